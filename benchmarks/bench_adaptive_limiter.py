@@ -0,0 +1,87 @@
+"""
+基准测试：固定并发 vs 自适应并发（AIMD）
+
+模拟服务按秒平摊执行 --rpm-limit / --tpm-limit 限流（超出返回 429 和 Retry-After），
+同时最多生成 --server-concurrency 个请求，超出的排队。用 batch_engine 发送 --requests 个请求，比较：
+1. 固定并发 N：模型使用 openai 客户端默认的重试（max_retries=2，遵守 Retry-After）
+2. AdaptiveLimiter（429 + 延迟）：worker 数为 --workers，实际并发由 AIMD 决定
+3. AdaptiveLimiter（+ RPM/TPM 预算）：另外按与服务端相同的预算在客户端平摊发送
+
+输出总耗时、成功请求的吞吐量、成功/失败数和服务端返回的 429 数。
+
+运行: python benchmarks/bench_adaptive_limiter.py --requests 600 --rpm-limit 1200
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.adaptive_limiter import AdaptiveLimiter, RateLimitedChatModel
+from common.batch_engine import abatch_as_completed
+from common.mock_server import MockServer
+from common.model_factory import get_chat_model
+
+OUTPUT_TOKENS = 20
+
+
+async def run(model, prompts: list[str], concurrency: int) -> dict:
+    start = time.perf_counter()
+    ok = failed = 0
+    async for _, result in abatch_as_completed(model, prompts, max_concurrency=concurrency, return_exceptions=True):
+        if isinstance(result, Exception):
+            failed += 1
+        else:
+            ok += 1
+    return {"elapsed": time.perf_counter() - start, "ok": ok, "failed": failed}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=600)
+    parser.add_argument("--rpm-limit", type=int, default=1200, help="服务端每分钟请求数上限")
+    parser.add_argument("--tpm-limit", type=int, default=60000, help="服务端每分钟 token 数上限")
+    parser.add_argument("--server-concurrency", type=int, default=16, help="服务端同时生成的请求数")
+    parser.add_argument("--workers", type=int, default=64, help="自适应方式的 worker 数")
+    args = parser.parse_args()
+
+    prompts = [f"第 {i} 个问题：为什么鹦鹉有五颜六色的羽毛？" for i in range(args.requests)]
+    variants = [(f"固定并发 {n}", n, None) for n in (4, 16, 64)] + [
+        ("AdaptiveLimiter（429 + 延迟）", args.workers, {}),
+        ("AdaptiveLimiter（+ RPM/TPM）", args.workers,
+         {"requests_per_minute": args.rpm_limit, "tokens_per_minute": args.tpm_limit}),
+    ]
+    print(f"{args.requests} 个请求，服务端限流 {args.rpm_limit} RPM / {args.tpm_limit} TPM（按秒平摊），"
+          f"同时生成 {args.server_concurrency} 个")
+    print(f"{'方式':<30}{'耗时 (s)':>9}{'req/s':>7}{'成功':>6}{'失败':>6}{'429':>6}  最终并发上限")
+    for name, concurrency, options in variants:
+        server = MockServer(
+            ttft=0.2, token_delay=0.01, output_tokens=OUTPUT_TOKENS, rpm_limit=args.rpm_limit,
+            tpm_limit=args.tpm_limit, max_concurrency=args.server_concurrency,
+        ).start()
+        try:
+            if options is None:
+                model = get_chat_model(base_url=server.base_url, api_key="mock", max_retries=2)
+            else:
+                limiter = AdaptiveLimiter(**options)
+                model = RateLimitedChatModel(
+                    model=get_chat_model(base_url=server.base_url, api_key="mock", max_retries=0),
+                    limiter=limiter,
+                    expected_output_tokens=OUTPUT_TOKENS,
+                )
+            time.sleep(1)  # 让令牌桶补满
+            result = asyncio.run(run(model, prompts, concurrency))
+        finally:
+            server.stop()
+        final = "-" if options is None else f"{limiter.limit}（最大在途 {limiter.stats.max_inflight}）"
+        print(
+            f"{name:<30}{result['elapsed']:>9.1f}{result['ok'] / result['elapsed']:>7.1f}{result['ok']:>6}"
+            f"{result['failed']:>6}{server.throttled:>6}  {final}"
+        )
+        if options is not None:
+            print(f"{'':<30}{limiter.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+基准测试：异步批处理引擎 vs 顺序 invoke vs model.batch()
+
+模拟服务在子进程中运行，对每个请求固定延迟 LATENCY 秒。
+顺序 invoke 太慢，只取前 SEQUENTIAL 个问题测吞吐量，其余方式处理全部 PROMPTS。
+运行: python benchmarks/bench_batch_engine.py
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.batch_engine import batch
+from common.mock_server import spawn_mock_server
+from common.model_factory import configure_pool, get_chat_model
+
+PROMPTS = [f"问题 {i}：什么是量子计算？" for i in range(500)]
+SEQUENTIAL = 20
+LATENCY = 0.2
+MAX_CONCURRENCY = 64
+
+
+def timed(name: str, prompts: list[str], fn) -> float:
+    start = time.perf_counter()
+    results = fn(prompts)
+    elapsed = time.perf_counter() - start
+    assert [r.content for r in results] == [f"模拟回复：{p}" for p in prompts], "结果顺序与输入不一致"
+    throughput = len(prompts) / elapsed
+    print(f"{name:<24} {len(prompts):4d} 个请求  耗时 {elapsed:6.2f} s   吞吐 {throughput:7.1f} req/s")
+    return throughput
+
+
+if __name__ == "__main__":
+    configure_pool(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY)
+    with spawn_mock_server(latency=LATENCY) as base_url:
+        model = get_chat_model(base_url=base_url, api_key="mock")
+        print(f"每个请求延迟 {LATENCY * 1000:.0f} ms\n")
+
+        sequential = timed("顺序 invoke", PROMPTS[:SEQUENTIAL], lambda ps: [model.invoke(p) for p in ps])
+        timed("model.batch (默认线程池)", PROMPTS, model.batch)
+        engine = timed(
+            f"异步引擎 (并发 {MAX_CONCURRENCY})",
+            PROMPTS,
+            lambda ps: batch(model, ps, max_concurrency=MAX_CONCURRENCY),
+        )
+
+    print(f"\n异步引擎相对顺序 invoke 提升 {engine / sequential:.1f}x")
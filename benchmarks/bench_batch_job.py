@@ -0,0 +1,107 @@
+"""
+基准测试：在线批量调用 vs Batch API 任务
+
+模拟服务按秒平摊执行 --rpm-limit 限流，Batch API 任务在 --batch-latency 秒内离线处理完。
+同样 --requests 个问题，比较：
+1. 在线调用：batch_engine 以 --concurrency 并发发送，经过 RateLimitedChatModel（AdaptiveLimiter）
+   控制并发和速率，遇到 429 时按 Retry-After 重试，保证全部请求完成后再比较费用
+2. BatchJob：上传输入文件、创建任务、轮询直到完成，再流式读取输出文件
+
+输出耗时、客户端发出的 HTTP 请求数、服务端返回的 429 数、成功的请求数、token 用量，以及按 --price 估算的
+费用和每个成功请求的平均费用（Batch API 按 --batch-discount 折扣计费）。最后检查按任务 ID 恢复（清空模型缓存、重新创建客户端）后，
+结果与输入一一对应。
+
+运行: python benchmarks/bench_batch_job.py --requests 500
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common import model_factory
+from common.adaptive_limiter import AdaptiveLimiter, RateLimitedChatModel
+from common.batch_engine import abatch
+from common.batch_job import BatchJob
+from common.mock_server import MockServer
+from common.model_factory import get_chat_model
+
+
+def cost(prompt_tokens: int, completion_tokens: int, price: tuple[float, float], discount: float = 1.0) -> float:
+    """按每百万 token 的输入、输出单价计算费用"""
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1e6 * discount
+
+
+def per_thousand(price: float, succeeded: int) -> float:
+    """每千个成功请求的费用，失败的请求不计入分母"""
+    return price / succeeded * 1000 if succeeded else float("nan")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32, help="在线调用的并发数")
+    parser.add_argument("--rpm-limit", type=int, default=3000, help="在线接口每分钟请求数上限")
+    parser.add_argument("--batch-latency", type=float, default=5.0, help="Batch API 任务的处理时长（秒）")
+    parser.add_argument("--price", type=float, nargs=2, default=(0.8, 2.0), help="每百万 token 的输入、输出单价（元）")
+    parser.add_argument("--batch-discount", type=float, default=0.5, help="Batch API 的计费折扣")
+    args = parser.parse_args()
+
+    prompts = [f"第 {i} 个问题：为什么鹦鹉有五颜六色的羽毛？" for i in range(args.requests)]
+    options = {"ttft": 0.1, "token_delay": 0.005, "rpm_limit": args.rpm_limit,
+               "batch_latency": args.batch_latency}
+    print(f"{args.requests} 个请求，在线接口限流 {args.rpm_limit} RPM，Batch API 处理时长 {args.batch_latency} 秒")
+    print(f"{'方式':<14}{'耗时 (s)':>9}{'HTTP 请求':>10}{'429':>6}{'成功':>6}{'输入 token':>11}{'输出 token':>11}"
+          f"{'费用 (元)':>10}{'每千次成功 (元)':>16}")
+    with MockServer(**options) as server:
+        model = get_chat_model(base_url=server.base_url, api_key="mock")
+        # 在线调用由限制器处理 429，openai 客户端不再自行重试
+        online = RateLimitedChatModel(
+            model=get_chat_model(base_url=server.base_url, api_key="mock", max_retries=0),
+            limiter=AdaptiveLimiter(initial_limit=args.concurrency, requests_per_minute=args.rpm_limit),
+        )
+
+        start = time.perf_counter()
+        responses = asyncio.run(abatch(online, prompts, max_concurrency=args.concurrency, return_exceptions=True))
+        elapsed = time.perf_counter() - start
+        usages = [r.usage_metadata for r in responses if not isinstance(r, Exception)]
+        prompt_tokens = sum(u["input_tokens"] for u in usages)
+        completion_tokens = sum(u["output_tokens"] for u in usages)
+        price = cost(prompt_tokens, completion_tokens, args.price)
+        print(f"{'在线调用':<14}{elapsed:>9.2f}{server.requests:>10}{server.throttled:>6}{len(usages):>6}"
+              f"{prompt_tokens:>11,}{completion_tokens:>11,}{price:>10.4f}{per_thousand(price, len(usages)):>16.4f}")
+        failed = sum(isinstance(r, Exception) for r in responses)
+        if failed:
+            print(f"{'':<14}其中 {failed} 个请求重试后仍然失败")
+
+        server.reset_stats()
+        start = time.perf_counter()
+        job = BatchJob.submit(model, prompts, poll_interval=0.5, max_poll_interval=2.0)
+        job.wait()
+        results = job.collect(return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        stats = job.stats
+        price = cost(stats.prompt_tokens, stats.completion_tokens, args.price, args.batch_discount)
+        print(f"{'BatchJob':<14}{elapsed:>9.2f}{server.requests:>10}{server.throttled:>6}{stats.succeeded:>6}"
+              f"{stats.prompt_tokens:>11,}{stats.completion_tokens:>11,}{price:>10.4f}"
+              f"{per_thousand(price, stats.succeeded):>16.4f}")
+        print(f"{'':<14}{stats}")
+        if any(not isinstance(a, Exception) and a.text != b.text for a, b in zip(responses, results)):
+            print(f"{'':<14}警告：BatchJob 的结果与在线调用不一致")
+
+        # 模拟进程重启：提交后只保留任务 ID，清空模型缓存和连接池后恢复
+        job_id = BatchJob.submit(model, prompts, poll_interval=0.5, max_poll_interval=2.0).id
+        model_factory.reset()
+        model = get_chat_model(base_url=server.base_url, api_key="mock")
+        resumed = BatchJob.resume(model, job_id, poll_interval=0.5, max_poll_interval=2.0)
+        print(f"\n恢复任务 {job_id}：当前状态 {resumed.status}")
+        results = resumed.collect(return_exceptions=True)
+        mismatched = sum(
+            isinstance(r, Exception) or not r.text.endswith(prompt) for r, prompt in zip(results, prompts)
+        )
+        print(f"恢复后取回 {len(results)} 个结果，与输入不对应 {mismatched} 个；{resumed.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+基准测试：单进程批处理 vs 多进程分片的 BulkPipeline，以及中断后续跑
+
+生成 --rows 行的 JSONL 提示文件（字符串、消息列表和带 id 的对象混合），模拟服务在子进程中运行。比较：
+1. 单进程：读入整个文件，用 batch_engine.abatch 以相同的总并发发送（相当于 model.batch 的做法）
+2. BulkPipeline：--workers 个工作进程，每个进程的并发为 总并发 / workers
+
+输出 rows/s、tokens/s 和各工作进程的统计。多进程的收益取决于 CPU 核数：单核机器上各进程争用同一个核，
+只能看到检查点和追加写的开销。
+
+最后在子进程中运行 BulkPipeline，处理到一半时用 SIGKILL 杀掉，再重新运行同一命令，
+检查输出文件中每一行输入恰好出现一次。
+
+运行: python benchmarks/bench_bulk_pipeline.py --rows 20000 --workers 1 2 4 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.batch_engine import abatch
+from common.bulk_pipeline import BulkPipeline
+from common.mock_server import spawn_mock_server
+from common.model_factory import get_chat_model
+from common.token_estimator import prompt_from_record
+
+PIPELINE_SCRIPT = Path(__file__).resolve().parents[1] / "common" / "bulk_pipeline.py"
+
+
+def write_prompts(path: str, rows: int) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(rows):
+            if i % 3 == 0:
+                record = f"第 {i} 个问题：为什么鹦鹉有五颜六色的羽毛？"
+            elif i % 3 == 1:
+                record = [{"role": "system", "content": "你是一个有帮助的助手。"}, {"role": "user", "content": f"第 {i} 个问题：飞机是如何飞行的？"}]
+            else:
+                record = {"id": f"row-{i}", "prompt": f"第 {i} 个问题：什么是量子计算？"}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def single_process(path: str, base_url: str, concurrency: int) -> tuple[float, int, int]:
+    """返回 (耗时, 行数, token 数)"""
+    model = get_chat_model(base_url=base_url, api_key="mock")
+    start = time.perf_counter()
+    with open(path, encoding="utf-8") as f:
+        prompts = [prompt_from_record(json.loads(line))[0] for line in f]
+    responses = asyncio.run(abatch(model, prompts, max_concurrency=concurrency))
+    with open(os.devnull, "w", encoding="utf-8") as out:
+        for response in responses:
+            out.write(json.dumps({"content": response.content, "usage": response.usage_metadata}, ensure_ascii=False) + "\n")
+    tokens = sum(response.usage_metadata["total_tokens"] for response in responses)
+    return time.perf_counter() - start, len(responses), tokens
+
+
+def check_output(path: str, rows: int) -> tuple[int, int]:
+    """返回 (重复的行数, 缺失的行数)"""
+    with open(path, encoding="utf-8") as f:
+        counts = Counter(json.loads(line)["offset"] for line in f if line.strip())
+    return sum(count - 1 for count in counts.values() if count > 1), rows - len(counts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=64, help="总并发数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory, spawn_mock_server(ttft=0.02, output_tokens=20) as base_url:
+        input_path = os.path.join(directory, "prompts.jsonl")
+        write_prompts(input_path, args.rows)
+        get_chat_model(base_url=base_url, api_key="mock").invoke("预热")
+        print(f"{args.rows} 行，总并发 {args.concurrency}，CPU 核数 {os.cpu_count()}")
+        print(f"{'方式':<24}{'耗时 (s)':>10}{'rows/s':>10}{'tokens/s':>12}")
+
+        elapsed, rows, tokens = single_process(input_path, base_url, args.concurrency)
+        print(f"{'单进程 abatch':<24}{elapsed:>10.2f}{rows / elapsed:>10.0f}{tokens / elapsed:>12.0f}")
+
+        for workers in args.workers:
+            output_path = os.path.join(directory, f"results-{workers}.jsonl")
+            pipeline = BulkPipeline(
+                input_path, output_path, workers=workers, concurrency=max(1, args.concurrency // workers),
+                base_url=base_url, api_key="mock", report_interval=0,
+            )
+            start = time.perf_counter()
+            results = pipeline.run()
+            elapsed = time.perf_counter() - start
+            rows = sum(result.rows for result in results)
+            tokens = sum(result.input_tokens + result.output_tokens for result in results)
+            print(f"{f'BulkPipeline × {workers}':<24}{elapsed:>10.2f}{rows / elapsed:>10.0f}{tokens / elapsed:>12.0f}")
+            for result in results:
+                print(f"{'':<4}{result}")
+
+        # 中断后续跑
+        output_path = os.path.join(directory, "results-resume.jsonl")
+        command = [
+            sys.executable, str(PIPELINE_SCRIPT), input_path, output_path, "--workers", str(max(args.workers)),
+            "--concurrency", str(max(1, args.concurrency // max(args.workers))), "--base-url", base_url,
+            "--api-key", "mock", "--checkpoint-interval", "0.5",
+        ]
+        proc = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        while not os.path.exists(output_path) or sum(1 for _ in open(output_path, "rb")) < args.rows // 2:
+            time.sleep(0.1)
+        os.killpg(proc.pid, signal.SIGKILL)  # 连同工作进程一起杀掉，不给写检查点的机会
+        proc.wait()
+        written = sum(1 for _ in open(output_path, "rb"))
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        duplicates, missing = check_output(output_path, args.rows)
+        print(f"\n中断后续跑：中断时已写出 {written} 行，续跑输出：")
+        print("\n".join(f"{'':<4}{line}" for line in output.strip().splitlines()))
+        print(f"检查：重复 {duplicates} 行，缺失 {missing} 行")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+基准测试：整份历史传给 model.invoke() vs Conversation 增量构建请求体
+
+模拟一段很长的多轮对话，每一轮追加一条用户消息并发送全部历史，回复追加到历史中。
+模拟服务运行在子进程中，time.process_time() 只统计客户端进程的 CPU 时间。
+按轮次分段输出每轮平均 CPU：model.invoke() 随历史长度线性增长，Conversation 基本保持不变。
+
+运行: python benchmarks/bench_conversation.py --turns 250
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.conversation import Conversation
+from common.mock_server import spawn_mock_server
+from common.model_factory import get_chat_model
+
+SYSTEM_PROMPT = "你是一个有帮助的编程助手。"
+
+
+def question(turn: int) -> str:
+    return f"第 {turn} 个问题：请解释 Python 中生成器和迭代器的区别，并给出示例。"
+
+
+def run_history_list(model, turns: int) -> list[float]:
+    history = [SystemMessage(SYSTEM_PROMPT)]
+    cpu = []
+    for turn in range(turns):
+        start = time.process_time()
+        history.append(HumanMessage(question(turn)))
+        history.append(model.invoke(history))
+        cpu.append(time.process_time() - start)
+    return cpu
+
+
+def run_conversation(model, turns: int) -> list[float]:
+    conversation = Conversation([SystemMessage(SYSTEM_PROMPT)])
+    cpu = []
+    for turn in range(turns):
+        start = time.process_time()
+        conversation.append(HumanMessage(question(turn)))
+        conversation.invoke(model)
+        cpu.append(time.process_time() - start)
+    return cpu
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=250)
+    parser.add_argument("--buckets", type=int, default=5, help="把轮次分成几段输出")
+    parser.add_argument("--output-tokens", type=int, default=200, help="每条回复的长度（字符）")
+    args = parser.parse_args()
+
+    with spawn_mock_server(output_tokens=args.output_tokens) as base_url:
+        model = get_chat_model(base_url=base_url, api_key="mock")
+        # 预热连接和导入
+        model.invoke("你好")
+
+        results = {
+            "model.invoke(history)": run_history_list(model, args.turns),
+            "Conversation.invoke": run_conversation(model, args.turns),
+        }
+
+    size = max(1, args.turns // args.buckets)
+    ranges = [(start, min(start + size, args.turns)) for start in range(0, args.turns, size)]
+    header = f"{'路径':<24}" + "".join(f"{f'{a + 1}-{b} 轮':>14}" for a, b in ranges) + f"{'总计':>10}"
+    print(f"{args.turns} 轮对话，每轮客户端 CPU 平均值 (ms)")
+    print(header)
+    for name, cpu in results.items():
+        cells = "".join(f"{sum(cpu[a:b]) / (b - a) * 1000:>14.2f}" for a, b in ranges)
+        print(f"{name:<24}{cells}{sum(cpu):>9.2f}s")
+
+
+if __name__ == "__main__":
+    main()
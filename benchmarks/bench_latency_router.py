@@ -0,0 +1,109 @@
+"""
+基准测试：按延迟路由和对冲请求对长尾延迟的影响
+
+三个模拟端点，每个都有 --slow-rate 比例的慢请求（额外等待 --slow-latency 秒）；
+第三个端点本身更慢，测试进行到一半时第一个端点整体变慢，模拟某个地域出现拥塞。
+以固定并发发送 --requests 个请求（ainvoke 或 astream），比较：
+1. 单个端点：只连接第一个端点，与各示例脚本的做法相同
+2. LatencyRouter（不对冲）：按 EWMA 选择最快的健康端点
+3. LatencyRouter（对冲）：超过首选端点 p95 仍未完成（stream 为未收到首块）时向下一个端点发出对冲请求
+
+输出 p50/p95/p99/最大延迟（stream 为首块时间）、上游请求数和各端点的分配情况。
+
+运行: python benchmarks/bench_latency_router.py --requests 600 --concurrency 16 --mode stream
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from bench_utils import percentile
+from common.latency_router import LatencyRouter
+from common.mock_server import MockServer
+from common.model_factory import get_chat_model
+
+# (名称, 首 token 延迟)
+ENDPOINTS = [("endpoint-a", 0.10), ("endpoint-b", 0.12), ("endpoint-c", 0.25)]
+
+
+async def measure(model, mode: str) -> float:
+    """invoke 返回总延迟，stream 返回首块时间（读完整个流）"""
+    start = time.perf_counter()
+    if mode == "invoke":
+        await model.ainvoke("为什么鹦鹉有五颜六色的羽毛？")
+        return time.perf_counter() - start
+    ttft = None
+    async for _ in model.astream("为什么鹦鹉有五颜六色的羽毛？"):
+        if ttft is None:
+            ttft = time.perf_counter() - start
+    return ttft
+
+
+async def run(model, servers: list[MockServer], args) -> list[float]:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    done = 0
+
+    async def one() -> None:
+        nonlocal done
+        async with semaphore:
+            latencies.append(await measure(model, args.mode))
+            done += 1
+            if done == args.requests // 2:
+                servers[0].latency = args.degraded_latency  # 第一个端点整体变慢
+
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=600)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mode", choices=["invoke", "stream"], default="stream")
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="每个端点的慢请求比例")
+    parser.add_argument("--slow-latency", type=float, default=1.5, help="慢请求的额外延迟（秒）")
+    parser.add_argument("--degraded-latency", type=float, default=0.4, help="第一个端点变慢后的额外延迟（秒）")
+    args = parser.parse_args()
+
+    variants = {
+        "单个端点": None,
+        "LatencyRouter（不对冲）": {"hedge": False},
+        "LatencyRouter（对冲）": {"hedge": True, "hedge_delay": 0.5},
+    }
+    print(f"{args.requests} 个 {args.mode} 请求，并发 {args.concurrency}，慢请求 {args.slow_rate:.0%} × {args.slow_latency} s，"
+          f"一半后 endpoint-a 增加 {args.degraded_latency} s")
+    metric = "TTFT" if args.mode == "stream" else "延迟"
+    print(f"{'方式':<26}{metric + ' p50':>10}{'p95':>8}{'p99':>8}{'最大':>8}{'上游请求':>9}  各端点胜出")
+    for name, options in variants.items():
+        servers = [
+            MockServer(ttft=ttft, token_delay=0.005, output_tokens=20, slow_rate=args.slow_rate,
+                       slow_latency=args.slow_latency, seed=i).start()
+            for i, (_, ttft) in enumerate(ENDPOINTS)
+        ]
+        try:
+            targets = [get_chat_model(base_url=server.base_url, api_key="mock", max_retries=0) for server in servers]
+            for target in targets:
+                target.invoke("预热")
+            model = targets[0] if options is None else LatencyRouter(
+                targets=targets, names=[label for label, _ in ENDPOINTS], **options
+            )
+            before = sum(server.requests for server in servers)
+            latencies = asyncio.run(run(model, servers, args))
+            upstream = sum(server.requests for server in servers) - before
+        finally:
+            for server in servers:
+                server.stop()
+        wins = "-" if options is None else ", ".join(f"{t.name} {t.wins}" for t in model.stats.targets)
+        print(
+            f"{name:<26}{percentile(latencies, 50) * 1000:>10.0f}{percentile(latencies, 95) * 1000:>8.0f}"
+            f"{percentile(latencies, 99) * 1000:>8.0f}{max(latencies) * 1000:>8.0f}{upstream:>9}  {wins}"
+        )
+        if options is not None:
+            print(f"{'':<26}对冲 {model.stats.hedged} 次（胜出 {model.stats.hedge_wins}），故障转移 {model.stats.failovers} 次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+基准测试：多轮对话中反复发送的图片，base64 字符串 vs MediaStore 延迟编码
+
+共 10 MB 的图片（默认 5 张 × 2 MB）在第一轮随问题发送，之后每一轮追加一个文字问题并发送全部历史，
+每 5 轮再引用一次其中的某张图片，共 20 轮。比较：
+1. model.invoke(history)：图片在第一轮编码为 base64 字符串放进 HumanMessage
+2. Conversation：同样的 base64 内容块，消息只转换和序列化一次
+3. MediaConversation：内容块只有占位符，发送时从 mmap 编码，编码结果放进 LRU
+4. MediaConversation（不缓存）：max_encoded_bytes=0，每次发送时从 mmap 按块重新编码
+
+每种方式在单独的子进程中运行，输出峰值 RSS（以及相对开始第一轮之前的增量）、每轮延迟和客户端 CPU。
+
+运行: python benchmarks/bench_media_store.py --turns 20 --images 5 --image-mb 2
+"""
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from bench_utils import percentile
+from common.conversation import Conversation
+from common.media_store import MediaConversation, MediaStore
+from common.mock_server import spawn_mock_server
+from common.model_factory import get_chat_model
+
+SYSTEM_PROMPT = "你是一个图片分析助手。"
+VARIANTS = ["model.invoke", "Conversation", "MediaConversation", "MediaConversation（不缓存）"]
+
+
+def turn_content(turn: int, paths: list[str], image_block) -> str | list:
+    """第 0 轮附上全部图片，之后每 5 轮再引用一张"""
+    if turn == 0:
+        return [{"type": "text", "text": "请描述这些图片。"}, *(image_block(path) for path in paths)]
+    if turn % 5 == 0:
+        path = paths[(turn // 5 - 1) % len(paths)]
+        return [{"type": "text", "text": f"第 {turn} 轮：再看一下这张图片。"}, image_block(path)]
+    return f"第 {turn} 轮：图片中还有哪些细节？"
+
+
+def eager_block(path: str) -> dict:
+    # 常见写法：读入文件，编码为 base64 字符串
+    with open(path, "rb") as f:
+        data = base64.b64encode(f.read()).decode("ascii")
+    return {"type": "image", "base64": data, "mime_type": "image/png"}
+
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux 下单位为 KB
+
+
+def run_variant(variant: str, base_url: str, paths: list[str], turns: int) -> dict:
+    model = get_chat_model(base_url=base_url, api_key="mock")
+    model.invoke("预热")
+    baseline = max_rss_mb()
+    latencies = []
+    start_cpu = time.process_time()
+    if variant == "model.invoke":
+        history = [SystemMessage(SYSTEM_PROMPT)]
+        for turn in range(turns):
+            start = time.perf_counter()
+            history.append(HumanMessage(turn_content(turn, paths, eager_block)))
+            history.append(model.invoke(history))
+            latencies.append(time.perf_counter() - start)
+    else:
+        if variant == "Conversation":
+            conversation = Conversation([SystemMessage(SYSTEM_PROMPT)])
+            image_block = eager_block
+        else:
+            store = MediaStore(max_encoded_bytes=0 if "不缓存" in variant else 64 * 2**20)
+            conversation = MediaConversation([SystemMessage(SYSTEM_PROMPT)], store=store)
+            image_block = store.block
+        for turn in range(turns):
+            start = time.perf_counter()
+            conversation.append(HumanMessage(turn_content(turn, paths, image_block)))
+            conversation.invoke(model)
+            latencies.append(time.perf_counter() - start)
+    return {
+        "baseline": baseline,
+        "peak": max_rss_mb(),
+        "cpu": time.process_time() - start_cpu,
+        "latencies": latencies,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--images", type=int, default=5)
+    parser.add_argument("--image-mb", type=float, default=2.0, help="每张图片的大小（MB）")
+    # 子进程内部使用
+    parser.add_argument("--variant", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--paths", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.base_url, args.paths, args.turns)))
+        return
+
+    with tempfile.TemporaryDirectory() as directory, spawn_mock_server() as base_url:
+        paths = []
+        for i in range(args.images):
+            path = os.path.join(directory, f"image_{i}.png")
+            with open(path, "wb") as f:
+                f.write(os.urandom(int(args.image_mb * 2**20)))  # 随机字节，与压缩过的图片一样无法再压缩
+            paths.append(path)
+        total = args.images * args.image_mb
+        print(f"{args.turns} 轮对话，{args.images} 张图片共 {total:.0f} MB")
+        print(f"{'方式':<30}{'峰值 RSS (MB)':>14}{'增量 (MB)':>11}{'p50 (ms)':>10}{'最后一轮 (ms)':>14}{'CPU (s)':>9}")
+        for variant in VARIANTS:
+            output = subprocess.run(
+                [sys.executable, __file__, "--variant", variant, "--base-url", base_url,
+                 "--turns", str(args.turns), "--paths", *paths],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            latencies = result["latencies"]
+            print(
+                f"{variant:<30}{result['peak']:>14.1f}{result['peak'] - result['baseline']:>11.1f}"
+                f"{percentile(latencies, 50) * 1000:>10.1f}{latencies[-1] * 1000:>14.1f}{result['cpu']:>9.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+基准测试：共享模型工厂 vs 每次新建模型
+
+对比两种方式重复调用 invoke 的延迟：
+1. 每次调用都新建模型和 httpx 客户端（相当于原来每个脚本/进程各自 init_chat_model）
+2. 通过 get_chat_model 获取缓存的模型实例，共享 keep-alive 连接池
+
+本地模拟服务用 connect_latency 模拟新连接的 TCP/TLS 握手往返。
+运行: python benchmarks/bench_model_factory.py
+"""
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from langchain.chat_models import init_chat_model
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.mock_server import MockServer
+from common.model_factory import get_chat_model, reset
+
+ROUNDS = 50
+PROMPT = "为什么鹦鹉有五颜六色的羽毛？"
+
+
+def run_fresh(server: MockServer) -> list[float]:
+    latencies = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        with httpx.Client() as http_client:
+            model = init_chat_model(
+                model="qwen-plus",
+                model_provider="openai",
+                base_url=server.base_url,
+                api_key="mock",
+                http_client=http_client,
+            )
+            model.invoke(PROMPT)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_shared(server: MockServer) -> list[float]:
+    latencies = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        model = get_chat_model(base_url=server.base_url, api_key="mock")
+        model.invoke(PROMPT)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name: str, latencies: list[float], connections: int) -> float:
+    mean = statistics.mean(latencies) * 1000
+    p50 = statistics.median(latencies) * 1000
+    print(f"{name:<12} 平均 {mean:7.2f} ms   p50 {p50:7.2f} ms   TCP 连接数 {connections}")
+    return mean
+
+
+if __name__ == "__main__":
+    with MockServer(latency=0.005, connect_latency=0.03) as server:
+        print(f"模拟服务: {server.base_url}，每种方式调用 {ROUNDS} 次\n")
+
+        fresh = report("每次新建", run_fresh(server), server.connections)
+        server.reset_stats()
+
+        reset()
+        shared = report("共享工厂", run_shared(server), server.connections)
+
+    print(f"\n每次调用节省 {fresh - shared:.2f} ms ({(1 - shared / fresh) * 100:.1f}%)")
@@ -0,0 +1,106 @@
+"""
+LangChain 调用路径与原生 openai 客户端的分阶段开销对比
+
+对应 foreword/ 中的两组示例：chat_with_openai.py / openai_stream.py 直接使用 openai 客户端，
+chat_with_langchain.py / langchain_stream.py 通过 ChatOpenAI 调用。
+两条路径针对同一个本地模拟服务各发送若干次普通请求和流式请求，
+用 StageProfiler 统计各阶段耗时，得出 LangChain 每次调用、每个块额外增加的客户端 CPU 时间。
+
+运行: python benchmarks/bench_overhead.py --requests 50 --folded overhead.folded
+      flamegraph.pl overhead.folded > overhead.svg   # 或把 overhead.folded 拖进 speedscope.app
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import httpx
+from langchain_openai import ChatOpenAI
+from openai import OpenAI
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.mock_server import spawn_mock_server
+from common.stage_profiler import StageProfiler, average_stages
+
+MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "你是谁？"},
+]
+STAGES = [
+    "message_conversion", "payload_build", "payload_serialization", "connect", "http_send", "first_byte",
+    "network_read", "response_parsing", "message_construction", "callbacks", "other",
+]
+
+
+def openai_invoke(client: OpenAI) -> int:
+    client.chat.completions.create(model="qwen-plus", messages=MESSAGES)
+    return 0
+
+
+def openai_stream(client: OpenAI) -> int:
+    completion = client.chat.completions.create(
+        model="qwen-plus", messages=MESSAGES, stream=True, stream_options={"include_usage": True}
+    )
+    return sum(1 for _ in completion)
+
+
+def langchain_invoke(model: ChatOpenAI) -> int:
+    model.invoke(MESSAGES)
+    return 0
+
+
+def langchain_stream(model: ChatOpenAI) -> int:
+    return sum(1 for _ in model.stream(MESSAGES))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LangChain 与原生 openai 客户端的分阶段开销对比")
+    parser.add_argument("--requests", type=int, default=50, help="每条路径的请求数")
+    parser.add_argument("--output-tokens", type=int, default=200, help="每个回复的 token 数（流式块数）")
+    parser.add_argument("--folded", help="把折叠栈写入该文件，用于生成火焰图")
+    args = parser.parse_args()
+
+    profiler = StageProfiler()
+    with spawn_mock_server(output_tokens=args.output_tokens) as base_url:
+        client = OpenAI(api_key="mock", base_url=base_url, http_client=httpx.Client())
+        model = ChatOpenAI(api_key="mock", base_url=base_url, model="qwen-plus",
+                           stream_usage=True, http_client=httpx.Client())
+        paths = [
+            ("openai.invoke", lambda: openai_invoke(client)),
+            ("langchain.invoke", lambda: langchain_invoke(model)),
+            ("openai.stream", lambda: openai_stream(client)),
+            ("langchain.stream", lambda: langchain_stream(model)),
+        ]
+        # 预热：建立连接、完成各模块的懒加载
+        for _, call in paths:
+            call()
+
+        with profiler.profile():
+            for label, call in paths:
+                for _ in range(args.requests):
+                    with profiler.request(label) as record:
+                        record.chunks = call()
+
+    by_label = {label: [r for r in profiler.requests if r.label == label] for label, _ in paths}
+    averages = {label: average_stages(records) for label, records in by_label.items()}
+
+    print(f"每条路径 {args.requests} 次请求的平均耗时 (ms)，流式回复 {args.output_tokens} tokens\n")
+    print(f"{'阶段':<24}" + "".join(f"{label:>18}" for label in by_label))
+    for stage in STAGES:
+        print(f"{stage:<24}" + "".join(f"{averages[label].get(stage, 0.0) * 1000:>18.3f}" for label in by_label))
+
+    def mean(label: str, attr: str) -> float:
+        records = by_label[label]
+        return sum(getattr(r, attr) for r in records) / len(records)
+
+    print(f"{'总耗时':<24}" + "".join(f"{mean(label, 'total') * 1000:>18.3f}" for label in by_label))
+    print(f"{'客户端 CPU':<24}" + "".join(f"{mean(label, 'cpu') * 1000:>18.3f}" for label in by_label))
+
+    per_call = mean("langchain.invoke", "cpu") - mean("openai.invoke", "cpu")
+    chunks = mean("langchain.stream", "chunks")
+    per_stream = mean("langchain.stream", "cpu") - mean("openai.stream", "cpu")
+    print(f"\nLangChain 额外开销: 每次调用 {per_call * 1000:.3f} ms，"
+          f"流式每个块 {(per_stream - per_call) / chunks * 1e6:.1f} µs（每次流式调用约 {chunks:.0f} 个块）")
+
+    if args.folded:
+        profiler.write_folded(args.folded)
+        print(f"折叠栈已写入 {args.folded}")
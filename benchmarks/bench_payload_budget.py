@@ -0,0 +1,139 @@
+"""
+基准测试：多模态请求发送前按预算缩小 vs 原样发送
+
+模拟服务按 --upload-bandwidth 模拟上传时间，请求体超过 --max-request-bytes 时返回 413。
+几种典型的请求（手机照片、多张照片、大 PDF + 照片），分别：
+1. 原样发送：base64 内联原始文件
+2. PayloadBudget：发送前缩小图片、提取 PDF 文本
+
+输出请求体大小、预估 token、首 token 时间（包含本地缩小的耗时）和是否被 413 拒绝。
+需要 Pillow 和 pypdf（pip install pillow pypdf）。
+
+运行: python benchmarks/bench_payload_budget.py --upload-bandwidth 5e6 --max-request-bytes 10e6
+"""
+import argparse
+import base64
+import io
+import sys
+import time
+from pathlib import Path
+
+import openai
+from langchain_core.messages import HumanMessage
+from PIL import Image
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.mock_server import spawn_mock_server
+from common.model_factory import get_chat_model
+from common.payload_budget import PayloadBudget
+
+
+def make_photo(width: int, height: int) -> bytes:
+    """类似手机照片的 JPEG：噪声纹理，高质量压缩，体积与真实照片相近"""
+    image = Image.effect_noise((width, height), 6).convert("RGB")
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=92)
+    return output.getvalue()
+
+
+def make_pdf(pages: int, padding: int) -> bytes:
+    """每页一行文字的 PDF，另带一个 padding 字节的二进制流，模拟扫描图片等占据体积的内容"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        stream = f"BT /F1 12 Tf 72 720 Td (Quarterly report, page {page + 1}: revenue grew 12 percent.) Tj ET".encode()
+        kids.append(f"{len(objects) + 1} 0 R")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects) + 2} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode()
+    objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (padding, bytes(range(256)) * (padding // 256)))
+    body = b"%PDF-1.4\n"
+    offsets = []
+    for number, content in enumerate(objects, 1):
+        offsets.append(len(body))
+        body += b"%d 0 obj\n%s\nendobj\n" % (number, content)
+    xref = len(body)
+    body += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    body += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    body += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF" % (len(objects) + 1, xref)
+    return body
+
+
+def image_block(data: bytes) -> dict:
+    return {"type": "image", "base64": base64.b64encode(data).decode("ascii"), "mime_type": "image/jpeg"}
+
+
+def pdf_block(data: bytes) -> dict:
+    return {
+        "type": "file",
+        "base64": base64.b64encode(data).decode("ascii"),
+        "mime_type": "application/pdf",
+        "extras": {"filename": "report.pdf"},
+    }
+
+
+def scenarios() -> dict[str, list]:
+    photo = make_photo(4032, 3024)
+    return {
+        "1 张手机照片": [HumanMessage(content=[{"type": "text", "text": "描述这张图片。"}, image_block(photo)])],
+        "3 张手机照片": [HumanMessage(content=[
+            {"type": "text", "text": "比较这三张图片。"}, *(image_block(photo) for _ in range(3)),
+        ])],
+        "PDF 4 MB + 照片": [HumanMessage(content=[
+            {"type": "text", "text": "根据报告解释图片中的趋势。"},
+            pdf_block(make_pdf(20, 4 * 2**20)),
+            image_block(photo),
+        ])],
+    }
+
+
+def first_token(model, messages) -> float | str:
+    """返回首个块的时间（秒），请求被拒绝时返回错误说明"""
+    start = time.perf_counter()
+    try:
+        for _ in model.stream(messages):
+            return time.perf_counter() - start
+    except openai.APIStatusError as e:
+        return f"HTTP {e.status_code}"
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--upload-bandwidth", type=float, default=5e6, help="模拟的上传带宽（字节/秒）")
+    parser.add_argument("--max-request-bytes", type=float, default=10e6, help="服务的请求体上限（字节）")
+    parser.add_argument("--max-bytes", type=float, default=4e6, help="PayloadBudget 的字节预算")
+    parser.add_argument("--max-tokens", type=int, default=None, help="PayloadBudget 的 token 预算")
+    args = parser.parse_args()
+
+    budget = PayloadBudget(max_bytes=int(args.max_bytes), max_tokens=args.max_tokens)
+    options = {"upload_bandwidth": args.upload_bandwidth, "max_request_bytes": int(args.max_request_bytes)}
+    with spawn_mock_server(**options) as base_url:
+        model = get_chat_model(base_url=base_url, api_key="mock", max_retries=0)
+        model.invoke("预热")
+        print(f"{'请求':<16}{'方式':<14}{'请求体 (MB)':>12}{'预估 tokens':>12}{'缩小 (ms)':>11}{'首 token':>12}")
+        for name, messages in scenarios().items():
+            size, tokens = budget.measure(messages)
+            ttft = first_token(model, messages)
+            shown = ttft if isinstance(ttft, str) else f"{ttft * 1000:.0f} ms"
+            print(f"{name:<16}{'原样发送':<14}{size / 1e6:>12.1f}{tokens:>12}{'-':>11}{shown:>12}")
+
+            start = time.perf_counter()
+            shrunk, report = budget.apply(messages)
+            elapsed = time.perf_counter() - start
+            ttft = first_token(model, shrunk)
+            shown = ttft if isinstance(ttft, str) else f"{(ttft + elapsed) * 1000:.0f} ms"
+            print(
+                f"{'':<16}{'PayloadBudget':<14}{report.bytes_after / 1e6:>12.1f}{report.tokens_after:>12}"
+                f"{elapsed * 1000:>11.0f}{shown:>12}"
+            )
+            for action in report.actions:
+                print(f"{'':<18}- {action.kind}: {action.detail}（{action.bytes_before / 1e6:.1f} → {action.bytes_after / 1e6:.2f} MB）")
+        print(f"\n{budget.stats}")
+
+
+if __name__ == "__main__":
+    main()
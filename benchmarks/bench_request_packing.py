@@ -0,0 +1,88 @@
+"""
+基准测试：打包抽取 vs 每条输入一次调用
+
+对 N 个电影名称抽取 Movie：
+1. 逐条：with_structured_output(Movie) 每个名称一次请求（通过 batch_engine 以相同并发发送）
+2. PackedExtractor：按 token 预算打包，每个包一次请求，无效条目单独重试
+
+模拟服务按消息字符数和 schema 大小计算 prompt_tokens，invalid_item_rate 控制打包结果中无效条目的比例。
+输出总耗时、吞吐量、请求数和每条记录的平均 token。
+
+运行: python benchmarks/bench_request_packing.py --records 500 --latency 0.3
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from pydantic import BaseModel, Field
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.batch_engine import abatch
+from common.mock_server import spawn_mock_server
+from common.model_factory import get_chat_model
+from common.request_packing import PackedExtractor
+
+INSTRUCTIONS = "根据电影名称，以 JSON 格式提供电影的详细信息，包括标题、年份、导演和评分。"
+
+
+class Movie(BaseModel):
+    """电影信息"""
+    title: str = Field(..., description="电影标题")
+    year: int = Field(..., description="上映年份")
+    director: str = Field(..., description="导演姓名")
+    rating: float = Field(..., description="电影评分(满分10分)")
+
+
+def one_per_item(model, titles: list[str], concurrency: int) -> tuple[float, int, int]:
+    """返回 (耗时, 成功条数, 总 token)"""
+    structured = model.with_structured_output(Movie, include_raw=True)
+    inputs = [[SystemMessage(INSTRUCTIONS), HumanMessage(title)] for title in titles]
+    start = time.perf_counter()
+    results = asyncio.run(abatch(structured, inputs, max_concurrency=concurrency))
+    elapsed = time.perf_counter() - start
+    tokens = sum(r["raw"].usage_metadata["total_tokens"] for r in results)
+    return elapsed, sum(r["parsed"] is not None for r in results), tokens
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.3, help="模拟服务每个请求的固定延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.001, help="模拟服务每个块的间隔（秒）")
+    parser.add_argument("--invalid-item-rate", type=float, default=0.02)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-prompt-tokens", type=int, default=2000)
+    args = parser.parse_args()
+
+    titles = [f"电影{i}号" for i in range(args.records)]
+    with spawn_mock_server(
+        latency=args.latency, token_delay=args.token_delay, invalid_item_rate=args.invalid_item_rate, seed=0
+    ) as base_url:
+        model = get_chat_model(base_url=base_url, api_key="mock")
+        baseline, baseline_ok, baseline_tokens = one_per_item(model, titles, args.concurrency)
+
+        extractor = PackedExtractor(
+            model, Movie, instructions=INSTRUCTIONS,
+            max_prompt_tokens=args.max_prompt_tokens, max_concurrency=args.concurrency,
+        )
+        start = time.perf_counter()
+        results = extractor.extract(titles)
+        packed = time.perf_counter() - start
+
+    stats = extractor.stats
+    packed_ok = sum(r is not None for r in results)
+    print(f"{args.records} 条记录，并发 {args.concurrency}，每个请求延迟 {args.latency}s")
+    print(f"{'方式':<16}{'耗时 (s)':>10}{'条/s':>10}{'请求数':>8}{'成功':>8}{'token/条':>10}")
+    print(f"{'逐条调用':<16}{baseline:>10.2f}{args.records / baseline:>10.1f}{args.records:>10}{baseline_ok:>8}"
+          f"{baseline_tokens / args.records:>10.1f}")
+    print(f"{'PackedExtractor':<16}{packed:>10.2f}{args.records / packed:>10.1f}{stats.requests:>10}{packed_ok:>8}"
+          f"{stats.tokens_per_record:>10.1f}")
+    print(f"  打包请求 {stats.packed_requests} 个（平均每个 {stats.packed_records / stats.packed_requests:.1f} 条），"
+          f"单独重试 {stats.retries} 条，最终失败 {stats.failures} 条")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+基准测试：相同请求的并发合并
+
+模拟热门问题：N 个用户在很短的时间内发出同样的问题（到达时间在 --spread 秒内均匀分布），
+另有一部分用户问不同的问题。分别用线程（invoke / stream）和 asyncio（ainvoke / astream）发送，比较：
+1. 直接调用模型：每个调用都是一次上游请求
+2. CoalescingChatModel：进行中的相同请求只发出一次，晚到的流订阅者补发已收到的块
+
+输出模拟服务收到的请求数、省下的请求数、p50/p99 延迟，并检查合并后的流与上游的块序列一致。
+
+运行: python benchmarks/bench_singleflight.py --users 200 --distinct 10
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from bench_utils import percentile
+from common.mock_server import MockServer
+from common.model_factory import get_chat_model
+from common.singleflight import CoalescingChatModel
+
+HOT_QUESTION = "为什么鹦鹉有五颜六色的羽毛？"
+
+
+def questions(users: int, distinct: int, seed: int = 0) -> list[str]:
+    """大部分用户问同一个热门问题，其余用户在 distinct 个其他问题中随机选择"""
+    rng = random.Random(seed)
+    others = [f"第 {i} 个冷门问题：天空为什么是蓝色的？" for i in range(distinct)]
+    return [HOT_QUESTION if rng.random() < 0.7 else rng.choice(others) for _ in range(users)]
+
+
+def call_sync(model, question: str, delay: float, mode: str) -> tuple[float, str]:
+    time.sleep(delay)
+    start = time.perf_counter()
+    if mode == "invoke":
+        text = model.invoke(question).text
+    else:
+        text = "".join(chunk.text for chunk in model.stream(question))
+    return time.perf_counter() - start, text
+
+
+async def call_async(model, question: str, delay: float, mode: str) -> tuple[float, str]:
+    await asyncio.sleep(delay)
+    start = time.perf_counter()
+    if mode == "invoke":
+        text = (await model.ainvoke(question)).text
+    else:
+        text = "".join([chunk.text async for chunk in model.astream(question)])
+    return time.perf_counter() - start, text
+
+
+def run(model, server: MockServer, qs: list[str], spread: float, mode: str, use_async: bool) -> dict:
+    delays = [i * spread / len(qs) for i in range(len(qs))]
+    before = server.requests
+    start = time.perf_counter()
+    if use_async:
+        async def main() -> list:
+            return await asyncio.gather(*(call_async(model, q, d, mode) for q, d in zip(qs, delays)))
+        results = asyncio.run(main())
+    else:
+        with ThreadPoolExecutor(max_workers=len(qs)) as pool:
+            results = list(pool.map(lambda args: call_sync(model, *args, mode), zip(qs, delays)))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency, _ in results]
+    return {
+        "requests": server.requests - before,
+        "elapsed": elapsed,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "texts": [text for _, text in results],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="并发用户数")
+    parser.add_argument("--distinct", type=int, default=10, help="冷门问题的数量")
+    parser.add_argument("--spread", type=float, default=0.5, help="用户到达时间的分布范围（秒）")
+    parser.add_argument("--ttft", type=float, default=0.3, help="模拟服务的首 token 延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="模拟服务的 token 间隔（秒）")
+    parser.add_argument("--output-tokens", type=int, default=50, help="每个回复的 token 数")
+    args = parser.parse_args()
+
+    qs = questions(args.users, args.distinct)
+    print(f"{args.users} 个用户，{qs.count(HOT_QUESTION)} 个问热门问题，到达时间分布在 {args.spread} 秒内")
+    options = {"ttft": args.ttft, "token_delay": args.token_delay, "output_tokens": args.output_tokens}
+    with MockServer(**options) as server:
+        plain = get_chat_model(base_url=server.base_url, api_key="mock")
+        plain.invoke("预热")
+        print(f"{'调用方式':<20}{'方式':<22}{'上游请求':>9}{'省下':>7}{'p50 (ms)':>10}{'p99 (ms)':>10}{'总耗时 (s)':>11}")
+        for use_async in (False, True):
+            for mode in ("invoke", "stream"):
+                label = ("a" if use_async else "") + mode + ("（asyncio）" if use_async else "（线程）")
+                baseline = None
+                for name in ("直接调用", "CoalescingChatModel"):
+                    model = plain if name == "直接调用" else CoalescingChatModel(model=plain)
+                    result = run(model, server, qs, args.spread, mode, use_async)
+                    saved = len(qs) - result["requests"]
+                    print(
+                        f"{label:<20}{name:<22}{result['requests']:>9}{saved:>7}"
+                        f"{result['p50'] * 1000:>10.0f}{result['p99'] * 1000:>10.0f}{result['elapsed']:>11.2f}"
+                    )
+                    if baseline is None:
+                        baseline = result["texts"]
+                    elif result["texts"] != baseline:
+                        print(f"{'':<20}警告：合并后的结果与直接调用不一致")
+                    if name != "直接调用":
+                        print(f"{'':<20}{model.stats}")
+
+
+if __name__ == "__main__":
+    main()
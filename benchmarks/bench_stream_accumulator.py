@@ -0,0 +1,76 @@
+"""
+基准测试：`full + chunk` 逐块合并 vs StreamAccumulator
+
+使用合成的流（不访问网络），分别测试纯文本流和工具调用参数流的合并耗时。
+工具调用流每次相加都要重新解析累积的参数 JSON，`full + chunk` 的方式需要运行约十秒。
+运行: python benchmarks/bench_stream_accumulator.py
+"""
+import sys
+import time
+from pathlib import Path
+
+from langchain_core.messages import AIMessageChunk
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.stream_accumulator import StreamAccumulator
+
+CHUNKS = 10_000
+
+
+def text_stream() -> list[AIMessageChunk]:
+    chunks = [AIMessageChunk(content="天空是蓝色的，", id="chatcmpl-bench") for _ in range(CHUNKS - 1)]
+    chunks.append(
+        AIMessageChunk(
+            content="",
+            response_metadata={"finish_reason": "stop"},
+            usage_metadata={"input_tokens": 10, "output_tokens": CHUNKS, "total_tokens": CHUNKS + 10},
+        )
+    )
+    return chunks
+
+
+def tool_call_stream() -> list[AIMessageChunk]:
+    chunks = [
+        AIMessageChunk(
+            content="",
+            tool_call_chunks=[{"index": 0, "id": "call_1", "name": "get_weather", "args": '{"location": "'}],
+        )
+    ]
+    chunks += [
+        AIMessageChunk(content="", tool_call_chunks=[{"index": 0, "id": None, "name": None, "args": "北"}])
+        for _ in range(CHUNKS - 2)
+    ]
+    chunks.append(AIMessageChunk(content="", tool_call_chunks=[{"index": 0, "id": None, "name": None, "args": '"}'}]))
+    return chunks
+
+
+def merge_with_add(chunks):
+    full = None
+    for chunk in chunks:
+        full = chunk if full is None else full + chunk
+    return full
+
+
+def merge_with_accumulator(chunks):
+    return StreamAccumulator().consume(chunks)
+
+
+def measure(fn, chunks) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = fn(chunks)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    for name, make_stream in [("文本流", text_stream), ("工具调用流", tool_call_stream)]:
+        chunks = make_stream()
+        add_time, expected = measure(merge_with_add, chunks)
+        acc_time, result = measure(merge_with_accumulator, chunks)
+        assert result.content == expected.content
+        assert result.tool_calls == expected.tool_calls
+        assert result.usage_metadata == expected.usage_metadata
+
+        print(f"{name}（{CHUNKS} 个块）")
+        print(f"  full + chunk       耗时 {add_time * 1000:9.1f} ms")
+        print(f"  StreamAccumulator  耗时 {acc_time * 1000:9.1f} ms")
+        print(f"  加速 {add_time / acc_time:.1f}x\n")
@@ -0,0 +1,124 @@
+"""
+基准测试：逐块下发 vs 合并成帧下发
+
+模拟服务在子进程中运行（避免与客户端争用 GIL）。同时发起 --streams 个流式请求，每个回复 --output-tokens 个 token，
+每收到一帧就"发送"给下游：序列化成 JSON 并写入 /dev/null（一次系统调用，代替 websocket 帧）。比较：
+1. 逐块下发：每个 AIMessageChunk 一帧
+2. acoalesce / coalesce：按 --intervals 中的时间窗口合并
+
+输出帧数、每秒帧数、客户端进程的 CPU 时间（其中下发帧所用的时间单独列出）、首帧延迟 p50/p99，
+并检查合并后的帧拼接出的文本与逐块下发一致。--sync 时改用线程和同步流。
+
+运行: python benchmarks/bench_stream_coalescer.py --streams 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from bench_utils import percentile
+from common.mock_server import spawn_mock_server
+from common.model_factory import configure_pool, get_chat_model
+from common.stream_coalescer import acoalesce, coalesce
+
+
+class Sink:
+    """模拟下游连接：每帧序列化后一次 write 系统调用，按线程 CPU 时间统计开销"""
+
+    def __init__(self):
+        self.fd = os.open(os.devnull, os.O_WRONLY)
+        self.frames = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def send(self, text: str) -> None:
+        start = time.thread_time()
+        os.write(self.fd, json.dumps({"type": "delta", "content": text}, ensure_ascii=False).encode("utf-8"))
+        elapsed = time.thread_time() - start
+        with self._lock:
+            self.frames += 1
+            self.seconds += elapsed
+
+
+async def run_async(model, streams: int, interval: float | None, sink: Sink) -> list[tuple[float, str]]:
+    async def one(i: int) -> tuple[float, str]:
+        start = time.perf_counter()
+        ttft, parts = None, []
+        source = model.astream(f"第 {i} 个问题：为什么鹦鹉有五颜六色的羽毛？")
+        frames = source if interval is None else acoalesce(source, interval=interval)
+        async for frame in frames:
+            if ttft is None and frame.content:
+                ttft = time.perf_counter() - start
+            parts.append(frame.content)
+            sink.send(frame.content)
+        return ttft, "".join(parts)
+
+    return await asyncio.gather(*(one(i) for i in range(streams)))
+
+
+def run_sync(model, streams: int, interval: float | None, sink: Sink) -> list[tuple[float, str]]:
+    def one(i: int) -> tuple[float, str]:
+        start = time.perf_counter()
+        ttft, parts = None, []
+        source = model.stream(f"第 {i} 个问题：为什么鹦鹉有五颜六色的羽毛？")
+        frames = source if interval is None else coalesce(source, interval=interval)
+        for frame in frames:
+            if ttft is None and frame.content:
+                ttft = time.perf_counter() - start
+            parts.append(frame.content)
+            sink.send(frame.content)
+        return ttft, "".join(parts)
+
+    with ThreadPoolExecutor(max_workers=streams) as pool:
+        return list(pool.map(one, range(streams)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=1000, help="并发流数")
+    parser.add_argument("--output-tokens", type=int, default=100, help="每个回复的 token 数")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="模拟服务的 token 间隔（秒）")
+    parser.add_argument("--intervals", type=float, nargs="+", default=[0.03, 0.1], help="合并的时间窗口（秒）")
+    parser.add_argument("--sync", action="store_true", help="使用线程和同步流")
+    args = parser.parse_args()
+
+    configure_pool(max_connections=args.streams, max_keepalive_connections=args.streams, timeout=300)
+    options = {"ttft": 0.2, "token_delay": args.token_delay, "output_tokens": args.output_tokens}
+    mode = "线程 + stream" if args.sync else "asyncio + astream"
+    print(f"{args.streams} 个并发流（{mode}），每个 {args.output_tokens} 个 token，token 间隔 {args.token_delay * 1000:.0f}ms")
+    print(f"{'方式':<16}{'帧数':>9}{'帧/秒':>9}{'耗时 (s)':>9}{'CPU (s)':>9}{'下发 (s)':>9}"
+          f"{'首帧 p50 (ms)':>14}{'首帧 p99 (ms)':>14}")
+    with spawn_mock_server(**options) as base_url:
+        model = get_chat_model(base_url=base_url, api_key="mock")
+        model.invoke("预热")
+        baseline = None
+        for interval in [None, *args.intervals]:
+            sink = Sink()
+            cpu, start = time.process_time(), time.perf_counter()
+            if args.sync:
+                results = run_sync(model, args.streams, interval, sink)
+            else:
+                results = asyncio.run(run_async(model, args.streams, interval, sink))
+            elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+            os.close(sink.fd)
+            ttfts = [ttft for ttft, _ in results if ttft is not None]
+            name = "逐块下发" if interval is None else f"合并 {interval * 1000:.0f}ms"
+            print(
+                f"{name:<16}{sink.frames:>9,}{sink.frames / elapsed:>9,.0f}{elapsed:>9.2f}{cpu:>9.2f}{sink.seconds:>9.2f}"
+                f"{percentile(ttfts, 50) * 1000:>14.0f}{percentile(ttfts, 99) * 1000:>14.0f}"
+            )
+            texts = [text for _, text in results]
+            if baseline is None:
+                baseline = texts
+            elif texts != baseline:
+                print(f"{'':<16}警告：合并后的文本与逐块下发不一致")
+
+
+if __name__ == "__main__":
+    main()
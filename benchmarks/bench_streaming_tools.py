@@ -0,0 +1,84 @@
+"""
+基准测试：等 invoke 返回后再执行工具 vs 流式接收时参数一完整就执行
+
+模拟服务以较慢的 token 速率流式输出多个工具调用，工具本身有固定延迟。
+两种方式都用 ToolExecutor 执行工具，并把全部结果在一次后续调用中发回模型：
+- invoke_with_tools：整个响应返回后才开始执行工具
+- stream_with_tools：每个调用的参数 JSON 一完整就开始执行，与后续调用的生成重叠
+
+工具结果就绪的时间，前者是 "响应结束 + 最慢的工具"，后者是 "各调用完成时刻 + 各自耗时" 的最大值。
+所以工具能完全并发且耗时相同时两者差不多；早出现的调用更慢、或工具后端的并发受限时，
+提前执行能节省大部分等待。这里分三种场景分别统计。
+
+运行: python benchmarks/bench_streaming_tools.py --calls 4 --token-delay 0.05 --tool-latency 0.3
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from langchain_core.tools import tool
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.mock_server import spawn_mock_server
+from common.model_factory import get_chat_model
+from common.streaming_tools import stream_with_tools
+from common.tool_executor import ToolExecutor, invoke_with_tools
+
+QUESTION = "北京、上海、广州和巴黎的天气怎么样？"
+# 模拟服务按这个顺序轮换城市
+CITIES = ["北京", "上海", "广州", "巴黎"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=4, help="每次响应中的工具调用数")
+    parser.add_argument("--token-delay", type=float, default=0.05, help="模拟服务每个 token 的间隔（秒）")
+    parser.add_argument("--tool-latency", type=float, default=0.3, help="每个工具的耗时（秒）")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    finished: list[float] = []
+    latencies: dict[str, float] = {}
+
+    @tool
+    def get_weather(location: str) -> str:
+        """获取某个位置的天气。"""
+        time.sleep(latencies.get(location, args.tool_latency))
+        finished.append(time.perf_counter())
+        return f"{location}：晴天，22°C"
+
+    scenarios = [
+        ("工具完全并发，耗时相同", None, {}),
+        ("工具后端一次只处理一个请求", 1, {}),
+        ("第一个调用耗时 3 倍", None, {CITIES[0]: args.tool_latency * 3}),
+    ]
+
+    # 后续调用的回答很短，避免它的流式耗时掩盖差异
+    with spawn_mock_server(token_delay=args.token_delay, tool_call_count=args.calls, output_tokens=5) as base_url:
+        model = get_chat_model(base_url=base_url, api_key="mock").bind_tools([get_weather])
+        model.invoke("你好")  # 预热连接
+
+        print(f"{args.calls} 个工具调用，token 间隔 {args.token_delay}s，工具耗时 {args.tool_latency}s")
+        print(f"{'场景':<24}{'路径':<20}{'工具结果就绪':>12}{'端到端':>12}")
+        for title, max_workers, overrides in scenarios:
+            latencies.clear()
+            latencies.update(overrides)
+            totals = {}
+            with ToolExecutor([get_weather], max_workers=max_workers) as executor:
+                for name, path in [("invoke_with_tools", invoke_with_tools), ("stream_with_tools", stream_with_tools)]:
+                    ready = total = 0.0
+                    for _ in range(args.rounds):
+                        finished.clear()
+                        start = time.perf_counter()
+                        path(model, QUESTION, executor)
+                        ready += max(finished) - start
+                        total += time.perf_counter() - start
+                    totals[name] = total / args.rounds
+                    print(f"{title:<24}{name:<20}{ready / args.rounds * 1000:>10.0f} ms{totals[name] * 1000:>10.0f} ms")
+            saved = totals["invoke_with_tools"] - totals["stream_with_tools"]
+            print(f"{'':<24}端到端节省 {saved * 1000:.0f} ms ({saved / totals['invoke_with_tools']:.0%})")
+
+
+if __name__ == "__main__":
+    main()
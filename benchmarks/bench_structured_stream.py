@@ -0,0 +1,78 @@
+"""
+基准测试：流式结构化输出
+
+schema 有 N 个字符串字段（模拟大 schema），模拟服务按 4 个字符一块流式返回 JSON。比较：
+1. with_structured_output(schema).invoke()：json_schema 方式，完整返回后才有结果
+2. with_structured_output(schema, method="function_calling").stream()：LangChain 自带的中间结果，
+   每个块重新解析累计的全部参数
+3. stream_structured(model, schema, ...)：增量解析
+
+输出每种方式的客户端 CPU 时间（每个块）和拿到第一个结果的时间，并以只接收不解析的 model.stream()
+作为基线：stream_structured 与基线的差就是增量解析的开销，不随字段数增长。
+
+运行: python benchmarks/bench_structured_stream.py --fields 20 100 400
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from pydantic import BaseModel, Field, create_model
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.mock_server import spawn_mock_server
+from common.model_factory import get_chat_model
+from common.structured_stream import stream_structured
+
+PROMPT = "请以 JSON 格式提供电影《盗梦空间》的详细信息"
+
+
+def make_schema(fields: int) -> type[BaseModel]:
+    definitions = {f"field_{i}": (str, Field(..., description=f"第 {i} 个属性")) for i in range(fields)}
+    return create_model("MovieDetails", __doc__="电影的详细信息", **definitions)
+
+
+def measure(stream_fn) -> tuple[float, float, int]:
+    """返回 (CPU 秒数, 拿到第一个结果的秒数, 块数)"""
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    first = None
+    chunks = 0
+    for _ in stream_fn():
+        if first is None:
+            first = time.perf_counter() - start_wall
+        chunks += 1
+    return time.process_time() - start_cpu, first, chunks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fields", type=int, nargs="+", default=[20, 100, 400])
+    parser.add_argument("--token-delay", type=float, default=0.001, help="模拟服务每个块的间隔（秒）")
+    args = parser.parse_args()
+
+    with spawn_mock_server(token_delay=args.token_delay) as base_url:
+        model = get_chat_model(base_url=base_url, api_key="mock")
+        print(f"{'字段数':>6}{'块数':>7}  {'方式':<32}{'CPU/块 (µs)':>12}{'CPU 合计 (ms)':>14}{'首个结果 (ms)':>14}")
+        for fields in args.fields:
+            schema = make_schema(fields)
+            structured = model.with_structured_output(schema)
+            partial = model.with_structured_output(schema, method="function_calling")
+            # 与 json_schema 方式相同的请求，只接收块
+            raw = model.bind(response_format=structured.first.kwargs["response_format"])
+            ways = {
+                "model.stream（不解析，基线）": lambda: raw.stream(PROMPT),
+                "with_structured_output.invoke": lambda: [structured.invoke(PROMPT)],
+                "function_calling.stream": lambda: partial.stream(PROMPT),
+                "stream_structured": lambda: stream_structured(model, schema, PROMPT),
+            }
+            # 各种方式收到的块数相同（模拟服务按 4 个字符切分 JSON）
+            _, _, chunks = measure(ways["model.stream（不解析，基线）"])
+            for name, fn in ways.items():
+                measure(fn)  # 预热
+                cpu, first, _ = measure(fn)
+                print(f"{fields:>8}{chunks:>9}  {name:<32}{cpu / chunks * 1e6:>12.1f}{cpu * 1000:>14.1f}{first * 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+基准测试套件：models/ 和 messages/ 中各调用路径的延迟与吞吐量
+
+针对本地模拟服务（子进程）依次测量 invoke、stream、batch、with_structured_output 和 bind_tools，
+输出 p50/p95/p99 延迟、首 token 延迟 (TTFT)、tokens/sec 和 requests/sec。
+可以作为回归基线：修改公共模块后重新运行，对比各项指标。
+
+运行: python benchmarks/bench_suite.py --requests 100 --ttft 0.05 --token-delay 0.005
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from pydantic import BaseModel, Field
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from bench_utils import PathResult, print_table
+from common.batch_engine import batch
+from common.mock_server import spawn_mock_server
+from common.model_factory import get_chat_model
+
+
+class Movie(BaseModel):
+    """电影信息"""
+    title: str = Field(..., description="电影标题")
+    year: int = Field(..., description="上映年份")
+    director: str = Field(..., description="导演姓名")
+    rating: float = Field(..., description="电影评分(满分10分)")
+
+
+def get_weather(location: str) -> str:
+    """获取某个位置的天气。"""
+    return f"{location}：晴天，22°C"
+
+
+def output_tokens(message) -> int:
+    usage = getattr(message, "usage_metadata", None)
+    return usage["output_tokens"] if usage else 0
+
+
+def run_invoke(name: str, runnable, prompts: list[str], tokens_of=output_tokens) -> PathResult:
+    result = PathResult(name, 0.0, requests=len(prompts))
+    start = time.perf_counter()
+    for prompt in prompts:
+        t0 = time.perf_counter()
+        response = runnable.invoke(prompt)
+        result.latencies.append(time.perf_counter() - t0)
+        result.output_tokens += tokens_of(response)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def run_stream(name: str, model, prompts: list[str]) -> PathResult:
+    result = PathResult(name, 0.0, requests=len(prompts))
+    start = time.perf_counter()
+    for prompt in prompts:
+        t0 = time.perf_counter()
+        first = None
+        for chunk in model.stream(prompt):
+            if first is None and (chunk.content or chunk.tool_call_chunks):
+                first = time.perf_counter() - t0
+            result.output_tokens += output_tokens(chunk)
+        result.latencies.append(time.perf_counter() - t0)
+        result.ttfts.append(first if first is not None else result.latencies[-1])
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def run_batch(name: str, fn, prompts: list[str]) -> PathResult:
+    start = time.perf_counter()
+    responses = fn(prompts)
+    elapsed = time.perf_counter() - start
+    return PathResult(name, elapsed, requests=len(prompts), output_tokens=sum(map(output_tokens, responses)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50, help="每条路径的请求数")
+    parser.add_argument("--concurrency", type=int, default=16, help="批处理的并发数")
+    parser.add_argument("--ttft", type=float, default=0.02)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--output-tokens", type=int, default=50)
+    args = parser.parse_args()
+
+    prompts = [f"问题 {i}：什么是机器学习？" for i in range(args.requests)]
+    with spawn_mock_server(ttft=args.ttft, token_delay=args.token_delay, output_tokens=args.output_tokens) as base_url:
+        model = get_chat_model(base_url=base_url, api_key="mock", stream_usage=True)
+        structured = model.with_structured_output(Movie, include_raw=True)
+        with_tools = model.bind_tools([get_weather])
+
+        # 预热：建立连接、初始化客户端
+        model.invoke("你好")
+
+        results = [
+            run_invoke("invoke", model, prompts),
+            run_stream("stream", model, prompts),
+            run_batch("model.batch", lambda ps: model.batch(ps, config={"max_concurrency": args.concurrency}), prompts),
+            run_batch("batch_engine.batch", lambda ps: batch(model, ps, max_concurrency=args.concurrency), prompts),
+            run_invoke("with_structured_output", structured, prompts, lambda r: output_tokens(r["raw"])),
+            run_invoke("bind_tools", with_tools, prompts),
+            run_stream("bind_tools + stream", with_tools, prompts),
+        ]
+
+    print(f"模拟服务: TTFT {args.ttft * 1000:.0f} ms，token 间隔 {args.token_delay * 1000:.1f} ms，"
+          f"文本回复 {args.output_tokens} tokens\n")
+    print_table(results)
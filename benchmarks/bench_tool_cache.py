@@ -0,0 +1,85 @@
+"""
+基准测试：ToolCache 对重复工具调用的效果
+
+模拟多个用户的对话，每轮模型返回若干个 get_weather 调用，城市按热度分布（少数热门城市占大部分查询），
+同一轮中也可能重复查询同一个城市。用 ToolExecutor 执行每一轮的调用，比较不缓存和缓存时的总耗时，
+并打印缓存统计的命中率和省下的工具耗时。
+
+运行: python benchmarks/bench_tool_cache.py --turns 50 --tool-latency 0.05
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+from langchain_core.messages import AIMessage
+from langchain_core.tools import tool
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.tool_cache import ToolCache
+from common.tool_executor import ToolExecutor
+
+CITIES = ["北京", "上海", "广州", "深圳", "杭州", "成都", "武汉", "西安", "南京", "重庆",
+          "巴黎", "伦敦", "东京", "纽约", "悉尼", "柏林", "罗马", "首尔", "新加坡", "迪拜"]
+
+
+def make_tool(latency: float):
+    @tool
+    def get_weather(location: str) -> str:
+        """获取某个位置的天气。"""
+        time.sleep(latency)
+        return f"{location}：晴天，22°C"
+
+    return get_weather
+
+
+def make_turns(turns: int, calls: int, seed: int) -> list[AIMessage]:
+    """城市按 1/rank 的权重抽取"""
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, len(CITIES) + 1)]
+    messages = []
+    for turn in range(turns):
+        cities = rng.choices(CITIES, weights, k=calls)
+        tool_calls = [
+            {"name": "get_weather", "args": {"location": city}, "id": f"call_{turn}_{i}"}
+            for i, city in enumerate(cities)
+        ]
+        messages.append(AIMessage("", tool_calls=tool_calls))
+    return messages
+
+
+def run(executor: ToolExecutor, turns: list[AIMessage]) -> float:
+    start = time.perf_counter()
+    for message in turns:
+        executor.run(message)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=50, help="对话轮数（所有用户合计）")
+    parser.add_argument("--calls", type=int, default=3, help="每轮的工具调用数")
+    parser.add_argument("--tool-latency", type=float, default=0.05, help="每次工具调用的耗时（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    turns = make_turns(args.turns, args.calls, args.seed)
+    get_weather = make_tool(args.tool_latency)
+    cache = ToolCache(maxsize=1024)
+    cached_weather = cache.wrap(get_weather, ttl=600)
+
+    with ToolExecutor([get_weather]) as plain, ToolExecutor([cached_weather]) as cached:
+        baseline = run(plain, turns)
+        elapsed = run(cached, turns)
+
+    stats = cache.stats
+    print(f"{args.turns} 轮，每轮 {args.calls} 个调用，工具耗时 {args.tool_latency}s")
+    print(f"  {'不缓存':<12}{baseline * 1000:>8.0f} ms")
+    print(f"  {'ToolCache':<12}{elapsed * 1000:>8.0f} ms  ({baseline / elapsed:.1f}x)")
+    print(f"  命中 {stats.hits}，并发去重 {stats.shared}，未命中 {stats.misses}，命中率 {stats.hit_rate:.0%}，"
+          f"省下工具耗时 {stats.saved_seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+基准测试：逐个执行工具调用 vs ToolExecutor 并发执行
+
+模拟服务每次返回多个 get_weather 调用（北京、上海、广州、巴黎……），工具本身有固定延迟。
+两种方式都是：调用模型 -> 执行全部工具 -> 带着全部 ToolMessage 再调用一次模型，比较整个流程的耗时。
+
+运行: python benchmarks/bench_tool_executor.py --calls 4 --tool-latency 0.3
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+from langchain_core.messages import HumanMessage, ToolMessage
+from langchain_core.tools import tool
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.mock_server import spawn_mock_server
+from common.model_factory import get_chat_model
+from common.tool_executor import ToolExecutor, invoke_with_tools
+
+QUESTION = "北京、上海、广州和巴黎的天气怎么样？"
+
+
+def make_tools(latency: float):
+    @tool
+    def get_weather(location: str) -> str:
+        """获取某个位置的天气。"""
+        time.sleep(latency)
+        return f"{location}：晴天，22°C"
+
+    @tool("get_weather")
+    async def aget_weather(location: str) -> str:
+        """获取某个位置的天气。"""
+        await asyncio.sleep(latency)
+        return f"{location}：晴天，22°C"
+
+    return get_weather, aget_weather
+
+
+def sequential(model, get_weather) -> float:
+    start = time.perf_counter()
+    messages = [HumanMessage(QUESTION)]
+    response = model.invoke(messages)
+    messages.append(response)
+    for call in response.tool_calls:
+        messages.append(ToolMessage(get_weather.invoke(call["args"]), tool_call_id=call["id"]))
+    model.invoke(messages)
+    return time.perf_counter() - start
+
+
+def concurrent(model, executor: ToolExecutor) -> float:
+    start = time.perf_counter()
+    invoke_with_tools(model, QUESTION, executor)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=4, help="每次响应中的工具调用数")
+    parser.add_argument("--tool-latency", type=float, default=0.3, help="每个工具的耗时（秒）")
+    parser.add_argument("--latency", type=float, default=0.1, help="模型每次调用的延迟（秒）")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    get_weather, aget_weather = make_tools(args.tool_latency)
+    with spawn_mock_server(latency=args.latency, tool_call_count=args.calls) as base_url:
+        model = get_chat_model(base_url=base_url, api_key="mock").bind_tools([get_weather])
+        model.invoke("你好")  # 预热连接
+
+        with ToolExecutor([get_weather]) as sync_executor, ToolExecutor([aget_weather]) as async_executor:
+            results = {
+                "逐个执行": [sequential(model, get_weather) for _ in range(args.rounds)],
+                "ToolExecutor (同步工具/线程池)": [concurrent(model, sync_executor) for _ in range(args.rounds)],
+                "ToolExecutor (异步工具)": [concurrent(model, async_executor) for _ in range(args.rounds)],
+            }
+
+    print(f"每次 {args.calls} 个工具调用，工具耗时 {args.tool_latency}s，模型延迟 {args.latency}s")
+    baseline = sum(results["逐个执行"]) / args.rounds
+    for name, times in results.items():
+        average = sum(times) / len(times)
+        print(f"  {name:<30}{average * 1000:>8.0f} ms  ({baseline / average:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+基准测试：每个请求新建绑定模型时的客户端 CPU 开销
+
+模拟服务中每个请求都重新绑定工具再调用的写法，分别测量 1、10、50 个工具时每个请求的 CPU 时间：
+1. model.bind_tools(函数列表).invoke()：每次从函数签名和 docstring 生成 schema，SDK 再转换、序列化
+2. registry.bind_tools(model).invoke()：使用预编译的 schema，仍然走 SDK 的请求路径
+3. registry.invoke(registry.bind_tools(model), ...)：请求体中直接拼接预先序列化的 tools 字节
+
+运行: python benchmarks/bench_tool_registry.py --requests 50
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.mock_server import spawn_mock_server
+from common.model_factory import get_chat_model
+from common.tool_registry import ToolRegistry
+
+QUESTION = "北京的天气怎么样？"
+
+
+def make_tools(count: int) -> list:
+    """生成 count 个签名与 docstring 各不相同的普通函数工具"""
+    tools = []
+    for i in range(count):
+        def get_weather(location: str, unit: str = "celsius", days: int = 1) -> str:
+            """获取某个位置的天气预报。
+
+            Args:
+                location: 城市名称
+                unit: 温度单位，celsius 或 fahrenheit
+                days: 预报天数
+            """
+            return f"{location}：晴天，22°C"
+
+        get_weather.__name__ = f"get_weather_{i}"
+        tools.append(get_weather)
+    return tools
+
+
+def cpu_per_request(fn, requests: int) -> float:
+    fn()  # 预热
+    start = time.process_time()
+    for _ in range(requests):
+        fn()
+    return (time.process_time() - start) / requests
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--tools", type=int, nargs="+", default=[1, 10, 50])
+    args = parser.parse_args()
+
+    with spawn_mock_server() as base_url:
+        model = get_chat_model(base_url=base_url, api_key="mock")
+        print(f"每个请求的客户端 CPU 时间（ms），{args.requests} 次请求取平均")
+        print(f"{'工具数':>6}{'bind_tools':>14}{'registry':>12}{'registry 拼接':>16}")
+        for count in args.tools:
+            tools = make_tools(count)
+            registry = ToolRegistry(tools)
+            results = [
+                cpu_per_request(lambda: model.bind_tools(tools).invoke(QUESTION), args.requests),
+                cpu_per_request(lambda: registry.bind_tools(model).invoke(QUESTION), args.requests),
+                cpu_per_request(lambda: registry.invoke(registry.bind_tools(model), QUESTION), args.requests),
+            ]
+            print(f"{count:>8}" + "".join(f"{value * 1000:>14.2f}" for value in results))
+
+
+if __name__ == "__main__":
+    main()
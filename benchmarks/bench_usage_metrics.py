@@ -0,0 +1,100 @@
+"""
+基准测试：UsageMetricsCallback 的开销
+
+1. 热路径微基准：on_llm_new_token 每个块的耗时；UsageMetrics.record 在 1 个和多个线程下每次的耗时
+2. 端到端：对子进程中的模拟服务执行流式调用，比较不挂回调、挂 UsageMetadataCallbackHandler 和
+   挂 UsageMetricsCallback 时客户端的 CPU 时间，折算为每个块的额外开销
+   （包含 LangChain 回调管理器分发事件本身的开销，这是挂任何回调都要付出的）
+
+运行: python benchmarks/bench_usage_metrics.py --streams 20 --output-tokens 2000
+"""
+import argparse
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.mock_server import spawn_mock_server
+from common.model_factory import get_chat_model
+from common.usage_metrics import UsageMetrics
+
+
+def bench_new_token(calls: int) -> float:
+    metrics = UsageMetrics()
+    callback = metrics.callback()
+    run_id = uuid.uuid4()
+    callback.on_chat_model_start({}, [[]], run_id=run_id, metadata={"ls_model_name": "qwen-plus"})
+    start = time.perf_counter()
+    for _ in range(calls):
+        callback.on_llm_new_token("字", run_id=run_id)
+    return (time.perf_counter() - start) / calls
+
+
+def bench_record(threads: int, calls: int) -> float:
+    metrics = UsageMetrics()
+
+    def work(worker: int) -> None:
+        for i in range(calls):
+            metrics.record("qwen-plus", f"route-{worker % 4}", latency=0.2, ttft=0.05,
+                           input_tokens=100, output_tokens=i % 500, chunks=50)
+
+    workers = [threading.Thread(target=work, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    requests = sum(series.counters["requests"] for series in metrics.merged().values())
+    assert requests == threads * calls, "记录数不一致"
+    return elapsed / (threads * calls)
+
+
+def bench_stream(model, streams: int, callbacks: list) -> tuple[float, int]:
+    """返回 (客户端 CPU 秒数, 块数)"""
+    chunks = 0
+    start = time.process_time()
+    for _ in range(streams):
+        for _ in model.stream("写一篇长文章", config={"callbacks": callbacks}):
+            chunks += 1
+    return time.process_time() - start, chunks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--output-tokens", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    print("热路径微基准")
+    print(f"  on_llm_new_token: {bench_new_token(1_000_000) * 1e9:,.0f} ns/块")
+    print(f"  record, 1 个线程: {bench_record(1, 200_000) * 1e6:.2f} µs/次")
+    print(f"  record, {args.threads} 个线程: {bench_record(args.threads, 50_000) * 1e6:.2f} µs/次")
+
+    with spawn_mock_server(output_tokens=args.output_tokens) as base_url:
+        model = get_chat_model(base_url=base_url, api_key="mock", stream_usage=True)
+        bench_stream(model, 2, [])  # 预热
+
+        metrics = UsageMetrics()
+        baseline, chunks = bench_stream(model, args.streams, [])
+        results = {
+            "UsageMetadataCallbackHandler": bench_stream(model, args.streams, [UsageMetadataCallbackHandler()])[0],
+            "UsageMetricsCallback": bench_stream(model, args.streams, [metrics.callback(route="bench")])[0],
+        }
+
+    print(f"\n端到端：{args.streams} 次流式调用，共 {chunks} 个块")
+    print(f"  {'不挂回调':<30}{baseline / chunks * 1e6:>8.1f} µs/块")
+    for name, cpu in results.items():
+        print(f"  {name:<30}{cpu / chunks * 1e6:>8.1f} µs/块  (额外 {(cpu - baseline) / chunks * 1e6:+.1f} µs/块)")
+    [series] = metrics.snapshot()
+    print(f"\nUsageMetrics 记录: {series['requests']} 次调用, {series['chunks']} 个块, "
+          f"TTFT p50 {series['ttft']['p50'] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+基准测试共用的统计工具
+"""
+import math
+from dataclasses import dataclass, field
+
+
+def percentile(values: list[float], q: float) -> float:
+    """最近秩法计算百分位数，q 取 0~100"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+@dataclass
+class PathResult:
+    """一条调用路径的测量结果，时间单位为秒"""
+    name: str
+    elapsed: float
+    latencies: list[float] = field(default_factory=list)
+    ttfts: list[float] = field(default_factory=list)
+    requests: int = 0
+    output_tokens: int = 0
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.output_tokens / self.elapsed if self.elapsed else 0.0
+
+
+def print_table(results: list[PathResult]) -> None:
+    def ms(value: float) -> str:
+        return "      -" if math.isnan(value) else f"{value * 1000:7.1f}"
+
+    print(f"{'路径':<24}{'请求数':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'TTFT p50':>10}{'tokens/s':>10}{'req/s':>9}")
+    for r in results:
+        print(
+            f"{r.name:<24}{r.requests:>8}"
+            f"  {ms(percentile(r.latencies, 50))}  {ms(percentile(r.latencies, 95))}  {ms(percentile(r.latencies, 99))}"
+            f"   {ms(percentile(r.ttfts, 50))}"
+            f"{r.tokens_per_second:>10.1f}{r.requests_per_second:>9.1f}"
+        )
+    print("（延迟单位 ms）")
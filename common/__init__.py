@@ -0,0 +1,3 @@
+"""
+各章节示例共享的公共模块
+"""
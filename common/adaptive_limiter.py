@@ -0,0 +1,558 @@
+"""
+自适应并发控制（AIMD）
+
+model.batch(max_concurrency=N) 的 N 是固定的：设小了配额用不满，设大了遇到 DashScope 限流时
+一起收到 429，客户端各自重试，重试又撞上限流。AdaptiveLimiter 根据服务端的反馈调整同时在途的请求数：
+- 加性增：延迟和错误率正常、并且并发上限确实被用满时，每完成一个请求上限增加 1/上限（约每一轮增加 1）
+- 乘性减：收到 429，或者延迟的 EWMA 超过基线（最近样本中的最小值）的 latency_tolerance 倍时，
+  上限乘以 backoff；同一轮内的多个信号只减一次
+- 429 的 Retry-After（或 retry-after-ms）期间暂停发出新请求，所有调用一起等待，而不是各自重试；
+  暂停结束时服务端的桶只补回了约一个请求，因此同时清空客户端的请求桶，之后按速率逐个放行
+- 没有设置 requests_per_minute 时，从 429 推断请求速率：收到 429 时取最近一秒内成功的请求数作为速率
+  （只减不增），之后每成功一个请求速率加性增长，再次 429 时重新推断。
+  延迟很短时，即使并发为 1 也可能超过服务端的 RPM，只靠并发上限无法避免反复 429
+- 重试的请求排到队首，不会因为重新排队而在每次重试中都输给新请求
+- requests_per_minute / tokens_per_minute：按秒平摊的令牌桶（与 DashScope 的限流方式一致），
+  发出前按预估的 token 数扣除，完成后按 usage_metadata 的实际用量多退少补；
+  超过一秒额度的请求（RPM 低于 60，或大请求）在桶满时放行
+- 等待的调用按先到先得的顺序放行，同步（线程）和异步调用共享同一个限制器
+
+RateLimitedChatModel 包装一个聊天模型，invoke/ainvoke/batch/stream/astream 都经过限制器；
+收到 429 时由它按 Retry-After 重试（重试同样经过限制器），被包装的模型应设置 max_retries=0，
+否则 openai 客户端会先自行重试。多个模型共用同一个 API Key 的配额时，共用同一个 AdaptiveLimiter。
+
+延迟信号：invoke 为总耗时，stream 为首块时间。回复长度差别很大的请求混在一起时，总耗时会随输出长度波动，
+这时可以调大 latency_tolerance，或者只依赖 429 信号（latency_tolerance=None）。
+
+用法:
+    limiter = AdaptiveLimiter(requests_per_minute=600, tokens_per_minute=1_000_000)
+    model = RateLimitedChatModel(model=get_chat_model(max_retries=0), limiter=limiter)
+    responses = model.batch(questions, config={"max_concurrency": 64})
+    print(limiter.stats)
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Callable, Iterator
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict, Field
+
+from common.token_estimator import TokenEstimator
+
+# 延迟基线取最近多少个样本中的最小值
+_BASELINE_WINDOW = 200
+# 429 没有带 Retry-After 时的等待时间（秒）
+_DEFAULT_RETRY_AFTER = 1.0
+
+
+@dataclass
+class LimiterStats:
+    """限制器统计，limit 是当前的并发上限"""
+    requests: int = 0
+    throttled: int = 0
+    errors: int = 0
+    retries: int = 0
+    increases: int = 0
+    decreases: int = 0
+    max_inflight: int = 0
+    waited_seconds: float = 0.0
+    limit: float = 0.0
+    # 从 429 推断的请求速率（每秒），设置了 requests_per_minute 时不使用
+    inferred_rate: float | None = None
+
+
+@dataclass
+class Permit:
+    """一次放行的请求，release 时交还"""
+    tokens: int
+    started: float
+
+
+class _Waiter:
+    __slots__ = ("tokens", "wake", "granted")
+
+    def __init__(self, tokens: int, wake: Callable[[], None]):
+        self.tokens = tokens
+        self.wake = wake
+        self.granted = False
+
+
+class AdaptiveLimiter:
+    """AIMD 并发上限 + 按秒平摊的 RPM / TPM 令牌桶"""
+
+    def __init__(
+        self,
+        *,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 256,
+        backoff: float = 0.5,
+        latency_tolerance: float | None = 2.0,
+        max_error_rate: float = 0.1,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+    ):
+        """
+        Args:
+            initial_limit: 初始并发上限
+            min_limit / max_limit: 并发上限的范围
+            backoff: 乘性减的系数
+            latency_tolerance: 延迟 EWMA 超过基线的多少倍时减小上限，None 表示不看延迟
+            max_error_rate: 错误率（EWMA）超过这个值时不再增加上限
+            requests_per_minute: 每分钟请求数预算，None 表示不限
+            tokens_per_minute: 每分钟 token 数预算（输入 + 输出），None 表示不限
+        """
+        if not 0 < backoff < 1:
+            raise ValueError("backoff 必须在 0 和 1 之间")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.max_error_rate = max_error_rate
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.stats = LimiterStats(limit=float(initial_limit))
+        self._limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._inflight = 0
+        self._waiters: deque[_Waiter] = deque()
+        # 从 429 推断的请求速率（每秒），以及最近一秒内成功完成的时间
+        self._inferred_rate: float | None = None
+        self._completed: deque[float] = deque()
+        self._paused_until = 0.0
+        # 令牌桶容量为一秒的额度
+        self._requests_left = self._request_capacity
+        self._tokens_left = self._token_capacity
+        self._refilled_at = time.monotonic()
+        self._latency: float | None = None
+        self._latencies: deque[float] = deque(maxlen=_BASELINE_WINDOW)
+        self._error_rate = 0.0
+        self._last_decrease = 0.0
+        self._timer_at: float | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def acquire(self, tokens: int = 0, *, retry: bool = False) -> Permit:
+        """等待到可以发出请求为止
+
+        Args:
+            tokens: 预估的 token 数（输入 + 输出）
+            retry: 是否为重试的请求，重试的请求排到队首
+        """
+        start = time.perf_counter()
+        event = threading.Event()
+        with self._lock:
+            if self._admit_now(tokens):
+                return Permit(tokens, start)
+            self._enqueue(_Waiter(tokens, event.set), retry)
+            woken = self._drain()
+        _wake(woken)
+        event.wait()
+        return self._granted(tokens, start)
+
+    async def aacquire(self, tokens: int = 0, *, retry: bool = False) -> Permit:
+        """acquire 的异步版本，与同步调用共享排队顺序"""
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self._admit_now(tokens):
+                return Permit(tokens, start)
+            waiter = _Waiter(tokens, lambda: loop.call_soon_threadsafe(_resolve, future))
+            self._enqueue(waiter, retry)
+            woken = self._drain()
+        _wake(woken)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    # 已经放行但调用者被取消，交还名额和预算
+                    self._inflight -= 1
+                    self._requests_left += 1
+                    self._tokens_left += tokens
+                else:
+                    self._waiters.remove(waiter)
+                woken = self._drain()
+            _wake(woken)
+            raise
+        return self._granted(tokens, start)
+
+    def release(
+        self,
+        permit: Permit,
+        outcome: str = "ok",
+        *,
+        latency: float | None = None,
+        tokens_used: int | None = None,
+        retry_after: float | None = None,
+        retrying: bool = False,
+    ) -> None:
+        """交还名额并反馈结果
+
+        Args:
+            outcome: "ok"、"throttled"（429）、"error"（其他错误）或 "cancelled"（调用者放弃，不作为信号）
+            latency: 延迟信号（秒），默认为从放行到现在的时间
+            tokens_used: 实际用量，用于修正预估的 token 数
+            retry_after: 429 的 Retry-After（秒）
+            retrying: 调用者是否会重试这个请求，只用于统计
+        """
+        now = time.monotonic()
+        if latency is None:
+            latency = time.perf_counter() - permit.started
+        with self._lock:
+            self._inflight -= 1
+            if tokens_used is not None:
+                self._tokens_left += permit.tokens - tokens_used
+            if retrying:
+                self.stats.retries += 1
+            if outcome == "throttled":
+                self.stats.throttled += 1
+                self._decrease(now)
+                pause = _DEFAULT_RETRY_AFTER if retry_after is None else retry_after
+                self._paused_until = max(self._paused_until, now + pause)
+                self._infer_rate(now)
+                # 服务端的桶已经用完，暂停结束后按速率逐个放行，而不是一次放行一整秒的额度
+                self._requests_left = min(self._requests_left, 0.0)
+            elif outcome == "error":
+                self.stats.errors += 1
+                self._error_rate = 0.9 * self._error_rate + 0.1
+            elif outcome == "ok":
+                self._error_rate *= 0.9
+                self._completed.append(now)
+                while self._completed[0] < now - 1.0:
+                    self._completed.popleft()
+                if self._inferred_rate is not None:
+                    # 每秒约增加 0.5 个请求的速率，慢慢试探服务端的余量
+                    self._inferred_rate += 0.5 / self._inferred_rate
+                self._observe(latency, now)
+            self.stats.limit = self._limit
+            self.stats.inferred_rate = self._inferred_rate
+            woken = self._drain()
+        _wake(woken)
+
+    @property
+    def _request_capacity(self) -> float:
+        if self.requests_per_minute:
+            return self.requests_per_minute / 60
+        return self._inferred_rate or 0.0
+
+    @property
+    def _paced(self) -> bool:
+        return bool(self.requests_per_minute or self._inferred_rate)
+
+    @property
+    def _token_capacity(self) -> float:
+        return self.tokens_per_minute / 60 if self.tokens_per_minute else 0.0
+
+    def _observe(self, latency: float, now: float) -> None:
+        self._latencies.append(latency)
+        self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+        baseline = min(self._latencies)
+        if self.latency_tolerance is not None and self._latency > self.latency_tolerance * baseline:
+            self._decrease(now)
+        elif self._error_rate <= self.max_error_rate and self._inflight + 1 >= int(self._limit):
+            # 只有上限被用满时才增加，空闲时上限不会无限增长
+            if self._limit < self.max_limit:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+                self.stats.increases += 1
+
+    def _infer_rate(self, now: float) -> None:
+        """以最近一秒内成功的请求数作为服务端的请求速率，只减不增"""
+        if self.requests_per_minute:
+            return
+        while self._completed and self._completed[0] < now - 1.0:
+            self._completed.popleft()
+        observed = max(float(len(self._completed)), 1.0)
+        if self._inferred_rate is None:
+            self._requests_left = 0.0
+            self._refilled_at = now
+            self._inferred_rate = observed
+        else:
+            self._inferred_rate = min(self._inferred_rate, observed)
+
+    def _decrease(self, now: float) -> None:
+        # 同一轮（约一个请求延迟）内的多个信号只减一次
+        if now - self._last_decrease < (self._latency or 0.0):
+            return
+        self._last_decrease = now
+        self._limit = max(self.min_limit, self._limit * self.backoff)
+        self.stats.decreases += 1
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self._paced:
+            self._requests_left = min(self._request_capacity, self._requests_left + elapsed * self._request_capacity)
+        if self.tokens_per_minute:
+            self._tokens_left = min(self._token_capacity, self._tokens_left + elapsed * self._token_capacity)
+
+    def _delay(self, tokens: int, now: float) -> float | None:
+        """还需要等待的秒数；0 表示可以放行，None 表示要等其他请求完成"""
+        if self._inflight >= int(self._limit):
+            return None
+        delays = [self._paused_until - now]
+        if self._paced:
+            # RPM 低于 60 时一秒的额度不到一个请求，桶满即放行
+            needed = min(1.0, self._request_capacity)
+            if self._requests_left < needed:
+                delays.append((needed - self._requests_left) / self._request_capacity)
+        if self.tokens_per_minute:
+            # 超过一秒额度的大请求在桶满时放行，之后的请求等待桶重新补满
+            needed = min(tokens, self._token_capacity)
+            if self._tokens_left < needed:
+                delays.append((needed - self._tokens_left) / self._token_capacity)
+        return max(0.0, *delays)
+
+    def _admit_now(self, tokens: int) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        self.stats.requests += 1
+        if self._waiters or self._delay(tokens, now) != 0:
+            return False
+        self._take(tokens)
+        return True
+
+    def _enqueue(self, waiter: _Waiter, retry: bool) -> None:
+        if retry:
+            self._waiters.appendleft(waiter)
+        else:
+            self._waiters.append(waiter)
+
+    def _take(self, tokens: int) -> None:
+        self._inflight += 1
+        self._requests_left -= 1
+        self._tokens_left -= tokens
+        self.stats.max_inflight = max(self.stats.max_inflight, self._inflight)
+
+    def _drain(self) -> list[Callable[[], None]]:
+        """按顺序放行排在前面的等待者，返回需要唤醒的回调（在锁外调用）"""
+        now = time.monotonic()
+        self._refill(now)
+        woken = []
+        while self._waiters:
+            waiter = self._waiters[0]
+            delay = self._delay(waiter.tokens, now)
+            if delay is None:
+                break
+            if delay > 0:
+                self._schedule(now, delay)
+                break
+            self._waiters.popleft()
+            self._take(waiter.tokens)
+            waiter.granted = True
+            woken.append(waiter.wake)
+        return woken
+
+    def _schedule(self, now: float, delay: float) -> None:
+        """预算或 Retry-After 到期时重新放行；已有更早的定时器时不重复创建"""
+        if self._timer_at is not None and self._timer_at <= now + delay:
+            return
+        self._timer_at = now + delay
+        timer = threading.Timer(delay, self._on_timer)
+        timer.daemon = True
+        timer.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer_at = None
+            woken = self._drain()
+        _wake(woken)
+
+    def _granted(self, tokens: int, start: float) -> Permit:
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.stats.waited_seconds += waited
+        return Permit(tokens, time.perf_counter())
+
+
+class RateLimitedChatModel(BaseChatModel):
+    """所有调用都经过 AdaptiveLimiter 的聊天模型包装，收到 429 时按 Retry-After 重试"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    model: BaseChatModel
+    limiter: AdaptiveLimiter
+    estimator: TokenEstimator = Field(default_factory=TokenEstimator, exclude=True)
+    max_retries: int = 5
+    # 没有设置 max_tokens 时按这个输出 token 数预估
+    expected_output_tokens: int = 256
+
+    @property
+    def _llm_type(self) -> str:
+        return f"rate-limited-{self.model._llm_type}"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return self.model._identifying_params
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> Any:
+        return self.bind(**self.model.bind_tools(tools, **kwargs).kwargs)
+
+    def estimate_tokens(self, messages: list[BaseMessage], **kwargs: Any) -> int:
+        """预估的 token 数：输入 + max_tokens（没有时用 expected_output_tokens）"""
+        output = kwargs.get("max_tokens") or getattr(self.model, "max_tokens", None) or self.expected_output_tokens
+        return self.estimator.estimate(messages, tools=kwargs.get("tools")) + output
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self.estimate_tokens(messages, **kwargs)
+        for attempt in range(self.max_retries + 1):
+            permit = self.limiter.acquire(tokens, retry=attempt > 0)
+            try:
+                message = self.model.invoke(messages, stop=stop, **kwargs)
+            except Exception as e:
+                if not self._throttled(permit, e, attempt):
+                    raise
+                continue
+            except BaseException:
+                self.limiter.release(permit, "cancelled")
+                raise
+            self.limiter.release(permit, tokens_used=_total_tokens(message))
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self.estimate_tokens(messages, **kwargs)
+        for attempt in range(self.max_retries + 1):
+            permit = await self.limiter.aacquire(tokens, retry=attempt > 0)
+            try:
+                message = await self.model.ainvoke(messages, stop=stop, **kwargs)
+            except Exception as e:
+                if not self._throttled(permit, e, attempt):
+                    raise
+                continue
+            except BaseException:
+                self.limiter.release(permit, "cancelled")
+                raise
+            self.limiter.release(permit, tokens_used=_total_tokens(message))
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        tokens = self.estimate_tokens(messages, **kwargs)
+        for attempt in range(self.max_retries + 1):
+            permit = self.limiter.acquire(tokens, retry=attempt > 0)
+            ttft = usage = None
+            try:
+                for chunk in self.model.stream(messages, stop=stop, **kwargs):
+                    if ttft is None:
+                        ttft = time.perf_counter() - permit.started
+                    usage = _total_tokens(chunk) or usage
+                    generation = ChatGenerationChunk(message=chunk)
+                    if run_manager is not None:
+                        run_manager.on_llm_new_token(generation.text, chunk=generation)
+                    yield generation
+            except Exception as e:
+                # 已经输出的块无法撤回，只有首块之前的 429 可以重试
+                if ttft is not None or not self._throttled(permit, e, attempt):
+                    if ttft is not None:
+                        self.limiter.release(permit, "error")
+                    raise
+                continue
+            except BaseException:
+                # 调用者提前结束（GeneratorExit）
+                self.limiter.release(permit, "cancelled" if ttft is None else "ok", latency=ttft, tokens_used=usage)
+                raise
+            self.limiter.release(permit, latency=ttft, tokens_used=usage)
+            return
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        tokens = self.estimate_tokens(messages, **kwargs)
+        for attempt in range(self.max_retries + 1):
+            permit = await self.limiter.aacquire(tokens, retry=attempt > 0)
+            ttft = usage = None
+            try:
+                async for chunk in self.model.astream(messages, stop=stop, **kwargs):
+                    if ttft is None:
+                        ttft = time.perf_counter() - permit.started
+                    usage = _total_tokens(chunk) or usage
+                    generation = ChatGenerationChunk(message=chunk)
+                    if run_manager is not None:
+                        await run_manager.on_llm_new_token(generation.text, chunk=generation)
+                    yield generation
+            except Exception as e:
+                if ttft is not None or not self._throttled(permit, e, attempt):
+                    if ttft is not None:
+                        self.limiter.release(permit, "error")
+                    raise
+                continue
+            except BaseException:
+                self.limiter.release(permit, "cancelled" if ttft is None else "ok", latency=ttft, tokens_used=usage)
+                raise
+            self.limiter.release(permit, latency=ttft, tokens_used=usage)
+            return
+
+    def _throttled(self, permit: Permit, error: Exception, attempt: int) -> bool:
+        """反馈一次失败的请求，返回是否应该重试（429 且还有重试次数）"""
+        status, retry_after = _rate_limit_info(error)
+        if status != 429:
+            self.limiter.release(permit, "error")
+            return False
+        retrying = attempt < self.max_retries
+        self.limiter.release(permit, "throttled", retry_after=retry_after, retrying=retrying)
+        return retrying
+
+
+def _rate_limit_info(error: Exception) -> tuple[int | None, float | None]:
+    """从 openai / httpx 的异常中取出 (状态码, Retry-After 秒数)"""
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    headers = getattr(response, "headers", None) or {}
+    retry_after = None
+    try:
+        if "retry-after-ms" in headers:
+            retry_after = float(headers["retry-after-ms"]) / 1000
+        elif "retry-after" in headers:
+            retry_after = float(headers["retry-after"])
+    except ValueError:
+        pass  # HTTP 日期格式，按默认时间等待
+    return status, retry_after
+
+
+def _total_tokens(message: AIMessage) -> int | None:
+    usage = message.usage_metadata
+    return usage["total_tokens"] if usage else None
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def _wake(callbacks: list[Callable[[], None]]) -> None:
+    for wake in callbacks:
+        try:
+            wake()
+        except RuntimeError:
+            pass  # 等待者的事件循环已经关闭
@@ -0,0 +1,113 @@
+"""
+基于 ainvoke 的异步批处理引擎
+
+model.batch() 使用线程池并发，结果要等全部完成后一次性返回。这里改用 asyncio：
+- max_concurrency 限制同时在途的请求数，输入可以是任意（惰性）可迭代对象
+- abatch_as_completed 按完成顺序逐个产出 (输入下标, 结果)
+- abatch / batch 按输入顺序收集结果，返回值与 model.batch() 一致
+- on_progress 回调用于报告进度
+
+用法:
+    async for index, response in abatch_as_completed(model, prompts, max_concurrency=32):
+        print(index, response.content)
+
+    responses = batch(model, prompts, max_concurrency=32)
+"""
+import asyncio
+from collections.abc import AsyncIterator, Callable, Iterable
+from typing import Any
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+# 进度回调: on_progress(已完成数, 总数)，总数未知时为 None
+ProgressCallback = Callable[[int, int | None], None]
+
+
+async def abatch_as_completed(
+    runnable: Runnable,
+    inputs: Iterable[Any],
+    *,
+    max_concurrency: int = 16,
+    config: RunnableConfig | None = None,
+    return_exceptions: bool = False,
+    on_progress: ProgressCallback | None = None,
+) -> AsyncIterator[tuple[int, Any]]:
+    """按完成顺序产出 (输入下标, 结果)
+
+    Args:
+        runnable: 模型或任意 Runnable
+        inputs: 输入序列，按需读取，不会一次性创建所有任务
+        max_concurrency: 最大并发请求数
+        config: 传给每次 ainvoke 的配置
+        return_exceptions: 为 True 时把异常作为结果产出，否则遇到第一个异常即停止并抛出
+        on_progress: 每完成一个请求调用一次
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency 必须大于 0")
+
+    total = len(inputs) if hasattr(inputs, "__len__") else None
+    pending = enumerate(inputs)
+    results: asyncio.Queue = asyncio.Queue()
+    active = max_concurrency
+
+    async def worker() -> None:
+        nonlocal active
+        try:
+            # 所有 worker 共享同一个迭代器，next() 是同步调用，在单线程事件循环中不会冲突
+            for index, item in pending:
+                try:
+                    result = await runnable.ainvoke(item, config)
+                except Exception as e:
+                    result = e
+                await results.put((index, result))
+        finally:
+            active -= 1
+            if active == 0:
+                results.put_nowait(None)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max_concurrency)]
+
+    done = 0
+    try:
+        while (item := await results.get()) is not None:
+            index, result = item
+            if isinstance(result, Exception) and not return_exceptions:
+                raise result
+            done += 1
+            if on_progress is not None:
+                on_progress(done, total)
+            yield index, result
+        # 传播 worker 自身的异常（例如读取 inputs 时出错）
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def abatch(
+    runnable: Runnable,
+    inputs: Iterable[Any],
+    *,
+    max_concurrency: int = 16,
+    config: RunnableConfig | None = None,
+    return_exceptions: bool = False,
+    on_progress: ProgressCallback | None = None,
+) -> list[Any]:
+    """并发执行并按输入顺序返回结果列表，与 model.batch() 的返回值一致"""
+    collected: dict[int, Any] = {}
+    async for index, result in abatch_as_completed(
+        runnable,
+        inputs,
+        max_concurrency=max_concurrency,
+        config=config,
+        return_exceptions=return_exceptions,
+        on_progress=on_progress,
+    ):
+        collected[index] = result
+    return [collected[i] for i in range(len(collected))]
+
+
+def batch(runnable: Runnable, inputs: Iterable[Any], **kwargs) -> list[Any]:
+    """abatch 的同步版本，参数同 abatch"""
+    return asyncio.run(abatch(runnable, inputs, **kwargs))
@@ -0,0 +1,288 @@
+"""
+Batch API 任务模式
+
+OpenAI 兼容接口（包括 DashScope 兼容模式）提供基于文件的 Batch API：把请求写成 JSONL 文件上传，
+服务端在 completion_window（通常 24h）内离线处理，按 token 计费比在线调用便宜得多。
+models/batch.py 中的 model.batch() 逐个发出在线请求，适合要立即拿到结果的场景；
+不着急的大批量离线任务（评测、数据标注、批量抽取）可以改用 BatchJob：
+- BatchJob.submit 接受与 model.batch() 相同的输入，按模型参数（含 bind_tools 等绑定的参数）
+  逐行写入临时文件后上传并创建任务，不会把所有请求同时放在内存里
+- wait 按指数退避轮询任务状态（poll_interval 起，每次乘以 backoff，最长 max_poll_interval）
+- results 流式读取输出文件和错误文件，按完成顺序产出 (输入下标, AIMessage 或异常)，
+  AIMessage 与在线调用一样带有 usage_metadata；任务过期或取消时，没有结果的请求以异常产出
+- BatchJob.resume 按任务 ID 恢复：提交后进程退出，之后可以用任务 ID 继续等待和读取结果
+
+用法:
+    model = get_chat_model(temperature=0)
+    job = BatchJob.submit(model, questions, metadata={"name": "评测"})
+    print(job.id)                                    # 保存任务 ID，进程退出后可以恢复
+    job = BatchJob.resume(model, job_id)
+    job.wait()
+    for index, message in job.results():
+        print(index, message.content, message.usage_metadata)
+
+    responses = run_batch_job(model, questions)      # 提交、等待并按输入顺序返回，与 model.batch() 一致
+"""
+import json
+import random
+import tempfile
+import time
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableBinding
+
+ENDPOINT = "/v1/chat/completions"
+# 单个任务的请求数上限（OpenAI 和 DashScope 均为 5 万）
+MAX_REQUESTS = 50_000
+# 任务的终止状态
+_TERMINAL = ("completed", "failed", "expired", "cancelled")
+
+
+@dataclass
+class BatchJobStats:
+    requests: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    missing: int = 0
+    polls: int = 0
+    input_bytes: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"请求 {self.requests}，成功 {self.succeeded}，失败 {self.failed}，无结果 {self.missing}，"
+            f"轮询 {self.polls} 次，输入文件 {self.input_bytes:,} 字节，"
+            f"token {self.prompt_tokens:,} 输入 / {self.completion_tokens:,} 输出"
+        )
+
+
+class BatchJob:
+    """一个 Batch API 任务，通过 submit 创建或 resume 恢复"""
+
+    def __init__(
+        self,
+        model: BaseChatModel,
+        job_id: str,
+        *,
+        poll_interval: float = 5.0,
+        max_poll_interval: float = 60.0,
+        backoff: float = 1.5,
+    ):
+        """
+        Args:
+            model: get_chat_model() 返回的 ChatOpenAI，或 bind_tools / bind 之后的模型，
+                用于构造请求体、解析结果，并提供 openai 客户端
+            job_id: 任务 ID
+            poll_interval: 第一次轮询的间隔（秒）
+            max_poll_interval: 轮询间隔的上限（秒）
+            backoff: 每次轮询后间隔乘以的倍数
+        """
+        self.model, _ = _unwrap(model)
+        self.id = job_id
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.batch = None
+        self.stats = BatchJobStats()
+
+    @classmethod
+    def submit(
+        cls,
+        model: BaseChatModel,
+        inputs: Iterable[LanguageModelInput],
+        *,
+        stop: list[str] | None = None,
+        completion_window: str = "24h",
+        metadata: dict[str, str] | None = None,
+        poll_interval: float = 5.0,
+        max_poll_interval: float = 60.0,
+        backoff: float = 1.5,
+        **kwargs: Any,
+    ) -> "BatchJob":
+        """把输入写成 JSONL 文件上传，创建并返回任务
+
+        Args:
+            model: 聊天模型，见 BatchJob
+            inputs: 与 model.batch() 相同的输入（字符串、消息列表、PromptValue），可以是惰性可迭代对象
+            stop: 停止词
+            completion_window: 任务的完成时限
+            metadata: 附加在任务上的元数据（值必须为字符串）
+            **kwargs: 其他模型参数，与 model.invoke(input, **kwargs) 一致
+        """
+        chat_model, bound = _unwrap(model)
+        params = {**bound, **kwargs}
+        count = 0
+        with tempfile.TemporaryFile() as file:
+            for index, value in enumerate(inputs):
+                if index >= MAX_REQUESTS:
+                    raise ValueError(f"单个批量任务最多 {MAX_REQUESTS} 个请求，请拆分后分别提交")
+                messages = chat_model._convert_input(value).to_messages()
+                body = chat_model._get_request_payload(messages, stop=stop, **params)
+                body.pop("stream", None)
+                line = {"custom_id": str(index), "method": "POST", "url": ENDPOINT, "body": body}
+                file.write(json.dumps(line, ensure_ascii=False).encode("utf-8") + b"\n")
+                count = index + 1
+            if not count:
+                raise ValueError("inputs 为空")
+            size = file.tell()
+            file.seek(0)
+            client = chat_model.root_client
+            uploaded = client.files.create(file=("batch_input.jsonl", file), purpose="batch")
+        # 请求数记录在元数据中，恢复任务时据此判断哪些请求没有结果
+        batch = client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=ENDPOINT,
+            completion_window=completion_window,
+            metadata={**(metadata or {}), "requests": str(count)},
+        )
+        job = cls(model, batch.id, poll_interval=poll_interval, max_poll_interval=max_poll_interval, backoff=backoff)
+        job.batch = batch
+        job.stats.requests = count
+        job.stats.input_bytes = size
+        return job
+
+    @classmethod
+    def resume(cls, model: BaseChatModel, job_id: str, **options: Any) -> "BatchJob":
+        """按任务 ID 恢复已提交的任务，options 与 BatchJob 的轮询参数一致"""
+        job = cls(model, job_id, **options)
+        job.refresh()
+        return job
+
+    @property
+    def status(self) -> str | None:
+        return self.batch.status if self.batch is not None else None
+
+    @property
+    def done(self) -> bool:
+        return self.status in _TERMINAL
+
+    def refresh(self):
+        """查询一次任务状态，返回 openai 的 Batch 对象"""
+        self.batch = self.model.root_client.batches.retrieve(self.id)
+        self.stats.polls += 1
+        if not self.stats.requests:
+            metadata = self.batch.metadata or {}
+            self.stats.requests = int(metadata.get("requests") or self.batch.request_counts.total or 0)
+        return self.batch
+
+    def wait(self, timeout: float | None = None, on_poll: Callable[[Any], None] | None = None):
+        """轮询直到任务结束，返回最终的 Batch 对象
+
+        Args:
+            timeout: 最长等待时间（秒），超时抛出 TimeoutError，任务不会被取消
+            on_poll: 每次轮询后以 Batch 对象调用，可用于报告进度
+
+        Raises:
+            RuntimeError: 任务状态为 failed（通常是输入文件校验失败）
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = self.poll_interval
+        while True:
+            batch = self.refresh()
+            if on_poll is not None:
+                on_poll(batch)
+            if batch.status == "failed":
+                errors = batch.errors.data if batch.errors and batch.errors.data else []
+                detail = "；".join(f"第 {e.line} 行 {e.code}: {e.message}" for e in errors) or "未知原因"
+                raise RuntimeError(f"批量任务 {self.id} 失败：{detail}")
+            if batch.status in _TERMINAL:
+                return batch
+            delay = interval * random.uniform(0.8, 1.2)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"批量任务 {self.id} 在 {timeout} 秒内没有完成，当前状态 {batch.status}")
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            interval = min(interval * self.backoff, self.max_poll_interval)
+
+    def cancel(self):
+        """取消任务，已完成的请求仍会写入输出文件"""
+        self.batch = self.model.root_client.batches.cancel(self.id)
+        return self.batch
+
+    def results(self) -> Iterator[tuple[int, AIMessage | Exception]]:
+        """流式读取结果，按输出文件中的顺序产出 (输入下标, AIMessage 或异常)
+
+        任务未结束时先调用 wait()。成功的请求产出带 usage_metadata 的 AIMessage，
+        失败的请求和（任务过期、取消时）没有结果的请求产出 RuntimeError。
+        """
+        if not self.done:
+            self.wait()
+        # 每次读取都重新统计结果
+        self.stats.succeeded = self.stats.failed = self.stats.missing = 0
+        self.stats.prompt_tokens = self.stats.completion_tokens = 0
+        seen = set()
+        for file_id in (self.batch.output_file_id, self.batch.error_file_id):
+            if not file_id:
+                continue
+            with self.model.root_client.files.with_streaming_response.content(file_id) as response:
+                for line in response.iter_lines():
+                    if not line.strip():
+                        continue
+                    index, result = self._parse(json.loads(line))
+                    if index in seen:
+                        continue
+                    seen.add(index)
+                    yield index, result
+        for index in range(self.stats.requests):
+            if index not in seen:
+                self.stats.missing += 1
+                yield index, RuntimeError(f"批量任务 {self.id} 状态为 {self.status}，请求 {index} 没有结果")
+
+    def collect(self, return_exceptions: bool = False) -> list[AIMessage | Exception]:
+        """按输入顺序返回全部结果，return_exceptions 的含义与 model.batch() 一致"""
+        if not self.done:
+            self.wait()
+        outputs: list[AIMessage | Exception | None] = [None] * self.stats.requests
+        for index, result in self.results():
+            if isinstance(result, Exception) and not return_exceptions:
+                raise result
+            outputs[index] = result
+        return outputs
+
+    def _parse(self, record: dict) -> tuple[int, AIMessage | Exception]:
+        index = int(record["custom_id"])
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        if record.get("error") or response.get("status_code") != 200:
+            error = record.get("error") or body.get("error") or {}
+            self.stats.failed += 1
+            message = f"批量请求 {index} 失败（HTTP {response.get('status_code')}）：{error.get('message', error)}"
+            return index, RuntimeError(message)
+        message = self.model._create_chat_result(body).generations[0].message
+        self.stats.succeeded += 1
+        if message.usage_metadata:
+            self.stats.prompt_tokens += message.usage_metadata["input_tokens"]
+            self.stats.completion_tokens += message.usage_metadata["output_tokens"]
+        return index, message
+
+
+def run_batch_job(
+    model: BaseChatModel,
+    inputs: Iterable[LanguageModelInput],
+    *,
+    timeout: float | None = None,
+    return_exceptions: bool = False,
+    **kwargs: Any,
+) -> list[AIMessage | Exception]:
+    """提交批量任务、等待完成并按输入顺序返回结果，kwargs 传给 BatchJob.submit"""
+    job = BatchJob.submit(model, inputs, **kwargs)
+    job.wait(timeout=timeout)
+    return job.collect(return_exceptions=return_exceptions)
+
+
+def _unwrap(model: BaseChatModel) -> tuple[BaseChatModel, dict]:
+    """拆开 bind / bind_tools 的绑定，返回底层的 ChatOpenAI 和绑定的参数"""
+    kwargs = {}
+    while isinstance(model, RunnableBinding):
+        kwargs = {**model.kwargs, **kwargs}
+        model = model.bound
+    if not hasattr(model, "root_client"):
+        raise TypeError(f"BatchJob 需要 OpenAI 兼容的聊天模型（ChatOpenAI），而不是 {type(model).__name__}")
+    return model, kwargs
@@ -0,0 +1,168 @@
+"""
+增量构建请求体的多轮对话
+
+常见写法是把完整的 conversation_history 列表传给 model.invoke()，每一轮 LangChain 都会把
+之前所有消息重新转换为 OpenAI 格式的字典，openai SDK 再把整个请求体重新序列化一遍，
+N 轮对话的客户端开销是 O(N²)。
+
+Conversation 假定消息一旦加入就不再修改：
+- 每条消息加入时只转换一次，缓存转换后的字典和 JSON 字节
+- 发送时把缓存的字节直接拼接成请求体，每一轮只需要转换新增的消息
+- 模型的回复自动追加到对话中，同样只转换一次
+- 绑定的工具如果是 ToolRegistry 预编译的 schema，直接拼接它序列化好的字节
+
+请求通过模型自带的 openai 客户端发送（共享连接池、超时和重试设置），响应由模型自己的
+_create_chat_result 解析，得到的 AIMessage 与 model.invoke() 一致。
+这条路径绕过了 Runnable 调用链，不会触发 LangChain 回调和 LLM 缓存；
+也不支持 Responses API、response_format 和流式输出，这些场景仍然使用 model.invoke()。
+
+用法:
+    conversation = Conversation([SystemMessage("你是一个有帮助的编程助手。")])
+    conversation.append(HumanMessage("什么是 Python？"))
+    response = conversation.invoke(model)  # 回复已追加到 conversation
+"""
+import json
+from collections.abc import Iterable, Iterator, Sequence
+from typing import Any
+
+from langchain_core.messages import AIMessage, BaseMessage, convert_to_messages
+from langchain_core.runnables import RunnableBinding
+from langchain_openai.chat_models.base import (
+    BaseChatOpenAI,
+    _convert_from_v1_to_chat_completions,
+    _convert_message_to_dict,
+)
+from openai.types.chat import ChatCompletion
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+class Conversation:
+    """缓存每条消息转换和序列化结果的对话历史"""
+
+    def __init__(self, messages: Iterable[BaseMessage | dict | str] = ()):
+        self.messages: list[BaseMessage] = []
+        # 与 messages 一一对应：OpenAI 格式的字典和它的 JSON 字节
+        self._dicts: list[dict] = []
+        self._encoded: list[bytes] = []
+        self.extend(messages)
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __iter__(self) -> Iterator[BaseMessage]:
+        return iter(self.messages)
+
+    def __getitem__(self, index):
+        return self.messages[index]
+
+    def append(self, message: BaseMessage | dict | str) -> None:
+        self.extend([message])
+
+    def extend(self, messages: Iterable[BaseMessage | dict | str]) -> None:
+        for message in convert_to_messages(list(messages)):
+            converted = _to_provider_dict(message)
+            self.messages.append(message)
+            self._dicts.append(converted)
+            self._encoded.append(_encode(converted))
+
+    def truncate(self, length: int) -> None:
+        """只保留前 length 条消息（例如撤销最后一轮）"""
+        del self.messages[length:], self._dicts[length:], self._encoded[length:]
+
+    def provider_messages(self) -> list[dict]:
+        """OpenAI 格式的消息列表（缓存的字典，不要修改）"""
+        return list(self._dicts)
+
+    def request_body(self, model: BaseChatOpenAI, **kwargs: Any) -> bytes:
+        """拼接缓存的消息字节和模型参数，得到 /chat/completions 的请求体"""
+        model, kwargs = _unwrap(model, kwargs)
+        return _body(self._request_parts(), _request_params(model, kwargs))
+
+    def invoke(self, model: BaseChatOpenAI, **kwargs: Any) -> AIMessage:
+        """发送当前对话，把回复追加到对话中并返回
+
+        Args:
+            model: ChatOpenAI 实例，或 bind_tools() 等返回的绑定模型
+            **kwargs: 额外的请求参数，与 model.invoke(messages, **kwargs) 相同
+        """
+        model, kwargs = _unwrap(model, kwargs)
+        params = _request_params(model, kwargs)
+        response = model.root_client.post(
+            "/chat/completions",
+            cast_to=ChatCompletion,
+            content=_body(self._request_parts(), params),
+            options={"headers": _JSON_HEADERS},
+        )
+        return self._add_response(model, response)
+
+    async def ainvoke(self, model: BaseChatOpenAI, **kwargs: Any) -> AIMessage:
+        """invoke 的异步版本"""
+        model, kwargs = _unwrap(model, kwargs)
+        params = _request_params(model, kwargs)
+        response = await model.root_async_client.post(
+            "/chat/completions",
+            cast_to=ChatCompletion,
+            content=_body(self._request_parts(), params),
+            options={"headers": _JSON_HEADERS},
+        )
+        return self._add_response(model, response)
+
+    def _request_parts(self) -> list[bytes]:
+        """要发送的消息的 JSON 字节，子类可以只选取其中一部分"""
+        return self._encoded
+
+    def _add_response(self, model: BaseChatOpenAI, response: ChatCompletion) -> AIMessage:
+        result = model._create_chat_result(response)
+        generation = result.generations[0]
+        message = generation.message
+        # 与 BaseChatModel 一致：把 llm_output 和 generation_info 合并到 response_metadata
+        message.response_metadata = {
+            **(result.llm_output or {}),
+            **(generation.generation_info or {}),
+            **message.response_metadata,
+        }
+        self.append(message)
+        return message
+
+
+def _to_provider_dict(message: BaseMessage) -> dict:
+    # 与 BaseChatOpenAI._get_request_payload 中的转换一致
+    if isinstance(message, AIMessage):
+        message = _convert_from_v1_to_chat_completions(message)
+    return _convert_message_to_dict(message)
+
+
+def _encode(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _unwrap(model, kwargs: dict) -> tuple[BaseChatOpenAI, dict]:
+    # bind_tools() / bind() 返回 RunnableBinding，绑定的参数合并到请求参数中
+    while isinstance(model, RunnableBinding):
+        kwargs = {**model.kwargs, **kwargs}
+        model = model.bound
+    if not isinstance(model, BaseChatOpenAI):
+        raise TypeError(f"Conversation 只支持 ChatOpenAI 系列模型，收到 {type(model).__name__}")
+    return model, kwargs
+
+
+def _request_params(model: BaseChatOpenAI, kwargs: dict) -> bytes:
+    """不含消息的请求参数，序列化为 JSON 对象"""
+    payload = model._get_request_payload([], **kwargs)
+    if "messages" not in payload or "response_format" in payload:
+        raise ValueError("Conversation 不支持 Responses API 和 response_format，请使用 model.invoke()")
+    del payload["messages"]
+    payload["stream"] = False
+    tools = payload.pop("tools", None)
+    params = _encode(payload)
+    if not tools:
+        return params
+    # ToolRegistry 预编译的 schema 带有序列化好的字节，直接拼接
+    encoded = [getattr(tool, "encoded", None) or _encode(tool) for tool in tools]
+    return b'{"tools":[' + b",".join(encoded) + b"]," + params[1:]
+
+
+def _body(encoded: Sequence[bytes], params: bytes) -> bytes:
+    # params 形如 {"model":...}，把 "messages":[...] 插在最前面
+    return b'{"messages":[' + b",".join(encoded) + b"]," + params[1:]
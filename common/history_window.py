@@ -0,0 +1,175 @@
+"""
+按 token 预算截断的对话历史
+
+对话历史不断增长，每一轮的输入 token（成本和延迟的主要来源）都会随之增加。
+TokenBudgetConversation 在 Conversation 的基础上只发送预算内的最近若干轮：
+- SystemMessage 始终保留
+- 以“轮”为单位丢弃：一轮从 HumanMessage 开始，包含其后的 AIMessage 和 ToolMessage，
+  所以工具调用和对应的 ToolMessage 不会被拆开
+- 超出预算时从最早的一轮开始丢弃；pin() 固定的轮次不会被丢弃；最新的一轮始终保留
+- 每条消息的 token 数只在加入时计算一次并缓存，窗口内的总数随追加和丢弃增量更新，
+  每一轮的截断开销只与新增消息和新丢弃的轮数有关，不会重新统计整个历史
+
+被丢弃的消息仍然保留在 messages 中，只是不再发送；window_messages() 返回实际发送的消息，
+也可以直接传给 model.invoke() / model.stream()。
+
+用法:
+    conversation = TokenBudgetConversation([SystemMessage("你是一个有帮助的编程助手。")], max_tokens=4000)
+    conversation.append(HumanMessage("我叫小明，请记住我的名字。"), pin=True)
+    response = conversation.invoke(model)
+    print(conversation.window_tokens, conversation.dropped_turns)
+"""
+from bisect import bisect_right
+from collections.abc import Callable, Iterable
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+from common.conversation import Conversation
+from common.token_estimator import TokenEstimator
+
+# 计算单条消息的 token 数
+TokenCounter = Callable[[BaseMessage], int]
+
+_ESTIMATOR = TokenEstimator()
+
+
+def approximate_tokens(message: BaseMessage) -> int:
+    """默认的 token 计数：通义千问的离线估算（含消息模板开销）"""
+    return _ESTIMATOR.count_message(message)
+
+
+class _Turn:
+    __slots__ = ("start", "end", "tokens", "pinned", "system", "dropped")
+
+    def __init__(self, start: int, pinned: bool = False, system: bool = False):
+        self.start = start
+        self.end = start
+        self.tokens = 0
+        self.pinned = pinned
+        self.system = system
+        self.dropped = False
+
+
+class TokenBudgetConversation(Conversation):
+    """只发送 token 预算内最近若干轮的对话历史"""
+
+    def __init__(
+        self,
+        messages: Iterable[BaseMessage | dict | str] = (),
+        *,
+        max_tokens: int,
+        token_counter: TokenCounter = approximate_tokens,
+    ):
+        """
+        Args:
+            messages: 初始消息
+            max_tokens: 发送的消息 token 总数上限（不含工具定义等请求参数）
+            token_counter: 计算单条消息 token 数的函数
+        """
+        if max_tokens < 1:
+            raise ValueError("max_tokens 必须大于 0")
+        self.max_tokens = max_tokens
+        self.token_counter = token_counter
+        # 与 messages 一一对应的 token 数
+        self._tokens: list[int] = []
+        # 被固定的消息下标，truncate() 重建窗口时使用
+        self._pins: set[int] = set()
+        self._reset_window()
+        super().__init__(messages)
+
+    @property
+    def over_budget(self) -> bool:
+        """只剩固定的轮次和最新一轮时仍然超出预算"""
+        return self.window_tokens > self.max_tokens
+
+    def append(self, message: BaseMessage | dict | str, *, pin: bool = False) -> None:
+        self.extend([message])
+        if pin:
+            self.pin(-1)
+
+    def extend(self, messages: Iterable[BaseMessage | dict | str]) -> None:
+        start = len(self.messages)
+        super().extend(messages)
+        for index in range(start, len(self.messages)):
+            self._tokens.append(self.token_counter(self.messages[index]))
+            self._place(index)
+        self._trim()
+
+    def truncate(self, length: int) -> None:
+        super().truncate(length)
+        del self._tokens[length:]
+        self._pins = {index for index in self._pins if index < length}
+        # 使用缓存的 token 数重建窗口，不重新计数
+        self._reset_window()
+        for index in range(len(self.messages)):
+            self._place(index)
+        self._trim()
+
+    def pin(self, index: int) -> None:
+        """固定 index 所在的一轮对话，之后不会被丢弃"""
+        index = range(len(self.messages))[index]
+        turn = self._turns[bisect_right(self._turn_starts, index) - 1]
+        if turn.dropped:
+            raise ValueError(f"第 {index} 条消息所在的一轮已被丢弃，无法固定")
+        turn.pinned = True
+        self._pins.add(index)
+
+    def window_messages(self) -> list[BaseMessage]:
+        """实际发送的消息"""
+        return [message for start, end in self._window() for message in self.messages[start:end]]
+
+    def provider_messages(self) -> list[dict]:
+        """实际发送的 OpenAI 格式消息（缓存的字典，不要修改）"""
+        return [item for start, end in self._window() for item in self._dicts[start:end]]
+
+    def _request_parts(self) -> list[bytes]:
+        return [part for start, end in self._window() for part in self._encoded[start:end]]
+
+    def _reset_window(self) -> None:
+        self._turns: list[_Turn] = []
+        self._turn_starts: list[int] = []
+        # _turns[_first:] 都在窗口中；_first 之前只有被固定的轮次（保存在 _kept）和已丢弃的轮次
+        self._first = 0
+        self._kept: list[_Turn] = []
+        self.window_tokens = 0
+        self.dropped_turns = 0
+
+    def _window(self) -> list[tuple[int, int]]:
+        # _kept 中的轮次都早于 _turns[_first:]，拼接后仍是原来的顺序
+        return [(turn.start, turn.end) for turn in self._kept + self._turns[self._first:]]
+
+    def _place(self, index: int) -> None:
+        """把第 index 条消息归入所属的一轮"""
+        message = self.messages[index]
+        last = self._turns[-1] if self._turns else None
+        if isinstance(message, SystemMessage):
+            turn = self._new_turn(index, pinned=True, system=True)
+        elif isinstance(message, HumanMessage) or last is None or last.system:
+            turn = self._new_turn(index)
+        else:
+            # AIMessage / ToolMessage 属于当前这一轮
+            turn = last
+        turn.end = index + 1
+        turn.tokens += self._tokens[index]
+        if index in self._pins:
+            turn.pinned = True
+        self.window_tokens += self._tokens[index]
+
+    def _new_turn(self, index: int, pinned: bool = False, system: bool = False) -> _Turn:
+        turn = _Turn(index, pinned, system)
+        self._turns.append(turn)
+        self._turn_starts.append(index)
+        return turn
+
+    def _trim(self) -> None:
+        """从最早的一轮开始丢弃，直到不超出预算；最新的一轮始终保留"""
+        last = len(self._turns) - 1
+        while self.window_tokens > self.max_tokens and self._first < last:
+            turn = self._turns[self._first]
+            self._first += 1
+            if turn.pinned:
+                self._kept.append(turn)
+                continue
+            turn.dropped = True
+            self.window_tokens -= turn.tokens
+            self.dropped_turns += 1
@@ -0,0 +1,402 @@
+"""
+按延迟选择目标的模型路由，带对冲请求
+
+各示例只连接一个 model + base_url，这个端点变慢时 p99 随之升高。
+LatencyRouter 包装多个聊天模型（不同的模型、地域或 base_url），用法与单个模型相同：
+- 每个目标分别记录总延迟和首块时间 (TTFT) 的 EWMA，以及最近若干次的样本；
+  invoke 发给总延迟 EWMA 最小的健康目标，stream 发给 TTFT EWMA 最小的健康目标，
+  还没有样本的目标优先尝试一次，explore_rate 的请求随机选择目标，让变慢后又恢复的目标有机会被重新评估
+- 连续失败 max_failures 次的目标在 cooldown 秒内不健康，排在最后；请求出错时立即转发给下一个目标
+- 对冲：请求在首选目标最近样本的 hedge_percentile 分位数（默认 p95）时间内没有完成时，
+  向下一个目标（只有一个目标时是同一个目标）发出一份相同的请求，先完成的为准，另一个被取消。
+  stream 以首块为准：先收到首块的流继续输出，另一个流被关闭
+- 异步调用的输家通过取消任务立即断开连接；同步调用在后台线程中发出，
+  invoke 的输家无法中断，完成后丢弃结果，stream 的输家在收到首块后关闭
+- 对冲和输家的耗时同样计入 EWMA（被取消时按已经等待的时间计），慢的目标很快被降级
+- stats 统计每个目标的请求、胜出、错误和当前 EWMA，以及对冲次数和对冲胜出次数
+
+对冲会增加上游请求（通常是 5% 左右，等于超过分位数的请求比例），适合延迟比费用更重要的交互场景；
+有副作用的请求（例如会触发计费的工具）不要对冲。
+
+用法:
+    router = LatencyRouter(targets=[
+        get_chat_model("qwen-plus"),
+        get_chat_model("qwen-plus", base_url=SINGAPORE_BASE_URL, api_key=...),
+    ])
+    router.invoke("为什么鹦鹉有五颜六色的羽毛？")
+    print(router.stats)
+"""
+import asyncio
+import math
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Callable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass, field
+from typing import Any
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict, PrivateAttr
+
+# 每个目标保留的最近样本数，用于计算对冲的分位数
+_WINDOW = 100
+
+
+@dataclass
+class TargetStats:
+    """单个目标的统计，ewma_* 单位为秒，没有样本时为 None"""
+    name: str
+    requests: int = 0
+    wins: int = 0
+    errors: int = 0
+    # 作为对冲请求发出的次数
+    hedges: int = 0
+    ewma_latency: float | None = None
+    ewma_ttft: float | None = None
+    consecutive_failures: int = 0
+    last_failure: float = 0.0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=_WINDOW), repr=False)
+    ttfts: deque = field(default_factory=lambda: deque(maxlen=_WINDOW), repr=False)
+
+
+@dataclass
+class RouterStats:
+    """路由统计，hedge_wins 是对冲请求先完成的次数"""
+    requests: int = 0
+    hedged: int = 0
+    hedge_wins: int = 0
+    failovers: int = 0
+    targets: list[TargetStats] = field(default_factory=list)
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged / self.requests if self.requests else 0.0
+
+
+class LatencyRouter(BaseChatModel):
+    """在多个聊天模型之间按延迟路由，可选对冲请求"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    targets: list[BaseChatModel]
+    # 目标名称，默认为 模型名@base_url
+    names: list[str] | None = None
+    hedge: bool = True
+    hedge_percentile: float = 95.0
+    # 样本不足 min_samples 时使用的对冲延迟，None 表示样本不足时不对冲
+    hedge_delay: float | None = None
+    min_samples: int = 20
+    alpha: float = 0.2
+    explore_rate: float = 0.02
+    max_failures: int = 3
+    cooldown: float = 30.0
+
+    _stats: RouterStats = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _random: random.Random = PrivateAttr(default_factory=random.Random)
+
+    def model_post_init(self, context: Any) -> None:
+        if not self.targets:
+            raise ValueError("targets 不能为空")
+        names = self.names or [_target_name(target) for target in self.targets]
+        if len(names) != len(self.targets):
+            raise ValueError("names 与 targets 的数量不一致")
+        self._stats = RouterStats(targets=[TargetStats(name) for name in names])
+
+    @property
+    def stats(self) -> RouterStats:
+        return self._stats
+
+    @property
+    def _llm_type(self) -> str:
+        return "latency-router"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {"targets": [stats.name for stats in self._stats.targets]}
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> Any:
+        # 各目标都是 OpenAI 兼容接口，由第一个目标转换工具格式，作为调用参数传给选中的目标
+        return self.bind(**self.targets[0].bind_tools(tools, **kwargs).kwargs)
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        def start(index: int) -> Callable[[], Any]:
+            return lambda: self.targets[index].invoke(messages, stop=stop, **kwargs)
+
+        message = self._race(start, "latency")
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        async def call(index: int) -> Any:
+            return await self.targets[index].ainvoke(messages, stop=stop, **kwargs)
+
+        message = await self._arace(call, "latency")
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        def start(index: int) -> Callable[[], Any]:
+            def first_chunk() -> tuple[Iterator[AIMessageChunk], AIMessageChunk | None]:
+                iterator = iter(self.targets[index].stream(messages, stop=stop, **kwargs))
+                return iterator, next(iterator, None)
+            return first_chunk
+
+        index, started, (iterator, first) = self._race(start, "ttft", with_index=True)
+        try:
+            chunks = iterator if first is None else _prepend(first, iterator)
+            for chunk in chunks:
+                generation = ChatGenerationChunk(message=chunk)
+                if run_manager is not None:
+                    run_manager.on_llm_new_token(generation.text, chunk=generation)
+                yield generation
+        except Exception:
+            self._record(index, time.perf_counter() - started, "latency", ok=False)
+            raise
+        finally:
+            iterator.close()
+        self._record(index, time.perf_counter() - started, "latency", ok=True)
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        async def first_chunk(index: int) -> tuple[AsyncIterator[AIMessageChunk], AIMessageChunk | None]:
+            iterator = aiter(self.targets[index].astream(messages, stop=stop, **kwargs))
+            try:
+                return iterator, await anext(iterator, None)
+            except BaseException:
+                await iterator.aclose()
+                raise
+
+        index, started, (iterator, first) = await self._arace(first_chunk, "ttft", with_index=True)
+        try:
+            if first is not None:
+                generation = ChatGenerationChunk(message=first)
+                if run_manager is not None:
+                    await run_manager.on_llm_new_token(generation.text, chunk=generation)
+                yield generation
+            async for chunk in iterator:
+                generation = ChatGenerationChunk(message=chunk)
+                if run_manager is not None:
+                    await run_manager.on_llm_new_token(generation.text, chunk=generation)
+                yield generation
+        except Exception:
+            self._record(index, time.perf_counter() - started, "latency", ok=False)
+            raise
+        finally:
+            await iterator.aclose()
+        self._record(index, time.perf_counter() - started, "latency", ok=True)
+
+    def _race(self, start: Callable[[int], Callable[[], Any]], metric: str, with_index: bool = False) -> Any:
+        """同步版本：在后台线程中发出请求，超过对冲延迟时发出对冲请求，返回先成功的结果"""
+        order, delay = self._plan(metric)
+        pending: dict[Future, tuple[int, float, bool]] = {}
+        error: BaseException | None = None
+
+        def launch(hedged: bool) -> None:
+            index = order.pop(0)
+            future = _spawn(start(index))
+            pending[future] = (index, time.perf_counter(), hedged)
+            self._count(index, hedged)
+
+        launch(False)
+        while pending:
+            timeout = delay if order and delay is not None else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                delay = None  # 每个请求最多对冲一次
+                launch(True)
+                continue
+            for future in done:
+                index, started, hedged = pending.pop(future)
+                elapsed = time.perf_counter() - started
+                if future.exception() is not None:
+                    error = future.exception()
+                    self._record(index, elapsed, metric, ok=False)
+                    continue
+                self._record(index, elapsed, metric, ok=True)
+                self._win(index, hedged)
+                for loser, (other, other_started, _) in pending.items():
+                    # 线程中的调用无法中断，完成后记录耗时并丢弃结果（流在这时关闭）
+                    loser.add_done_callback(self._discard(other, other_started, metric))
+                result = future.result()
+                return (index, started, result) if with_index else result
+            if not pending and order:
+                self._failover()
+                launch(False)
+        raise error
+
+    async def _arace(self, call: Callable[[int], Any], metric: str, with_index: bool = False) -> Any:
+        """异步版本：输家的任务被取消，连接立即断开"""
+        order, delay = self._plan(metric)
+        pending: dict[asyncio.Task, tuple[int, float, bool]] = {}
+        error: BaseException | None = None
+
+        def launch(hedged: bool) -> None:
+            index = order.pop(0)
+            task = asyncio.ensure_future(call(index))
+            pending[task] = (index, time.perf_counter(), hedged)
+            self._count(index, hedged)
+
+        launch(False)
+        try:
+            while pending:
+                timeout = delay if order and delay is not None else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    delay = None
+                    launch(True)
+                    continue
+                for task in done:
+                    index, started, hedged = pending.pop(task)
+                    elapsed = time.perf_counter() - started
+                    if task.exception() is not None:
+                        error = task.exception()
+                        self._record(index, elapsed, metric, ok=False)
+                        continue
+                    self._record(index, elapsed, metric, ok=True)
+                    self._win(index, hedged)
+                    result = task.result()
+                    return (index, started, result) if with_index else result
+                if not pending and order:
+                    self._failover()
+                    launch(False)
+            raise error
+        finally:
+            # 输家（以及调用者被取消时的所有请求）按已经等待的时间计入样本
+            for task, (index, started, _) in pending.items():
+                if not task.done():
+                    task.cancel()
+                elif task.exception() is not None:
+                    self._record(index, time.perf_counter() - started, metric, ok=False)
+                    continue
+                elif metric == "ttft":
+                    # 与赢家同时拿到首块的流
+                    asyncio.ensure_future(task.result()[0].aclose())
+                self._record(index, time.perf_counter() - started, metric, ok=True)
+
+    def _plan(self, metric: str) -> tuple[list[int], float | None]:
+        """返回 (目标的尝试顺序, 对冲延迟)"""
+        now = time.monotonic()
+        with self._lock:
+            targets = self._stats.targets
+
+            def score(index: int) -> tuple[bool, float]:
+                stats = targets[index]
+                unhealthy = stats.consecutive_failures >= self.max_failures and now - stats.last_failure < self.cooldown
+                value = getattr(stats, f"ewma_{metric}")
+                return unhealthy, 0.0 if value is None else value
+
+            order = sorted(range(len(targets)), key=score)
+            if len(order) > 1 and self._random.random() < self.explore_rate:
+                order.insert(0, order.pop(self._random.randrange(1, len(order))))
+            samples = list(targets[order[0]].latencies if metric == "latency" else targets[order[0]].ttfts)
+        delay = None
+        if self.hedge:
+            if len(samples) >= self.min_samples:
+                delay = _percentile(samples, self.hedge_percentile)
+            else:
+                delay = self.hedge_delay
+        # 只有一个目标时对冲发给同一个目标
+        order += [] if len(order) > 1 else order[:1]
+        return order, delay
+
+    def _count(self, index: int, hedged: bool) -> None:
+        with self._lock:
+            self._stats.targets[index].requests += 1
+            if hedged:
+                self._stats.targets[index].hedges += 1
+                self._stats.hedged += 1
+
+    def _win(self, index: int, hedged: bool) -> None:
+        with self._lock:
+            self._stats.requests += 1
+            self._stats.targets[index].wins += 1
+            if hedged:
+                self._stats.hedge_wins += 1
+
+    def _failover(self) -> None:
+        with self._lock:
+            self._stats.failovers += 1
+
+    def _record(self, index: int, elapsed: float, metric: str, ok: bool) -> None:
+        with self._lock:
+            stats = self._stats.targets[index]
+            if not ok:
+                stats.errors += 1
+                stats.consecutive_failures += 1
+                stats.last_failure = time.monotonic()
+                return
+            stats.consecutive_failures = 0
+            if metric == "latency":
+                stats.latencies.append(elapsed)
+                stats.ewma_latency = _ewma(stats.ewma_latency, elapsed, self.alpha)
+            else:
+                stats.ttfts.append(elapsed)
+                stats.ewma_ttft = _ewma(stats.ewma_ttft, elapsed, self.alpha)
+
+    def _discard(self, index: int, started: float, metric: str) -> Callable[[Future], None]:
+        def callback(future: Future) -> None:
+            self._record(index, time.perf_counter() - started, metric, ok=future.exception() is None)
+            if future.exception() is None and metric == "ttft":
+                future.result()[0].close()
+        return callback
+
+
+def _spawn(call: Callable[[], Any]) -> Future:
+    """在新的守护线程中执行 call，输家的线程不占用线程池"""
+    future: Future = Future()
+
+    def run() -> None:
+        try:
+            future.set_result(call())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def _prepend(first: AIMessageChunk, rest: Iterator[AIMessageChunk]) -> Iterator[AIMessageChunk]:
+    yield first
+    yield from rest
+
+
+def _ewma(current: float | None, sample: float, alpha: float) -> float:
+    return sample if current is None else alpha * sample + (1 - alpha) * current
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(q / 100 * len(ordered))) - 1]
+
+
+def _target_name(target: BaseChatModel) -> str:
+    model = getattr(target, "model_name", None) or getattr(target, "model", None) or target._llm_type
+    base_url = getattr(target, "openai_api_base", None)
+    return f"{model}@{base_url}" if base_url else str(model)
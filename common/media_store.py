@@ -0,0 +1,407 @@
+"""
+按内容寻址、延迟编码的多模态内容
+
+messages/multimodal.py 中的图片、音频、视频以 base64 字符串直接放进 HumanMessage，
+同一张图片在多轮对话、多个用户之间反复发送时，每次都要在 Python 字符串中保存一份编码结果，
+每一轮 LangChain 转换和 SDK 序列化请求体时又各复制一遍，内存和 CPU 随对话轮数增长。
+
+MediaStore 以内容的 SHA-256 登记本地文件或字节：
+- store.block(path) 返回的内容块中只有一个占位符 "media:sha256:<hash>"，消息本身很小
+- MediaConversation 发送时把请求体拆成普通字节和媒体片段，通过 MediaBody 流式写入请求，
+  媒体内容在发送时才编码为 data URL：文件通过 mmap 读取，按块编码，不需要把整个文件读入内存
+- 编码结果按内容哈希放进 LRU（max_encoded_bytes 为总大小上限），同一对话中多次引用、
+  以及其他对话引用同一内容时都直接复用；超过上限的内容每次发送时从 mmap 重新按块编码
+- 请求体的长度可以提前算出（base64 长度只取决于原始大小），以 Content-Length 发送；
+  MediaBody 可以 seek，同步、异步请求在 SDK 重试时都会回到开头重新发送
+
+用法:
+    store = MediaStore()
+    conversation = MediaConversation([SystemMessage("你是一个图片分析助手。")], store=store)
+    conversation.append(HumanMessage(content=[
+        {"type": "text", "text": "描述这张图片的内容。"},
+        store.block("photos/cat.jpg"),
+    ]))
+    response = conversation.invoke(model)
+    print(store.stats)
+"""
+import binascii
+import bisect
+import contextlib
+import hashlib
+import io
+import mimetypes
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Iterable, Iterator
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_openai.chat_models.base import BaseChatOpenAI
+from openai.types.chat import ChatCompletion
+
+from common.conversation import _JSON_HEADERS, Conversation, _body, _request_params, _unwrap
+
+# 请求体中的占位符（包括 JSON 字符串的引号）
+_PLACEHOLDER = re.compile(rb'"media:sha256:([0-9a-f]{64})"')
+# 每次编码的原始字节数（3 的倍数，编码结果没有填充）
+_ENCODE_CHUNK = 3 * 2**16
+
+
+@dataclass(frozen=True)
+class MediaRef:
+    """登记在 MediaStore 中的一段内容"""
+    digest: str
+    mime_type: str
+    size: int
+    path: str | None = None
+    data: bytes | None = None
+
+    @property
+    def placeholder(self) -> str:
+        return f"media:sha256:{self.digest}"
+
+    @property
+    def prefix(self) -> bytes:
+        return f'"data:{self.mime_type};base64,'.encode("ascii")
+
+    @property
+    def encoded_size(self) -> int:
+        """base64 编码后的字节数"""
+        return (self.size + 2) // 3 * 4
+
+    def block(self) -> dict:
+        """引用这段内容的 OpenAI 格式内容块，类型由 MIME 决定"""
+        kind = self.mime_type.split("/", 1)[0]
+        if kind == "image":
+            return {"type": "image_url", "image_url": {"url": self.placeholder}}
+        if kind == "video":
+            return {"type": "video_url", "video_url": {"url": self.placeholder}}
+        if kind == "audio":
+            audio_format = self.mime_type.split("/", 1)[1].removeprefix("x-")
+            return {"type": "input_audio", "input_audio": {"data": self.placeholder, "format": audio_format}}
+        raise ValueError(f"不支持的 MIME 类型: {self.mime_type}")
+
+
+@dataclass
+class MediaStats:
+    """编码缓存的统计"""
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    # 实际执行 base64 编码的原始字节数
+    encoded_bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class MediaStore:
+    """按内容哈希登记媒体，并缓存最近使用的编码结果"""
+
+    def __init__(self, max_encoded_bytes: int = 64 * 2**20):
+        """
+        Args:
+            max_encoded_bytes: 编码结果缓存的总大小上限（字节），0 表示不缓存，每次发送时重新编码
+        """
+        self.max_encoded_bytes = max_encoded_bytes
+        self.stats = MediaStats()
+        self._refs: dict[str, MediaRef] = {}
+        # 文件路径 -> ((mtime, size), digest)，同一个文件重复登记时不用重新计算哈希
+        self._paths: dict[str, tuple[tuple[int, int], str]] = {}
+        self._encoded: OrderedDict[str, bytes | bytearray] = OrderedDict()
+        self._encoded_total = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._refs)
+
+    def add(self, source: str | os.PathLike | bytes, mime_type: str | None = None) -> MediaRef:
+        """登记文件路径或字节，相同的内容只保存一份"""
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            data = bytes(source)
+            digest = hashlib.sha256(data).hexdigest()
+            if mime_type is None:
+                raise ValueError("字节内容需要指定 mime_type")
+            return self._register(MediaRef(digest, mime_type, len(data), data=data))
+
+        path = os.path.abspath(source)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        mime_type = mime_type or mimetypes.guess_type(path)[0]
+        if mime_type is None:
+            raise ValueError(f"无法根据文件名判断 MIME 类型，请指定 mime_type: {path}")
+        cached = self._paths.get(path)
+        if cached is not None and cached[0] == version and cached[1] in self._refs:
+            digest = cached[1]
+        else:
+            with _mapped(path, stat.st_size) as view:
+                digest = hashlib.sha256(view).hexdigest()
+            self._paths[path] = (version, digest)
+        return self._register(MediaRef(digest, mime_type, stat.st_size, path=path))
+
+    def block(self, source: str | os.PathLike | bytes, mime_type: str | None = None) -> dict:
+        """登记内容并返回引用它的内容块，可以直接放进 HumanMessage 的 content"""
+        return self.add(source, mime_type).block()
+
+    def ref(self, digest: str) -> MediaRef:
+        try:
+            return self._refs[digest]
+        except KeyError:
+            raise KeyError(f"内容 {digest[:12]}… 没有在这个 MediaStore 中登记") from None
+
+    def encoded(self, digest: str) -> bytes | bytearray | None:
+        """缓存的编码结果，没有时返回 None"""
+        with self._lock:
+            value = self._encoded.get(digest)
+            if value is None:
+                self.stats.misses += 1
+                return None
+            self._encoded.move_to_end(digest)
+            self.stats.hits += 1
+            return value
+
+    def clear(self) -> None:
+        """清空编码缓存，登记的内容保留"""
+        with self._lock:
+            self._encoded.clear()
+            self._encoded_total = 0
+
+    def _register(self, ref: MediaRef) -> MediaRef:
+        # 相同内容保留最先登记的来源（和 MIME 类型）
+        return self._refs.setdefault(ref.digest, ref)
+
+    def _fits(self, ref: MediaRef) -> bool:
+        return ref.encoded_size <= self.max_encoded_bytes
+
+    def _put(self, digest: str, value: bytes | bytearray) -> None:
+        with self._lock:
+            if digest in self._encoded:
+                return
+            self._encoded[digest] = value
+            self._encoded_total += len(value)
+            while self._encoded_total > self.max_encoded_bytes:
+                _, evicted = self._encoded.popitem(last=False)
+                self._encoded_total -= len(evicted)
+                self.stats.evictions += 1
+
+
+class MediaBody(io.RawIOBase):
+    """由普通字节和媒体片段组成的请求体，读取时才编码媒体内容
+
+    可以 seek（httpx 据此得到 Content-Length，openai SDK 重试时回到开头重新读取），
+    异步请求通过 async_stream() 发送，同样可以重试。
+    每个媒体片段第一次读取时查一次缓存：命中时直接复制缓存的编码结果，
+    否则从 mmap 按块编码，从头顺序读完时把结果放进缓存。
+    """
+
+    def __init__(self, store: MediaStore, segments: Iterable[bytes | MediaRef]):
+        super().__init__()
+        self.store = store
+        self._segments: list[bytes | MediaRef] = []
+        self._starts: list[int] = []
+        length = 0
+        for segment in segments:
+            self._segments.append(segment)
+            self._starts.append(length)
+            length += len(segment) if isinstance(segment, bytes) else segment.encoded_size
+        self.length = length
+        self._pos = 0
+        # digest -> 缓存的编码结果 / 打开的原始内容 / 正在顺序填充的编码结果
+        self._cached: dict[str, bytes | bytearray | None] = {}
+        self._views: dict[str, memoryview] = {}
+        self._mmaps: list[mmap.mmap] = []
+        self._filling: dict[str, bytearray] = {}
+
+    def __len__(self) -> int:
+        return self.length
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.length
+        if offset < 0:
+            raise ValueError("seek 位置不能为负")
+        if offset != self._pos:
+            # 不再是顺序读取，放弃正在填充的缓存
+            self._filling.clear()
+        self._pos = offset
+        return offset
+
+    def readinto(self, buffer) -> int:
+        target = memoryview(buffer).cast("B")
+        written = 0
+        while written < len(target) and self._pos < self.length:
+            index = bisect.bisect_right(self._starts, self._pos) - 1
+            segment = self._segments[index]
+            offset = self._pos - self._starts[index]
+            want = len(target) - written
+            if isinstance(segment, bytes):
+                piece = segment[offset:offset + want]
+            else:
+                piece = self._media_range(segment, offset, min(offset + want, segment.encoded_size))
+            target[written:written + len(piece)] = piece
+            written += len(piece)
+            self._pos += len(piece)
+        return written
+
+    def async_stream(self) -> "_AsyncMediaBody":
+        """用于 AsyncClient 的请求体，见 _AsyncMediaBody"""
+        return _AsyncMediaBody(self)
+
+    def close(self) -> None:
+        for view in self._views.values():
+            view.release()
+        self._views.clear()
+        for view in self._mmaps:
+            view.close()
+        self._mmaps.clear()
+        super().close()
+
+    def _media_range(self, ref: MediaRef, start: int, stop: int) -> bytes | bytearray:
+        digest = ref.digest
+        if digest not in self._cached:
+            self._cached[digest] = self.store.encoded(digest)
+        cached = self._cached[digest]
+        if cached is not None:
+            return cached[start:stop]
+        # base64 每 3 个原始字节对应 4 个字符，按 4 字节边界对齐后编码，再截取需要的部分
+        first, last = start // 4, min(-(-stop // 4), start // 4 + _ENCODE_CHUNK // 3)
+        raw = self._view(ref)[first * 3:last * 3]
+        encoded = binascii.b2a_base64(raw, newline=False)
+        self.store.stats.encoded_bytes += len(raw)
+        piece = encoded[start - first * 4:stop - first * 4]
+
+        if self.store._fits(ref):
+            filling = self._filling.setdefault(digest, bytearray()) if start == 0 else self._filling.get(digest)
+            if filling is not None and len(filling) == start:
+                filling += piece
+                if len(filling) == ref.encoded_size:
+                    del self._filling[digest]
+                    self.store._put(digest, filling)
+                    self._cached[digest] = filling
+        return piece
+
+    def _view(self, ref: MediaRef) -> memoryview:
+        view = self._views.get(ref.digest)
+        if view is None:
+            if ref.data is not None:
+                view = memoryview(ref.data)
+            elif ref.size == 0:
+                view = memoryview(b"")
+            else:
+                with open(ref.path, "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mmaps.append(mapped)
+                view = memoryview(mapped)
+            self._views[ref.digest] = view
+        return view
+
+
+class MediaConversation(Conversation):
+    """请求体中的媒体占位符在发送时才展开为 data URL 的 Conversation"""
+
+    def __init__(self, messages: Iterable[BaseMessage | dict | str] = (), *, store: MediaStore | None = None):
+        self.store = store if store is not None else MediaStore()
+        super().__init__(messages)
+
+    def request_stream(self, model: BaseChatOpenAI, **kwargs: Any) -> MediaBody:
+        """与 request_body 相同的请求体，媒体内容在读取时才编码；用完需要 close()"""
+        model, kwargs = _unwrap(model, kwargs)
+        return self._media_body(_request_params(model, kwargs))
+
+    def request_body(self, model: BaseChatOpenAI, **kwargs: Any) -> bytes:
+        with self.request_stream(model, **kwargs) as body:
+            return body.read()
+
+    def invoke(self, model: BaseChatOpenAI, **kwargs: Any) -> AIMessage:
+        model, kwargs = _unwrap(model, kwargs)
+        with self._media_body(_request_params(model, kwargs)) as body:
+            response = model.root_client.post(
+                "/chat/completions",
+                cast_to=ChatCompletion,
+                content=body,
+                options={"headers": _JSON_HEADERS},
+            )
+        return self._add_response(model, response)
+
+    async def ainvoke(self, model: BaseChatOpenAI, **kwargs: Any) -> AIMessage:
+        model, kwargs = _unwrap(model, kwargs)
+        with self._media_body(_request_params(model, kwargs)) as body:
+            # 异步可迭代的请求体 httpx 默认分块发送，这里直接给出长度
+            response = await model.root_async_client.post(
+                "/chat/completions",
+                cast_to=ChatCompletion,
+                content=body.async_stream(),
+                options={"headers": {**_JSON_HEADERS, "Content-Length": str(len(body))}},
+            )
+        return self._add_response(model, response)
+
+    def _media_body(self, params: bytes) -> MediaBody:
+        return MediaBody(self.store, self._segments(_body(self._request_parts(), params)))
+
+    def _segments(self, body: bytes) -> list[bytes | MediaRef]:
+        """按占位符把请求体拆成 [字节, 媒体, 字节, ...]，每个媒体片段前后加上 data URL 的前缀和引号"""
+        segments: list[bytes | MediaRef] = []
+        position = 0
+        for match in _PLACEHOLDER.finditer(body):
+            ref = self.store.ref(match.group(1).decode("ascii"))
+            segments.append(body[position:match.start()] + ref.prefix)
+            segments.append(ref)
+            position = match.end() - 1  # 保留结束的引号
+        segments.append(body[position:])
+        return segments
+
+
+class _AsyncMediaBody:
+    """MediaBody 的异步视图
+
+    httpx 的异步请求只接受异步可迭代对象（MediaBody 本身是同步可迭代的，会被当作同步请求体）；
+    openai SDK 只会重放 bytes、list 或可以 seek 的请求体，异步生成器只能发送一次，重试会被跳过。
+    这里只提供 __aiter__ 和 read/seek/tell：SDK 重试前 seek 回开头，每次 __aiter__ 都从当前位置重新读取。
+    """
+
+    def __init__(self, body: MediaBody, chunk_size: int = 2**16):
+        self.body = body
+        self.chunk_size = chunk_size
+
+    def read(self, size: int = -1) -> bytes:
+        return self.body.read(size)
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self.body.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.body.tell()
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while chunk := self.body.read(self.chunk_size):
+            yield chunk
+
+
+@contextlib.contextmanager
+def _mapped(path: str, size: int) -> Iterator[mmap.mmap | bytes]:
+    """只读 mmap 整个文件（空文件不能 mmap，返回 b""）"""
+    if not size:
+        yield b""
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield mapped
@@ -0,0 +1,691 @@
+"""
+本地 OpenAI 兼容接口的模拟服务
+
+用于在不访问 dashscope.aliyuncs.com 的情况下运行示例和基准测试。
+服务基于 asyncio 实现，支持 HTTP/1.1 keep-alive，并统计 TCP 连接数，
+便于观察客户端是否复用了连接。
+
+支持的 /v1/chat/completions 功能:
+- 普通调用和 SSE 流式输出（stream_options.include_usage 时在最后返回用量）
+- 工具调用：请求中带 tools 且最后一条消息不是工具结果时，返回 tool_calls，参数按 JSON Schema 生成
+- JSON 模式：response_format 为 json_object / json_schema 时，返回符合 schema 的 JSON；
+  schema 中带 index 字段的对象数组按最后一条用户消息中 "[编号] " 开头的行逐行生成（模拟打包抽取），
+  invalid_item_rate 控制其中字段类型错误的条目比例
+- 用量：prompt_tokens 按消息字符数加上 tools / response_format 的 schema 估算
+- 可配置首 token 延迟 (ttft)、token 间隔 (token_delay) 和错误率 (error_rate)
+- 慢请求：按 slow_rate 的概率在生成前额外等待 slow_latency，模拟偶发的长尾延迟
+- 限流：rpm_limit / tpm_limit 按秒平摊（每秒 limit/60），超出时返回 429 和 Retry-After，
+  超过一秒额度的请求在桶满时放行；
+  max_concurrency 限制同时生成的请求数，超出的请求排队，延迟随之升高
+- 请求体：upload_bandwidth 按请求体大小模拟上传时间，超过 max_request_bytes 时返回 413
+
+批量接口（/v1/files 和 /v1/batches，与 OpenAI / DashScope 的 Batch API 一致）:
+- POST /files 上传 JSONL 输入文件（multipart），GET /files/{id} 和 /files/{id}/content 读取文件
+- POST /batches 创建任务，GET /batches/{id} 查询状态，POST /batches/{id}/cancel 取消
+- 任务依次经过 validating → in_progress → finalizing → completed，batch_latency 为处理全部请求的总时长；
+  成功的结果写入 output_file_id，失败的（按 error_rate）写入 error_file_id；取消时保留已完成部分
+
+用法:
+    with MockServer(ttft=0.05, token_delay=0.01) as server:
+        model = get_chat_model(base_url=server.base_url, api_key="mock")
+
+也可以单独启动，或用 spawn_mock_server 在子进程中运行（避免与客户端争用 GIL，压测时更准确）:
+    python common/mock_server.py --port 8000 --ttft 0.2
+
+    with spawn_mock_server(latency=0.2) as base_url:
+        ...
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import math
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+
+# 工具参数中 location/city 字段的示例取值，依次轮换
+_SAMPLE_CITIES = ["北京", "上海", "广州", "巴黎"]
+# 打包抽取的输入行: "[3] 盗梦空间"
+_INDEXED_LINE = re.compile(r"^\[(\d+)\] ", re.MULTILINE)
+
+
+class MockServer:
+    """在后台线程中运行的 /v1/chat/completions 模拟服务"""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        connect_latency: float = 0.0,
+        ttft: float = 0.0,
+        token_delay: float = 0.0,
+        error_rate: float = 0.0,
+        output_tokens: int = 0,
+        tool_call_count: int = 1,
+        invalid_item_rate: float = 0.0,
+        upload_bandwidth: float = 0.0,
+        max_request_bytes: int = 0,
+        slow_rate: float = 0.0,
+        slow_latency: float = 0.0,
+        rpm_limit: int = 0,
+        tpm_limit: int = 0,
+        max_concurrency: int = 0,
+        batch_latency: float = 0.0,
+        seed: int | None = None,
+    ):
+        """
+        Args:
+            latency: 每个请求在生成前的固定处理延迟（秒）
+            connect_latency: 新连接上第一个请求的额外延迟，模拟 TCP/TLS 握手往返
+            ttft: 首 token 延迟（秒）
+            token_delay: 之后每个 token 的间隔（秒），非流式请求会等待同样的总时长
+            error_rate: 返回 500 错误的概率
+            output_tokens: 文本回复的 token 数，0 表示使用默认回复 "模拟回复：<问题>"
+            tool_call_count: 每次返回的工具调用数量，超过可用工具数时轮换使用
+            invalid_item_rate: 打包抽取时，每个条目中出现类型错误的概率
+            upload_bandwidth: 模拟的上传带宽（字节/秒），每个请求先等待 请求体大小 / 带宽，0 表示不限
+            max_request_bytes: 请求体大小上限，超过时返回 413，0 表示不限
+            slow_rate: 慢请求的概率
+            slow_latency: 慢请求在生成前额外等待的时间（秒）
+            rpm_limit: 每分钟请求数上限，按秒平摊，0 表示不限
+            tpm_limit: 每分钟 token 数上限（输入 + 预计输出），按秒平摊，0 表示不限
+            max_concurrency: 同时生成的请求数上限，超出的请求排队，0 表示不限
+            batch_latency: 批量任务从开始处理到完成的总时长（秒），按请求数平摊
+            seed: 随机数种子，用于复现错误注入
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.output_tokens = output_tokens
+        self.tool_call_count = tool_call_count
+        self.invalid_item_rate = invalid_item_rate
+        self.upload_bandwidth = upload_bandwidth
+        self.max_request_bytes = max_request_bytes
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.max_concurrency = max_concurrency
+        self.batch_latency = batch_latency
+        # 统计信息：connections 为累计建立的 TCP 连接数，requests 为累计请求数
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        # 限流的令牌桶: [剩余请求数, 剩余 token 数, 上次补充的时间]
+        self._bucket = [rpm_limit / 60, tpm_limit / 60, time.monotonic()]
+        self._slots = None
+        self._ids = itertools.count(1)
+        # 批量接口的文件和任务，按 id 保存在内存中
+        self._files: dict[str, dict] = {}
+        self._batches: dict[str, dict] = {}
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self._run, name="mock-server", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    def reset_stats(self) -> None:
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        if self.max_concurrency:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle_connection, self.host, self.port, backlog=4096)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            for task in asyncio.all_tasks(self._loop):
+                task.cancel()
+            self._loop.run_until_complete(asyncio.sleep(0))
+            self._loop.close()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        first = True
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                self.requests += 1
+                if first and self.connect_latency:
+                    await asyncio.sleep(self.connect_latency)
+                first = False
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._dispatch(method, path, headers, body, writer)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, headers: dict, body: bytes, writer: asyncio.StreamWriter) -> None:
+        if self.upload_bandwidth:
+            await asyncio.sleep(len(body) / self.upload_bandwidth)
+        if self.max_request_bytes and len(body) > self.max_request_bytes:
+            self.errors += 1
+            message = f"请求体 {len(body)} 字节，超过上限 {self.max_request_bytes} 字节"
+            await _write_json(writer, 413, {"error": {"message": message, "type": "invalid_request_error"}})
+        elif method == "POST" and path.endswith("/chat/completions"):
+            payload = json.loads(body or b"{}")
+            retry_after = self._throttle(payload)
+            if retry_after is not None:
+                self.throttled += 1
+                error = {"error": {"message": "请求过于频繁，请稍后再试", "type": "rate_limit_error"}}
+                retry = {"Retry-After": str(math.ceil(retry_after)), "retry-after-ms": str(int(retry_after * 1000))}
+                await _write_json(writer, 429, error, retry)
+                return
+            async with self._slots or contextlib.nullcontext():
+                await self._generate(payload, writer)
+        elif "/files" in path or "/batches" in path:
+            await self._batch_api(method, path, headers, body, writer)
+        else:
+            await _write_json(writer, 404, {"error": {"message": f"{method} {path} not found"}})
+
+    async def _batch_api(self, method: str, path: str, headers: dict, body: bytes, writer: asyncio.StreamWriter) -> None:
+        parts = path.split("?", 1)[0].rstrip("/").split("/")
+        resource = "files" if "files" in parts else "batches"
+        rest = parts[parts.index(resource) + 1:]
+        store = self._files if resource == "files" else self._batches
+        if rest and rest[0] not in store:
+            await _write_json(writer, 404, {"error": {"message": f"{rest[0]} 不存在", "type": "invalid_request_error"}})
+        elif resource == "files" and method == "POST" and not rest:
+            form = _parse_multipart(body, headers.get("content-type", ""))
+            file = {
+                "id": f"file-mock-{next(self._ids)}",
+                "object": "file",
+                "bytes": len(form["file"][1]),
+                "created_at": int(time.time()),
+                "filename": form["file"][0],
+                "purpose": form.get("purpose", (None, b"batch"))[1].decode(),
+                "status": "processed",
+            }
+            self._files[file["id"]] = {**file, "content": form["file"][1]}
+            await _write_json(writer, 200, file)
+        elif resource == "files" and method == "GET" and len(rest) == 2 and rest[1] == "content":
+            content = self._files[rest[0]]["content"]
+            writer.write(
+                f"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n"
+                f"Content-Length: {len(content)}\r\n\r\n".encode("latin-1") + content
+            )
+            await writer.drain()
+        elif resource == "files" and method == "GET" and len(rest) == 1:
+            await _write_json(writer, 200, {k: v for k, v in self._files[rest[0]].items() if k != "content"})
+        elif resource == "batches" and method == "POST" and not rest:
+            payload = json.loads(body or b"{}")
+            if payload.get("input_file_id") not in self._files:
+                await _write_json(writer, 400, {"error": {"message": "input_file_id 不存在", "type": "invalid_request_error"}})
+                return
+            now = int(time.time())
+            batch = {
+                "id": f"batch-mock-{next(self._ids)}",
+                "object": "batch",
+                "endpoint": payload.get("endpoint", "/v1/chat/completions"),
+                "errors": None,
+                "input_file_id": payload["input_file_id"],
+                "completion_window": payload.get("completion_window", "24h"),
+                "status": "validating",
+                "output_file_id": None,
+                "error_file_id": None,
+                "created_at": now,
+                "in_progress_at": None,
+                "expires_at": now + 86400,
+                "finalizing_at": None,
+                "completed_at": None,
+                "failed_at": None,
+                "expired_at": None,
+                "cancelling_at": None,
+                "cancelled_at": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                "metadata": payload.get("metadata"),
+            }
+            self._batches[batch["id"]] = batch
+            asyncio.get_running_loop().create_task(self._run_batch(batch))
+            await _write_json(writer, 200, batch)
+        elif resource == "batches" and method == "GET" and len(rest) == 1:
+            await _write_json(writer, 200, self._batches[rest[0]])
+        elif resource == "batches" and method == "POST" and len(rest) == 2 and rest[1] == "cancel":
+            batch = self._batches[rest[0]]
+            if batch["status"] in ("validating", "in_progress"):
+                batch.update(status="cancelling", cancelling_at=int(time.time()))
+            await _write_json(writer, 200, batch)
+        else:
+            await _write_json(writer, 404, {"error": {"message": f"{method} {path} not found"}})
+
+    async def _run_batch(self, batch: dict) -> None:
+        """在后台逐条处理批量任务的输入文件，结果按完成顺序写入输出文件和错误文件"""
+        lines = self._files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+        requests, errors, seen = [], [], set()
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                custom_id = request["custom_id"]
+            except (ValueError, KeyError, TypeError):
+                errors.append({"code": "invalid_json_line", "message": "无法解析的 JSON 行或缺少 custom_id", "line": number})
+                continue
+            if custom_id in seen:
+                errors.append({"code": "duplicate_custom_id", "message": f"重复的 custom_id: {custom_id}", "line": number})
+            elif request.get("url") != batch["endpoint"]:
+                errors.append({"code": "invalid_url", "message": f"url 必须为 {batch['endpoint']}", "line": number})
+            seen.add(custom_id)
+            requests.append(request)
+        await asyncio.sleep(0.01)
+        if errors or not requests:
+            errors = errors or [{"code": "empty_file", "message": "输入文件为空", "line": None}]
+            batch.update(status="failed", failed_at=int(time.time()), errors={"object": "list", "data": errors})
+            return
+        batch["request_counts"]["total"] = len(requests)
+        if batch["status"] == "validating":
+            batch.update(status="in_progress", in_progress_at=int(time.time()))
+        output, failed = [], []
+        for request in requests:
+            if batch["status"] != "in_progress":
+                break
+            if self.batch_latency:
+                await asyncio.sleep(self.batch_latency / len(requests))
+            payload = request.get("body") or {}
+            if self.error_rate and self._random.random() < self.error_rate:
+                status, body = 500, {"error": {"message": "模拟服务错误", "type": "server_error"}}
+                batch["request_counts"]["failed"] += 1
+            else:
+                status, body = 200, self._completion(payload, self._plan(payload))
+                batch["request_counts"]["completed"] += 1
+            result = {
+                "id": f"batch_req_mock_{next(self._ids)}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": status, "request_id": f"req-mock-{next(self._ids)}", "body": body},
+                "error": None,
+            }
+            (output if status == 200 else failed).append(json.dumps(result, ensure_ascii=False))
+        cancelled = batch["status"] == "cancelling"
+        if not cancelled:
+            batch.update(status="finalizing", finalizing_at=int(time.time()))
+        for key, rows, name in (("output_file_id", output, "output"), ("error_file_id", failed, "errors")):
+            if rows:
+                content = ("\n".join(rows) + "\n").encode("utf-8")
+                file_id = f"file-mock-{next(self._ids)}"
+                self._files[file_id] = {
+                    "id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                    "filename": f"{batch['id']}_{name}.jsonl", "purpose": "batch_output", "status": "processed",
+                    "content": content,
+                }
+                batch[key] = file_id
+        if cancelled:
+            batch.update(status="cancelled", cancelled_at=int(time.time()))
+        else:
+            batch.update(status="completed", completed_at=int(time.time()))
+
+    async def _generate(self, payload: dict, writer: asyncio.StreamWriter) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.slow_rate and self._random.random() < self.slow_rate:
+            await asyncio.sleep(self.slow_latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors += 1
+            await _write_json(writer, 500, {"error": {"message": "模拟服务错误", "type": "server_error"}})
+        elif payload.get("stream"):
+            await self._stream_completion(payload, writer)
+        else:
+            plan = self._plan(payload)
+            delay = self.ttft + self.token_delay * max(len(plan["tokens"]) - 1, 0)
+            if delay:
+                await asyncio.sleep(delay)
+            await _write_json(writer, 200, self._completion(payload, plan))
+
+    def _throttle(self, payload: dict) -> float | None:
+        """按令牌桶扣除请求数和 token 数，超出限额时返回需要等待的秒数"""
+        if not self.rpm_limit and not self.tpm_limit:
+            return None
+        requests, tokens, last = self._bucket
+        now = time.monotonic()
+        # 桶容量为一秒的额度，与按秒平摊的限流一致
+        if self.rpm_limit:
+            requests = min(self.rpm_limit / 60, requests + (now - last) * self.rpm_limit / 60)
+        if self.tpm_limit:
+            tokens = min(self.tpm_limit / 60, tokens + (now - last) * self.tpm_limit / 60)
+        cost = self._usage(payload, self.output_tokens or len(_last_user_text(payload.get("messages", []))) + 5)
+        # 超过一秒额度的请求（RPM 低于 60，或大请求）在桶满时放行，与 AdaptiveLimiter 一致
+        needed_requests = min(1, self.rpm_limit / 60)
+        needed_tokens = min(cost["total_tokens"], self.tpm_limit / 60)
+        waits = []
+        if self.rpm_limit and requests < needed_requests:
+            waits.append((needed_requests - requests) * 60 / self.rpm_limit)
+        if self.tpm_limit and tokens < needed_tokens:
+            waits.append((needed_tokens - tokens) * 60 / self.tpm_limit)
+        if waits:
+            self._bucket = [requests, tokens, now]
+            return max(waits)
+        self._bucket = [requests - 1, tokens - cost["total_tokens"], now]
+        return None
+
+    def _plan(self, payload: dict) -> dict:
+        """决定回复内容：文本 token 列表，或工具调用列表（tokens 为切分后的参数片段）"""
+        messages = payload.get("messages", [])
+        tools = payload.get("tools") or []
+        forced = payload.get("tool_choice")
+        if tools and (isinstance(forced, dict) or not messages or messages[-1].get("role") != "tool"):
+            count = self.tool_call_count
+            if isinstance(forced, dict):
+                # 强制调用某个工具（如 with_structured_output 的 function_calling 方式）时只返回一个调用
+                name = forced["function"]["name"]
+                tools = [t for t in tools if t["function"]["name"] == name] or tools
+                count = 1
+            calls = []
+            for i in range(count):
+                function = tools[i % len(tools)]["function"]
+                arguments = json.dumps(_sample_from_schema(function.get("parameters", {}), i), ensure_ascii=False)
+                calls.append({"id": f"call_mock_{next(self._ids)}", "name": function["name"], "arguments": arguments})
+            return {"tool_calls": calls, "tokens": [p for call in calls for p in _split(call["arguments"], 4)]}
+
+        response_format = payload.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"].get("schema", {})
+            value = self._fill_indexed(_sample_from_schema(schema), _last_user_text(messages))
+            return {"tokens": _split(json.dumps(value, ensure_ascii=False), 4)}
+        if response_format.get("type") == "json_object":
+            content = json.dumps({"answer": f"模拟回复：{_last_user_text(messages)}"}, ensure_ascii=False)
+            return {"tokens": _split(content, 4)}
+
+        content = f"模拟回复：{_last_user_text(messages)}"
+        if self.output_tokens:
+            return {"tokens": [content[i % len(content)] for i in range(self.output_tokens)]}
+        return {"tokens": list(content)}
+
+    def _fill_indexed(self, value, user_text: str):
+        """把带 index 字段的对象数组展开为每个 "[编号] " 输入行一个条目"""
+        numbers = [int(n) for n in _INDEXED_LINE.findall(user_text)]
+        if not numbers or not isinstance(value, dict):
+            return value
+        for key, items in value.items():
+            if isinstance(items, list) and items and isinstance(items[0], dict) and "index" in items[0]:
+                value[key] = [self._indexed_item(items[0], number) for number in numbers]
+        return value
+
+    def _indexed_item(self, template: dict, number: int) -> dict:
+        item = {**template, "index": number}
+        if self.invalid_item_rate and self._random.random() < self.invalid_item_rate:
+            # 把第一个数值字段换成字符串，模拟模型输出了不符合 schema 的值
+            for key, field in item.items():
+                if key != "index" and isinstance(field, (int, float)) and not isinstance(field, bool):
+                    item[key] = "未知"
+                    break
+        return item
+
+    def _usage(self, payload: dict, completion_tokens: int) -> dict:
+        prompt_tokens = sum(len(_text_of(m.get("content"))) for m in payload.get("messages", []))
+        # schema 按约 4 个字符一个 token 计入
+        for key in ("tools", "response_format"):
+            if payload.get(key):
+                prompt_tokens += len(json.dumps(payload[key], ensure_ascii=False)) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def _completion(self, payload: dict, plan: dict) -> dict:
+        if "tool_calls" in plan:
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {"id": call["id"], "type": "function", "function": {"name": call["name"], "arguments": call["arguments"]}}
+                    for call in plan["tool_calls"]
+                ],
+            }
+            finish_reason = "tool_calls"
+        else:
+            message = {"role": "assistant", "content": "".join(plan["tokens"])}
+            finish_reason = "stop"
+        return {
+            "id": f"chatcmpl-mock-{next(self._ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "qwen-plus"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": self._usage(payload, len(plan["tokens"])),
+        }
+
+    async def _stream_completion(self, payload: dict, writer: asyncio.StreamWriter) -> None:
+        plan = self._plan(payload)
+        base = {
+            "id": f"chatcmpl-mock-{next(self._ids)}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": payload.get("model", "qwen-plus"),
+        }
+
+        async def send(data: dict | bytes) -> None:
+            if isinstance(data, dict):
+                data = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            event = b"data: " + data + b"\n\n"
+            # HTTP/1.1 chunked 编码：每个 SSE 事件作为一个 chunk
+            writer.write(b"%x\r\n%s\r\n" % (len(event), event))
+            await writer.drain()
+
+        def chunk(delta: dict, finish_reason: str | None = None) -> dict:
+            return {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"\r\n"
+        )
+        if self.ttft:
+            await asyncio.sleep(self.ttft)
+        await send(chunk({"role": "assistant", "content": ""}))
+
+        if "tool_calls" in plan:
+            first = True
+            for index, call in enumerate(plan["tool_calls"]):
+                header = {"index": index, "id": call["id"], "type": "function", "function": {"name": call["name"], "arguments": ""}}
+                await send(chunk({"tool_calls": [header]}))
+                for piece in _split(call["arguments"], 4):
+                    if not first and self.token_delay:
+                        await asyncio.sleep(self.token_delay)
+                    first = False
+                    await send(chunk({"tool_calls": [{"index": index, "function": {"arguments": piece}}]}))
+            finish_reason = "tool_calls"
+        else:
+            for i, token in enumerate(plan["tokens"]):
+                if i and self.token_delay:
+                    await asyncio.sleep(self.token_delay)
+                await send(chunk({"content": token}))
+            finish_reason = "stop"
+
+        await send(chunk({}, finish_reason))
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            await send({**base, "choices": [], "usage": self._usage(payload, len(plan["tokens"]))})
+        await send(b"[DONE]")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+async def _read_request(reader: asyncio.StreamReader):
+    """读取一个 HTTP/1.1 请求，连接关闭时返回 None"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    lines = head.decode("latin-1").split("\r\n")
+    method, path, _ = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+async def _write_json(writer: asyncio.StreamWriter, status: int, data: dict, headers: dict | None = None) -> None:
+    body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    extra = "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+    writer.write(
+        f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"{extra}"
+        f"\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+
+
+def _parse_multipart(body: bytes, content_type: str) -> dict[str, tuple[str | None, bytes]]:
+    """解析 multipart/form-data 请求体，返回 {字段名: (文件名, 内容)}"""
+    boundary = content_type.partition("boundary=")[2].strip('"').encode("latin-1")
+    fields = {}
+    for part in body.split(b"--" + boundary)[1:]:
+        if part.startswith(b"--"):
+            break
+        head, _, content = part.removeprefix(b"\r\n").removesuffix(b"\r\n").partition(b"\r\n\r\n")
+        disposition = dict(re.findall(r'(\w+)="([^"]*)"', head.decode("utf-8")))
+        fields[disposition["name"]] = (disposition.get("filename"), content)
+    return fields
+
+
+def _sample_from_schema(schema: dict, seq: int = 0, defs: dict | None = None, name: str = ""):
+    """按 JSON Schema 生成确定性的示例数据，seq 用于让多次工具调用的参数不同"""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return _sample_from_schema(defs[schema["$ref"].rsplit("/", 1)[-1]], seq, defs, name)
+    for key in ("anyOf", "oneOf", "allOf"):
+        if key in schema:
+            options = [s for s in schema[key] if s.get("type") != "null"] or schema[key]
+            return _sample_from_schema(options[0], seq, defs, name)
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = schema.get("type", "object")
+    if kind == "object":
+        properties = schema.get("properties", {})
+        return {key: _sample_from_schema(prop, seq, defs, key) for key, prop in properties.items()}
+    if kind == "array":
+        return [_sample_from_schema(schema.get("items", {}), seq, defs, name)]
+    if kind == "integer":
+        return 2010
+    if kind == "number":
+        return 8.8
+    if kind == "boolean":
+        return True
+    if kind == "null":
+        return None
+    if name in ("location", "city"):
+        return _SAMPLE_CITIES[seq % len(_SAMPLE_CITIES)]
+    return f"示例{name}" if name else "示例"
+
+
+def _split(text: str, size: int) -> list[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def _text_of(content) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return ""
+
+
+def _last_user_text(messages: list) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return _text_of(message.get("content"))
+    return ""
+
+
+@contextlib.contextmanager
+def spawn_mock_server(**options):
+    """在子进程中启动模拟服务，返回 base_url。options 与 MockServer 的参数一致"""
+    args = [sys.executable, __file__, "--port", "0"]
+    for name, value in options.items():
+        args += [f"--{name.replace('_', '-')}", str(value)]
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, text=True)
+    try:
+        # 子进程启动后第一行输出为 base_url
+        yield proc.stdout.readline().strip()
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的固定处理延迟（秒）")
+    parser.add_argument("--connect-latency", type=float, default=0.0, help="新连接的模拟握手延迟（秒）")
+    parser.add_argument("--ttft", type=float, default=0.0, help="首 token 延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="token 间隔（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 错误的概率")
+    parser.add_argument("--output-tokens", type=int, default=0, help="文本回复的 token 数")
+    parser.add_argument("--tool-call-count", type=int, default=1, help="每次返回的工具调用数量")
+    parser.add_argument("--invalid-item-rate", type=float, default=0.0, help="打包抽取中类型错误的条目比例")
+    parser.add_argument("--upload-bandwidth", type=float, default=0.0, help="模拟的上传带宽（字节/秒）")
+    parser.add_argument("--max-request-bytes", type=int, default=0, help="请求体大小上限（字节）")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="慢请求的概率")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="慢请求的额外延迟（秒）")
+    parser.add_argument("--rpm-limit", type=int, default=0, help="每分钟请求数上限")
+    parser.add_argument("--tpm-limit", type=int, default=0, help="每分钟 token 数上限")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="同时生成的请求数上限")
+    parser.add_argument("--batch-latency", type=float, default=0.0, help="批量任务的总处理时长（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子")
+    args = parser.parse_args()
+
+    server = MockServer(**vars(args)).start()
+    print(server.base_url, flush=True)
+    print("模拟服务已启动 (Ctrl+C 退出)", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
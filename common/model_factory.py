@@ -0,0 +1,177 @@
+"""
+共享的模型工厂
+
+各示例脚本不再各自调用 init_chat_model 创建模型，而是统一通过 get_chat_model 获取：
+- 相同的 (model, base_url, 参数) 返回同一个缓存的模型实例
+- 所有模型共用一组 keep-alive 的 httpx 连接池（同步 + 异步），避免每次都重新建立 TCP/TLS 连接
+- 连接池上限可通过 configure_pool() 或环境变量配置
+
+用法:
+    from common.model_factory import get_chat_model
+
+    model = get_chat_model()                      # 默认 qwen-plus + DashScope 兼容接口
+    model = get_chat_model("qwen-max", temperature=0)
+"""
+import asyncio
+import itertools
+import json
+import os
+import threading
+import weakref
+
+import httpx
+from dotenv import load_dotenv
+from langchain.chat_models import init_chat_model
+from langchain_core.language_models import BaseChatModel
+
+load_dotenv()
+
+DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+DEFAULT_MODEL = "qwen-plus"
+
+# 连接池默认配置，可通过环境变量覆盖
+_pool_config = {
+    "max_connections": int(os.getenv("LLM_POOL_MAX_CONNECTIONS", 100)),
+    "max_keepalive_connections": int(os.getenv("LLM_POOL_MAX_KEEPALIVE", 20)),
+    "keepalive_expiry": float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", 60.0)),
+    "timeout": float(os.getenv("LLM_POOL_TIMEOUT", 60.0)),
+}
+
+# 每个异步连接池分片的连接数，见 _LoopLocalTransport
+_CONNECTIONS_PER_SHARD = 8
+
+_lock = threading.Lock()
+_models: dict[tuple, BaseChatModel] = {}
+_http_client: httpx.Client | None = None
+_http_async_client: httpx.AsyncClient | None = None
+
+
+def configure_pool(
+    *,
+    max_connections: int | None = None,
+    max_keepalive_connections: int | None = None,
+    keepalive_expiry: float | None = None,
+    timeout: float | None = None,
+) -> None:
+    """修改连接池配置。已创建的连接池和模型缓存会被关闭并清空，下次获取时按新配置重建。"""
+    updates = {
+        "max_connections": max_connections,
+        "max_keepalive_connections": max_keepalive_connections,
+        "keepalive_expiry": keepalive_expiry,
+        "timeout": timeout,
+    }
+    with _lock:
+        _pool_config.update({k: v for k, v in updates.items() if v is not None})
+    reset()
+
+
+def get_http_clients() -> tuple[httpx.Client, httpx.AsyncClient]:
+    """返回共享的同步、异步 httpx 客户端（首次调用时创建）"""
+    global _http_client, _http_async_client
+    with _lock:
+        if _http_client is None:
+            limits = httpx.Limits(
+                max_connections=_pool_config["max_connections"],
+                max_keepalive_connections=_pool_config["max_keepalive_connections"],
+                keepalive_expiry=_pool_config["keepalive_expiry"],
+            )
+            timeout = httpx.Timeout(_pool_config["timeout"])
+            _http_client = httpx.Client(limits=limits, timeout=timeout)
+            _http_async_client = httpx.AsyncClient(transport=_LoopLocalTransport(limits), timeout=timeout)
+        return _http_client, _http_async_client
+
+
+def get_chat_model(
+    model: str = DEFAULT_MODEL,
+    *,
+    base_url: str = DASHSCOPE_BASE_URL,
+    api_key: str | None = None,
+    **params,
+) -> BaseChatModel:
+    """获取缓存的聊天模型实例
+
+    Args:
+        model: 模型名称，默认 qwen-plus
+        base_url: OpenAI 兼容接口地址，默认 DashScope 北京地域
+        api_key: API Key，默认读取环境变量 DASHSCOPE_API_KEY
+        **params: 其他传给 init_chat_model 的参数，如 temperature、max_tokens
+    """
+    api_key = api_key or os.getenv("DASHSCOPE_API_KEY")
+    key = (model, base_url, api_key, _freeze(params))
+    with _lock:
+        cached = _models.get(key)
+    if cached is not None:
+        return cached
+
+    http_client, http_async_client = get_http_clients()
+    chat_model = init_chat_model(
+        model=model,
+        model_provider="openai",
+        base_url=base_url,
+        api_key=api_key,
+        http_client=http_client,
+        http_async_client=http_async_client,
+        **params,
+    )
+    with _lock:
+        # 并发创建时以先写入的实例为准，保证同一个 key 只对应一个实例
+        return _models.setdefault(key, chat_model)
+
+
+def reset() -> None:
+    """清空模型缓存并关闭共享连接池"""
+    global _http_client, _http_async_client
+    with _lock:
+        _models.clear()
+        client, _http_client = _http_client, None
+        # 异步客户端无法在同步代码中 aclose，这里只丢弃引用，由 GC 回收连接
+        _http_async_client = None
+    if client is not None:
+        client.close()
+
+
+class _LoopLocalTransport(httpx.AsyncBaseTransport):
+    """按事件循环分别维护连接池的异步 transport
+
+    异步连接绑定在创建它的事件循环上，多次 asyncio.run() 之间不能复用。
+    这里为每个事件循环单独创建连接池，事件循环被回收后连接池随之释放。
+
+    httpcore 每次分配连接都要扫描整个连接池（请求数 × 连接数），高并发时 CPU 开销很大，
+    因此每个事件循环的连接池再按 _CONNECTIONS_PER_SHARD 拆成多个小池，请求轮流分配。
+    """
+
+    def __init__(self, limits: httpx.Limits):
+        self._shards = _ceil_div(limits.max_connections, _CONNECTIONS_PER_SHARD) or 1
+        self._limits = httpx.Limits(
+            max_connections=_ceil_div(limits.max_connections, self._shards),
+            max_keepalive_connections=_ceil_div(limits.max_keepalive_connections, self._shards),
+            keepalive_expiry=limits.keepalive_expiry,
+        )
+        # 创建 SSL 上下文要加载 CA 证书，开销较大，所有分片共用一个
+        self._ssl_context = httpx.create_ssl_context()
+        self._pools: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._next = itertools.count()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            pool = self._pools[loop] = [
+                httpx.AsyncHTTPTransport(verify=self._ssl_context, limits=self._limits)
+                for _ in range(self._shards)
+            ]
+        transport = pool[next(self._next) % self._shards]
+        return await transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        for transport in self._pools.pop(asyncio.get_running_loop(), []):
+            await transport.aclose()
+
+
+def _ceil_div(value: int | None, shards: int) -> int | None:
+    return None if value is None else -(-value // shards)
+
+
+def _freeze(params: dict) -> str:
+    """把参数转换为可哈希的缓存 key（与参数顺序无关）"""
+    return json.dumps(params, sort_keys=True, ensure_ascii=False, default=repr)
@@ -0,0 +1,409 @@
+"""
+多模态请求的大小预算
+
+messages/multimodal.py 中的图片、PDF 以 base64 内联在消息里。用户上传手机拍的照片或几十页的 PDF 时，
+请求体很容易达到几十 MB：上传本身拖慢首 token，超过服务的请求体上限时直接返回 413；
+而千问 VL 会把图片缩放到最多 1280 个 28×28 的块，多传的像素只增加上传时间。
+
+PayloadBudget 作为发送前的一个步骤，测量消息列表中内容块的大小，按预算在本地缩小：
+1. 边长超过 max_image_side 的图片总是先缩小（服务端也会缩放）
+2. 请求体字节数超过 max_bytes 或预估 token 超过 max_tokens 时，先把 PDF 提取为文本（pdf_to_text），
+   再从最大的图片开始逐步缩小边长、降低 JPEG 质量，直到满足预算或到达下限（min_image_side / min_quality）
+3. 每次缩小都从原图重新编码，不会多次有损压缩；透明图片编码为 WebP，其余为 JPEG
+字节数按 OpenAI 格式序列化后的消息计算，token 用 TokenEstimator 估算（图片按尺寸计算）。
+返回的 PayloadReport 记录每一步缩小了什么；缩小后仍然超出预算时抛出 ValueError（raise_on_exceed=False 时照常发送）。
+
+缩小图片需要 Pillow，提取 PDF 文本需要 pypdf（pip install pillow pypdf）；
+没有安装时跳过对应的步骤，并在 report.skipped 中说明。
+
+用法:
+    budget = PayloadBudget(max_bytes=4 * 2**20, max_tokens=8000)
+    messages, report = budget.apply([HumanMessage(content=[...])])
+    chain = budget.as_runnable() | model     # 或者放在调用链中
+    print(budget.last_report, budget.stats)
+"""
+import base64
+import io
+import threading
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from typing import Any
+
+from langchain_core.language_models import LanguageModelInput
+from langchain_core.messages import BaseMessage, convert_to_messages
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import RunnableLambda
+
+from common.conversation import _encode, _to_provider_dict
+from common.token_estimator import TokenEstimator, image_size
+
+
+@dataclass
+class ShrinkAction:
+    """一次缩小"""
+    message: int
+    block: int
+    # resize 缩小图片，recompress 只降低质量，pdf_text PDF 转为文本
+    kind: str
+    bytes_before: int
+    bytes_after: int
+    detail: str = ""
+
+
+@dataclass
+class PayloadReport:
+    """一次请求的测量和缩小结果"""
+    bytes_before: int
+    tokens_before: int
+    bytes_after: int = 0
+    tokens_after: int = 0
+    within_budget: bool = True
+    actions: list[ShrinkAction] = field(default_factory=list)
+    # 因为缺少依赖等原因跳过的步骤
+    skipped: list[str] = field(default_factory=list)
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+
+@dataclass
+class PayloadStats:
+    """多次请求的累计"""
+    requests: int = 0
+    shrunk_requests: int = 0
+    over_budget: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+
+
+class PayloadBudget:
+    """发送前测量多模态消息的大小，超出预算时在本地缩小图片、提取 PDF 文本"""
+
+    def __init__(
+        self,
+        *,
+        max_bytes: int | None = 8 * 2**20,
+        max_tokens: int | None = None,
+        max_image_side: int = 2048,
+        min_image_side: int = 448,
+        quality: int = 85,
+        min_quality: int = 50,
+        pdf_to_text: bool = True,
+        raise_on_exceed: bool = True,
+        estimator: TokenEstimator | None = None,
+    ):
+        """
+        Args:
+            max_bytes: 请求中消息部分的字节数上限，None 表示不限
+            max_tokens: 预估输入 token 的上限，None 表示不限
+            max_image_side: 图片的最长边，超过时总是缩小
+            min_image_side: 为了满足预算继续缩小时，最长边的下限
+            quality: 重新编码的 JPEG/WebP 质量
+            min_quality: 为了满足预算继续降低质量时的下限
+            pdf_to_text: 超出预算时是否把 PDF 替换为提取的文本
+            raise_on_exceed: 缩小后仍然超出预算时抛出 ValueError，False 时照常返回
+            estimator: token 估算器，默认使用 TokenEstimator()
+        """
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self.max_image_side = max_image_side
+        self.min_image_side = min_image_side
+        self.quality = quality
+        self.min_quality = min_quality
+        self.pdf_to_text = pdf_to_text
+        self.raise_on_exceed = raise_on_exceed
+        self.estimator = estimator or TokenEstimator()
+        self.stats = PayloadStats()
+        # 最近一次 apply 的报告（并发调用时只是其中之一，以返回值为准）
+        self.last_report: PayloadReport | None = None
+        self._lock = threading.Lock()
+
+    def measure(self, messages: LanguageModelInput) -> tuple[int, int]:
+        """(消息部分的字节数, 预估 token 数)"""
+        messages = _to_messages(messages)
+        return _payload_bytes(messages), self.estimator.estimate(messages)
+
+    def apply(self, messages: LanguageModelInput) -> tuple[list[BaseMessage], PayloadReport]:
+        """按预算缩小消息中的内容块，返回新的消息列表（原消息不修改）和报告"""
+        messages = _to_messages(messages)
+        size = _payload_bytes(messages)
+        tokens = self.estimator.estimate(messages)
+        report = PayloadReport(size, tokens)
+        media = _find_media(messages)
+        if media:
+            shrinker = _Shrinker(self, messages, media, report, size)
+            shrinker.run()
+            messages = shrinker.messages()
+            size, tokens = _payload_bytes(messages), self.estimator.estimate(messages)
+        report.bytes_after, report.tokens_after = size, tokens
+        report.within_budget = self._within(size, tokens)
+
+        with self._lock:
+            stats = self.stats
+            stats.requests += 1
+            stats.shrunk_requests += bool(report.actions)
+            stats.over_budget += not report.within_budget
+            stats.bytes_before += report.bytes_before
+            stats.bytes_after += report.bytes_after
+            self.last_report = report
+        if not report.within_budget and self.raise_on_exceed:
+            reasons = "；".join(report.skipped)
+            raise ValueError(
+                f"请求超出预算：{size} 字节 / 约 {tokens} tokens"
+                f"（上限 {self.max_bytes} 字节 / {self.max_tokens} tokens）" + (f"，{reasons}" if reasons else "")
+            )
+        return messages, report
+
+    def as_runnable(self) -> RunnableLambda:
+        """放在模型之前的调用链步骤：budget.as_runnable() | model"""
+        return RunnableLambda(lambda messages: self.apply(messages)[0], name="PayloadBudget")
+
+    def _within(self, size: int, tokens: int) -> bool:
+        return (self.max_bytes is None or size <= self.max_bytes) and (
+            self.max_tokens is None or tokens <= self.max_tokens
+        )
+
+
+@dataclass
+class _Media:
+    """消息中一个内联的图片或 PDF"""
+    message: int
+    block: int
+    kind: str  # image / pdf
+    mime_type: str
+    data: str  # base64
+    filename: str | None = None
+    # 图片：原始文件（base64 和解码后的字节）、原图尺寸、当前的最长边和质量，无法解码时 failed
+    original: str = ""
+    raw: bytes | None = None
+    size: tuple[int, int] = (0, 0)
+    side: int = 0
+    quality: int = 0
+    failed: bool = False
+
+
+class _Shrinker:
+    def __init__(
+        self, budget: PayloadBudget, messages: list[BaseMessage], media: list[_Media], report: PayloadReport, size: int
+    ):
+        self.budget = budget
+        self.report = report
+        self.size = size
+        self._messages = messages
+        self._media = media
+        # 修改过的消息的内容块列表
+        self._contents: dict[int, list] = {}
+        # (原图 base64, 边长, 质量) -> (编码结果, MIME, 尺寸)，同一张图片出现多次时只编码一次
+        self._encoded: dict[tuple[str, int, int], tuple[str, str, tuple[int, int]]] = {}
+
+    def run(self) -> None:
+        budget = self.budget
+        images = [item for item in self._media if item.kind == "image"]
+        # 1. 超过最长边的图片总是缩小（尺寸从文件头读取，不需要缩小的图片不解码）
+        for item in images:
+            size = _header_size(item.data)
+            if size and max(size) > budget.max_image_side and self._load_image(item):
+                self._encode_image(item, budget.max_image_side, budget.quality)
+        if self._fits():
+            return
+        # 2. PDF 转为文本，从大到小
+        if budget.pdf_to_text:
+            for item in sorted((m for m in self._media if m.kind == "pdf"), key=lambda m: -len(m.data)):
+                self._pdf_to_text(item)
+                if self._fits():
+                    return
+        # 3. 从最大的图片开始，每次缩小一档：边长 ×0.75、质量 -10
+        while not self._fits():
+            candidates = [item for item in images if self._can_shrink(item)]
+            if not candidates:
+                return
+            item = max(candidates, key=lambda m: len(m.data))
+            if not self._load_image(item):
+                item.failed = True
+                continue
+            side = max(int(item.side * 0.75), budget.min_image_side)
+            quality = max(item.quality - 10, budget.min_quality)
+            self._encode_image(item, side, quality)
+
+    def messages(self) -> list[BaseMessage]:
+        return [
+            message.model_copy(update={"content": self._contents[i]}) if i in self._contents else message
+            for i, message in enumerate(self._messages)
+        ]
+
+    def _fits(self) -> bool:
+        # token 只在有 token 预算时才重新估算（需要读取每张图片的文件头）
+        tokens = self.budget.estimator.estimate(self.messages()) if self.budget.max_tokens is not None else 0
+        return self.budget._within(self.size, tokens)
+
+    def _can_shrink(self, item: _Media) -> bool:
+        if item.failed:
+            return False
+        return item.raw is None or item.side > self.budget.min_image_side or item.quality > self.budget.min_quality
+
+    def _load_image(self, item: _Media) -> bool:
+        """保存原始文件并读取尺寸（只读文件头），之后每次缩小都从原始文件重新解码"""
+        if item.raw is not None:
+            return True
+        try:
+            from PIL import Image
+        except ImportError:
+            self._skip("没有安装 Pillow，无法缩小图片")
+            return False
+        try:
+            raw = base64.b64decode(item.data)
+            item.size = Image.open(io.BytesIO(raw)).size
+        except (OSError, ValueError):
+            return False
+        item.original, item.raw = item.data, raw
+        item.side = max(item.size)
+        item.quality = self.budget.quality + 10  # 还没有重新编码过
+        return True
+
+    def _encode_image(self, item: _Media, side: int, quality: int) -> None:
+        key = (item.original, side, quality)
+        if key not in self._encoded:
+            try:
+                self._encoded[key] = _resize(item.raw, side, quality)
+            except Exception as e:  # 文件头正常但数据截断或损坏（OSError）、像素数过多（DecompressionBombError）等
+                item.failed = True
+                self._skip(f"图片解码失败: {e}")
+                return
+        data, mime_type, size = self._encoded[key]
+        before = item.size
+        item.side, item.quality = side, quality
+        if len(data) >= len(item.data) and size == before:
+            return  # 没有变小，保留原来的编码
+        kind = "resize" if size != before else "recompress"
+        detail = f"{before[0]}×{before[1]} → {size[0]}×{size[1]} {mime_type.split('/')[1].upper()} q{quality}"
+        self._replace(item, _with_image_data(self._block(item), data, mime_type), kind, detail)
+        item.data, item.mime_type = data, mime_type
+
+    def _pdf_to_text(self, item: _Media) -> None:
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            self._skip("没有安装 pypdf，无法提取 PDF 文本")
+            return
+        try:
+            pages = PdfReader(io.BytesIO(base64.b64decode(item.data))).pages
+            text = "\n\n".join((page.extract_text() or "").strip() for page in pages).strip()
+        except Exception as e:  # pypdf 对损坏文件抛出的异常类型很多
+            self._skip(f"PDF 解析失败: {e}")
+            return
+        if not text:
+            self._skip("PDF 中没有可提取的文本（可能是扫描件），保留原文件")
+            return
+        name = f" {item.filename}" if item.filename else ""
+        block = {"type": "text", "text": f"[PDF{name} 的文本内容，共 {len(pages)} 页]\n{text}"}
+        self._replace(item, block, "pdf_text", f"{len(pages)} 页，{len(text)} 字")
+
+    def _block(self, item: _Media) -> dict:
+        content = self._contents.get(item.message)
+        return (content if content is not None else self._messages[item.message].content)[item.block]
+
+    def _replace(self, item: _Media, block: dict, kind: str, detail: str) -> None:
+        old = self._block(item)
+        before, after = len(_encode(old)), len(_encode(block))
+        content = self._contents.get(item.message)
+        if content is None:
+            content = self._contents[item.message] = list(self._messages[item.message].content)
+        content[item.block] = block
+        self.size += after - before
+        self.report.actions.append(ShrinkAction(item.message, item.block, kind, before, after, detail))
+
+    def _skip(self, reason: str) -> None:
+        if reason not in self.report.skipped:
+            self.report.skipped.append(reason)
+
+
+def _resize(raw: bytes, side: int, quality: int) -> tuple[str, str, tuple[int, int]]:
+    """把图片缩小到最长边不超过 side 并重新编码，返回 (base64, MIME, 尺寸)"""
+    from PIL import Image
+
+    # 解码前调用 thumbnail，JPEG 可以直接按缩小的比例解码（draft），比先完整解码快
+    image = Image.open(io.BytesIO(raw))
+    image.thumbnail((side, side), Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        image.save(output, "WEBP", quality=quality)
+        mime_type = "image/webp"
+    else:
+        image.convert("RGB").save(output, "JPEG", quality=quality, optimize=True)
+        mime_type = "image/jpeg"
+    return base64.b64encode(output.getvalue()).decode("ascii"), mime_type, image.size
+
+
+def _to_messages(value: LanguageModelInput) -> list[BaseMessage]:
+    if isinstance(value, PromptValue):
+        return value.to_messages()
+    if isinstance(value, (str, BaseMessage)):
+        value = [value]
+    return convert_to_messages(value)
+
+
+def _payload_bytes(messages: Sequence[BaseMessage]) -> int:
+    """OpenAI 格式序列化后的字节数，与请求体中 "messages" 部分一致"""
+    return sum(len(_encode(_to_provider_dict(message))) for message in messages) + max(len(messages) - 1, 0)
+
+
+def _find_media(messages: Sequence[BaseMessage]) -> list[_Media]:
+    """找出内联 base64 的图片和 PDF：LangChain 标准内容块和 OpenAI 格式的 image_url / file 块"""
+    found = []
+    for i, message in enumerate(messages):
+        if isinstance(message.content, str):
+            continue
+        for j, block in enumerate(message.content):
+            if not isinstance(block, dict):
+                continue
+            kind = block.get("type")
+            mime_type, data, filename = None, None, None
+            if kind in ("image", "file") and block.get("base64"):
+                mime_type, data = block.get("mime_type"), block["base64"]
+                filename = (block.get("extras") or {}).get("filename") or block.get("filename")
+            elif kind == "image" and isinstance(block.get("url"), str):
+                mime_type, data = _parse_data_url(block["url"])
+            elif kind == "image_url":
+                image_url = block.get("image_url")
+                url = image_url.get("url") if isinstance(image_url, dict) else image_url
+                mime_type, data = _parse_data_url(url)
+            elif kind == "file" and isinstance(block.get("file"), dict):
+                mime_type, data = _parse_data_url(block["file"].get("file_data"))
+                filename = block["file"].get("filename")
+            if not data or not mime_type:
+                continue
+            if mime_type.startswith("image/"):
+                found.append(_Media(i, j, "image", mime_type, data))
+            elif mime_type == "application/pdf":
+                found.append(_Media(i, j, "pdf", mime_type, data, filename))
+    return found
+
+
+def _header_size(data: str) -> tuple[int, int] | None:
+    """只解码 base64 的开头，从文件头读取图片尺寸"""
+    head = data[:87384]
+    try:
+        return image_size(base64.b64decode(head[: len(head) // 4 * 4]))
+    except ValueError:
+        return None
+
+
+def _parse_data_url(url: Any) -> tuple[str | None, str | None]:
+    if not isinstance(url, str) or not url.startswith("data:"):
+        return None, None
+    header, _, data = url.partition(",")
+    if not header.endswith(";base64"):
+        return None, None
+    return header[5:-7], data
+
+
+def _with_image_data(block: dict, data: str, mime_type: str) -> dict:
+    """与原内容块格式相同、换成新图片数据的内容块"""
+    url = f"data:{mime_type};base64,{data}"
+    if block.get("type") == "image_url":
+        image_url = block.get("image_url")
+        return {**block, "image_url": {**image_url, "url": url} if isinstance(image_url, dict) else url}
+    if block.get("base64"):
+        return {**block, "base64": data, "mime_type": mime_type}
+    return {**block, "url": url}
@@ -0,0 +1,224 @@
+"""
+打包的结构化抽取
+
+models/structured_output.py 中每部电影一次调用，每次都要重新发送系统提示词和 schema。
+批量抽取几千条时，PackedExtractor 把多条输入打包进一个请求：
+- 请求的 schema 是 {"items": [Movie + index]}，输入按 "[编号] 内容" 逐行列出，内容编码为 JSON 字符串，
+  输入中的换行或 "[编号] " 开头的文本不会打乱编号；模型为每条输入返回一个带相同 index 的对象，
+  结果按 index 映射回原来的输入
+- 每个包的大小受 token 预算限制：提示词（系统提示 + schema + 输入）不超过 max_prompt_tokens，
+  预计输出不超过 max_output_tokens，条数不超过 max_items；token 数用 TokenEstimator 离线估算
+- 每个条目单独校验，某一条不符合 schema 或缺失时只把这一条单独重新请求，不影响同一个包中的其他条目；
+  整个包请求失败（5xx、超时等）时，包中的条目全部单独重新请求，单独请求也失败的记为 None
+- 多个包通过 batch_engine 并发发送；stats 统计请求数、重试数和每条记录的平均 token
+
+用法:
+    extractor = PackedExtractor(model, Movie, instructions="根据电影名称，以 JSON 格式提供电影的详细信息。")
+    movies = extractor.extract(["盗梦空间", "星际穿越", ...])  # 与输入一一对应，失败的为 None
+    print(extractor.stats)
+"""
+import asyncio
+import json
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
+from langchain_openai.chat_models.base import _convert_to_openai_response_format
+from pydantic import BaseModel, Field, ValidationError, create_model
+
+from common.batch_engine import abatch
+from common.token_estimator import TokenEstimator
+
+_PACKING_NOTE = (
+    "输入按 \"[编号] 内容\" 逐行列出，内容是 JSON 字符串（其中的 \\n 等为转义字符）。"
+    "请为每一行输入返回 items 中的一个对象，index 与该行的编号相同，不要遗漏或合并。"
+)
+
+
+@dataclass
+class PackingStats:
+    """打包抽取的统计"""
+    records: int = 0
+    # 打包请求数和其中的条目总数
+    packed_requests: int = 0
+    packed_records: int = 0
+    # 单独重新请求的条目数，以及重试后仍然失败的条目数
+    retries: int = 0
+    failures: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+    @property
+    def requests(self) -> int:
+        return self.packed_requests + self.retries
+
+    @property
+    def tokens_per_record(self) -> float:
+        return (self.input_tokens + self.output_tokens) / self.records if self.records else 0.0
+
+
+class PackedExtractor:
+    """把多条输入打包进一次结构化输出请求，结果按 index 拆回"""
+
+    def __init__(
+        self,
+        model: BaseChatModel,
+        schema: type[BaseModel],
+        *,
+        instructions: str,
+        max_prompt_tokens: int = 4000,
+        max_output_tokens: int = 4000,
+        output_tokens_per_item: int | None = None,
+        max_items: int = 50,
+        max_concurrency: int = 8,
+        token_counter: Callable[[str], int] | None = None,
+    ):
+        """
+        Args:
+            model: 聊天模型
+            schema: 每条记录的 pydantic 模型
+            instructions: 系统提示词，说明要从每条输入中抽取什么；单条请求和打包请求共用
+            max_prompt_tokens: 每个打包请求的输入 token 上限
+            max_output_tokens: 每个打包请求预计输出 token 的上限
+            output_tokens_per_item: 每条记录预计的输出 token，默认按 schema 的字段估算
+            max_items: 每个包最多的条数
+            max_concurrency: 同时在途的请求数
+            token_counter: 估算文本 token 数的函数，默认使用 TokenEstimator
+        """
+        if not (isinstance(schema, type) and issubclass(schema, BaseModel)):
+            raise TypeError("PackedExtractor 只支持 pydantic 模型作为 schema")
+        self.model = model
+        self.schema = schema
+        self.instructions = instructions
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_output_tokens = max_output_tokens
+        self.max_items = max_items
+        self.max_concurrency = max_concurrency
+        self.count_tokens = token_counter or TokenEstimator().count_text
+        self.stats = PackingStats()
+
+        self._wrapper = _packed_schema(schema)
+        response_format = _convert_to_openai_response_format(self._wrapper.model_json_schema())
+        self._packed_model = model.bind(response_format=response_format)
+        self._single_model = model.with_structured_output(schema, include_raw=True)
+        self._system = SystemMessage(f"{instructions}\n{_PACKING_NOTE}")
+        # 每个打包请求的固定开销：系统提示词 + schema
+        schema_text = json.dumps(response_format, ensure_ascii=False)
+        self._overhead = self.count_tokens(self._system.content) + self.count_tokens(schema_text)
+        if output_tokens_per_item is None:
+            # 每个字段约为 key、值和标点，按 12 个 token 估算，再加上 index
+            output_tokens_per_item = 12 * (len(schema.model_fields) + 1)
+        self.output_tokens_per_item = output_tokens_per_item
+
+    def pack(self, inputs: Sequence[str]) -> list[list[int]]:
+        """按 token 预算把输入分组，返回每个包中输入的下标"""
+        limit = min(self.max_items, max(1, self.max_output_tokens // self.output_tokens_per_item))
+        packs: list[list[int]] = []
+        current: list[int] = []
+        used = self._overhead
+        for index, text in enumerate(inputs):
+            # "[编号] " 前缀、引号和换行约 5 个 token
+            tokens = self.count_tokens(text) + 5
+            if current and (len(current) >= limit or used + tokens > self.max_prompt_tokens):
+                packs.append(current)
+                current, used = [], self._overhead
+            current.append(index)
+            used += tokens
+        if current:
+            packs.append(current)
+        return packs
+
+    async def aextract(self, inputs: Sequence[str]) -> list[BaseModel | None]:
+        """抽取所有输入，结果与 inputs 一一对应，重试后仍然失败的为 None"""
+        results: list[BaseModel | None] = [None] * len(inputs)
+        self.stats.records += len(inputs)
+
+        async def run_pack(indexes: list[int]) -> list[int]:
+            """发送一个包，返回需要单独重试的下标"""
+            self.stats.packed_requests += 1
+            try:
+                message = await self._packed_model.ainvoke(
+                    [self._system, HumanMessage("\n".join(_packed_line(i, inputs[index]) for i, index in enumerate(indexes)))]
+                )
+            except Exception:
+                # 一个包失败不影响其他包，包中的条目全部单独重试
+                return list(indexes)
+            self._add_usage(message)
+            self.stats.packed_records += len(indexes)
+            parsed = self._split(message, len(indexes))
+            missing = []
+            for i, index in enumerate(indexes):
+                if parsed.get(i) is None:
+                    missing.append(index)
+                else:
+                    results[index] = parsed[i]
+            return missing
+
+        async def run_single(index: int) -> None:
+            self.stats.retries += 1
+            try:
+                result = await self._single_model.ainvoke([SystemMessage(self.instructions), HumanMessage(inputs[index])])
+            except Exception:
+                self.stats.failures += 1
+                return
+            self._add_usage(result["raw"])
+            if result["parsed"] is None:
+                self.stats.failures += 1
+            results[index] = result["parsed"]
+
+        missing = await abatch(RunnableLambda(run_pack), self.pack(inputs), max_concurrency=self.max_concurrency)
+        retry = [index for indexes in missing for index in indexes]
+        await abatch(RunnableLambda(run_single), retry, max_concurrency=self.max_concurrency)
+        return results
+
+    def extract(self, inputs: Sequence[str]) -> list[BaseModel | None]:
+        """aextract 的同步版本，不能在运行中的事件循环里调用"""
+        return asyncio.run(self.aextract(inputs))
+
+    def _split(self, message: AIMessage, count: int) -> dict[int, BaseModel]:
+        """把打包的回复拆成 {包内编号: 校验后的记录}，每条单独校验，无效或缺失的不在结果中"""
+        try:
+            items = json.loads(message.text)["items"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            return {}
+        parsed: dict[int, BaseModel] = {}
+        for item in items if isinstance(items, list) else ():
+            if not isinstance(item, dict):
+                continue
+            fields = dict(item)
+            index = fields.pop("index", None)
+            if not isinstance(index, int) or not 0 <= index < count or index in parsed:
+                continue
+            try:
+                parsed[index] = self.schema.model_validate(fields)
+            except ValidationError:
+                continue
+        return parsed
+
+    def _add_usage(self, message: Any) -> None:
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            self.stats.input_tokens += usage["input_tokens"]
+            self.stats.output_tokens += usage["output_tokens"]
+
+
+def _packed_schema(schema: type[BaseModel]) -> type[BaseModel]:
+    """{"items": [schema + index]}"""
+    item = create_model(
+        f"{schema.__name__}Item",
+        __base__=schema,
+        index=(int, Field(..., description="对应输入的编号")),
+    )
+    return create_model(
+        f"{schema.__name__}List",
+        __doc__=f"多条输入的{schema.__doc__ or schema.__name__}",
+        items=(list[item], Field(..., description="每条输入对应一个结果")),
+    )
+
+
+def _packed_line(number: int, text: str) -> str:
+    """打包请求中的一行：内容编码为 JSON 字符串，换行和引号都被转义，一条输入总是恰好一行"""
+    return f"[{number}] {json.dumps(text, ensure_ascii=False)}"
@@ -0,0 +1,209 @@
+"""
+精确匹配的模型响应缓存
+
+实现 LangChain 的 BaseCache 接口，可以通过 set_llm_cache() 全局启用，
+也可以通过 get_chat_model(cache=...) 只对某个模型启用：
+- 缓存 key 为规范化后的消息、模型名称和采样参数的哈希。
+  字典格式的消息与 HumanMessage/SystemMessage/AIMessage 对象得到相同的 key，
+  消息 id、response_metadata 等与回答内容无关的字段不参与计算
+- 内存中是有容量上限的 LRU，可选 SQLite 磁盘层，进程重启后仍然有效
+- 支持 TTL 过期，并统计命中/未命中次数
+- 缓存的是完整的 ChatGeneration，命中时返回的 AIMessage 保留原始 usage_metadata
+
+用法:
+    from langchain_core.globals import set_llm_cache
+
+    cache = ResponseCache(maxsize=1024, ttl=24 * 3600, sqlite_path=DEFAULT_CACHE_PATH)
+    set_llm_cache(cache)
+    ...
+    print(cache.stats)
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.messages import BaseMessage, convert_to_messages, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration
+
+# 默认的 SQLite 缓存文件位置（项目根目录下的 .cache/，已加入 .gitignore）
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parents[1] / ".cache" / "responses.sqlite"
+
+
+@dataclass
+class CacheStats:
+    """缓存命中统计"""
+    hits: int = 0
+    misses: int = 0
+    memory_hits: int = 0
+    disk_hits: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class ResponseCache(BaseCache):
+    """内存 LRU + 可选 SQLite 的两级响应缓存"""
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float | None = None,
+        sqlite_path: str | Path | None = None,
+    ):
+        """
+        Args:
+            maxsize: 内存中最多保留的条目数
+            ttl: 过期时间（秒），None 表示永不过期
+            sqlite_path: SQLite 文件路径，None 表示只使用内存缓存
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = CacheStats()
+        # key -> (过期时间戳或 None, 缓存值)
+        self._memory: OrderedDict[str, tuple[float | None, RETURN_VAL_TYPE]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if sqlite_path is not None:
+            Path(sqlite_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(sqlite_path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+            self._db.commit()
+
+    def lookup(self, prompt: str, llm_string: str) -> RETURN_VAL_TYPE | None:
+        key = self._key_from_prompt(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.stats.hits += 1
+                    self.stats.memory_hits += 1
+                    return value
+                del self._memory[key]
+                self.stats.expirations += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    serialized, expires_at = row
+                    if expires_at is None or expires_at > now:
+                        value = _loads_generations(serialized)
+                        self._remember(key, expires_at, value)
+                        self.stats.hits += 1
+                        self.stats.disk_hits += 1
+                        return value
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                    self.stats.expirations += 1
+
+            self.stats.misses += 1
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = self._key_from_prompt(prompt, llm_string)
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._remember(key, expires_at, return_val)
+            if self._db is not None:
+                serialized = _dumps_generations(return_val)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, serialized, expires_at),
+                )
+                self._db.commit()
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    # 内存查找本身很快，不需要像默认实现那样放到线程池中执行
+    async def alookup(self, prompt: str, llm_string: str) -> RETURN_VAL_TYPE | None:
+        return self.lookup(prompt, llm_string)
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        self.update(prompt, llm_string, return_val)
+
+    async def aclear(self, **kwargs: Any) -> None:
+        self.clear(**kwargs)
+
+    def _remember(self, key: str, expires_at: float | None, value: RETURN_VAL_TYPE) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+            self.stats.evictions += 1
+
+    @staticmethod
+    def _key_from_prompt(prompt: str, llm_string: str) -> str:
+        # prompt 是 langchain_core.load.dumps 序列化后的消息列表
+        serialized = json.loads(prompt)
+        messages = [_canonical_message(item["kwargs"]) for item in serialized]
+        return cache_key(messages, llm_string)
+
+
+def normalize_messages(messages: str | Sequence[BaseMessage | dict | str]) -> list[dict]:
+    """把字符串、字典或消息对象统一转换为只包含影响回答的字段的字典"""
+    if isinstance(messages, str):
+        messages = [messages]
+    return [_canonical_message(message.model_dump()) for message in convert_to_messages(messages)]
+
+
+def cache_key(messages: list[dict], llm_string: str) -> str:
+    """规范化消息 + 模型配置字符串 -> sha256"""
+    canonical = json.dumps([messages, llm_string], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _dumps_generations(generations: RETURN_VAL_TYPE) -> str:
+    return json.dumps(
+        [
+            {"message": message_to_dict(generation.message), "generation_info": generation.generation_info}
+            for generation in generations
+        ],
+        ensure_ascii=False,
+    )
+
+
+def _loads_generations(serialized: str) -> list[ChatGeneration]:
+    items = json.loads(serialized)
+    messages = messages_from_dict([item["message"] for item in items])
+    return [
+        ChatGeneration(message=message, generation_info=item["generation_info"])
+        for message, item in zip(messages, items)
+    ]
+
+
+def _canonical_message(fields: dict) -> dict:
+    message = {"type": fields["type"], "content": fields.get("content", "")}
+    if fields.get("name"):
+        message["name"] = fields["name"]
+    if fields.get("tool_calls"):
+        message["tool_calls"] = [
+            {"name": call["name"], "args": call["args"], "id": call.get("id")}
+            for call in fields["tool_calls"]
+        ]
+    if fields.get("tool_call_id"):
+        message["tool_call_id"] = fields["tool_call_id"]
+    return message
@@ -0,0 +1,411 @@
+"""
+相同请求的并发合并（singleflight）
+
+热门问题常常同时来自很多用户，每个 model.invoke / model.stream 都会单独发出一次上游请求。
+CoalescingChatModel 包装一个聊天模型，正在进行中的相同请求只发出一次：
+- 请求的 key 为规范化后的消息（与 ResponseCache 相同，见 normalize_messages）、
+  模型和调用参数（包括 bind 的 tools、stop 等），invoke 和 stream 分别合并
+- invoke：第一个调用发出请求，其余调用等待同一个结果，各自得到一份 AIMessage 副本
+- stream：上游的块写入一个共享的缓冲区，每个订阅者从头读取；
+  中途加入的订阅者先补发已经收到的块，再跟随实时的流，所有订阅者得到相同的块序列
+- 同步（线程）和异步调用共享同一组进行中的请求，可以互相合并；
+  流由后台线程（同步发起）或后台事件循环中的任务（异步发起）拉取，慢的订阅者不会拖慢其他订阅者，
+  发起者的事件循环结束也不会中断其他订阅者
+- 上游出错时所有等待者得到同样的异常（流的订阅者先收到出错前的块）；
+  流的订阅者全部退出时取消上游请求
+- stats 统计调用次数、上游请求数和省下的请求数
+
+只合并同时进行中的请求，请求完成后的相同请求会重新发出；需要复用已完成的结果请配合 ResponseCache。
+key 不区分用户，回答依赖调用者身份时把身份放进消息或参数中。
+
+用法:
+    model = CoalescingChatModel(model=get_chat_model())
+    model.invoke("为什么鹦鹉有五颜六色的羽毛？")      # 与 get_chat_model() 返回的模型用法相同
+    for chunk in model.stream("天空是什么颜色？"):
+        ...
+    print(model.stats)
+"""
+import asyncio
+import threading
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict, Field
+
+from common.response_cache import cache_key, normalize_messages
+
+
+@dataclass
+class FlightStats:
+    """合并统计，saved 是没有发出上游请求的调用次数"""
+    calls: int = 0
+    upstream_calls: int = 0
+    # 流的订阅者加入时已经有块，需要补发
+    late_joins: int = 0
+    replayed_chunks: int = 0
+    # 订阅者全部退出而取消的上游流
+    abandoned: int = 0
+
+    @property
+    def saved(self) -> int:
+        return self.calls - self.upstream_calls
+
+
+class _Broadcast:
+    """一次上游流的共享缓冲区：一个生产者，任意多个同步或异步订阅者，每个订阅者都从头读取"""
+
+    def __init__(self, on_abandon: Callable[["_Broadcast"], None]):
+        self.chunks: list[Any] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.cancelled = False
+        # 取消上游的方法，由启动生产者的一方设置
+        self.cancel: Callable[[], None] | None = None
+        self._on_abandon = on_abandon
+        self._subscribers = 0
+        self._cond = threading.Condition()
+        self._async_waiters: set[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+    def subscribe(self) -> int | None:
+        """登记一个订阅者，返回此时已有的块数；流已被取消时返回 None，调用方应重新发起"""
+        with self._cond:
+            if self.cancelled:
+                return None
+            self._subscribers += 1
+            return len(self.chunks)
+
+    def unsubscribe(self) -> None:
+        with self._cond:
+            self._subscribers -= 1
+            abandoned = self._subscribers == 0 and not self.done
+            if abandoned:
+                self.cancelled = True
+        if abandoned:
+            self._on_abandon(self)
+            if self.cancel is not None:
+                self.cancel()
+
+    def publish(self, chunk: Any) -> None:
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+            waiters = list(self._async_waiters)
+        self._wake(waiters)
+
+    def finish(self, error: BaseException | None = None) -> None:
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+            waiters = list(self._async_waiters)
+        self._wake(waiters)
+
+    def __iter__(self) -> Iterator[Any]:
+        position = 0
+        while True:
+            with self._cond:
+                while position == len(self.chunks) and not self.done:
+                    self._cond.wait()
+                new = self.chunks[position:]
+                done, error = self.done, self.error
+            position += len(new)
+            yield from new
+            if done and position == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            self._async_waiters.add(waiter)
+        try:
+            position = 0
+            while True:
+                # 先 clear 再检查，检查之后的 publish 一定会再次 set
+                waiter[1].clear()
+                with self._cond:
+                    new = self.chunks[position:]
+                    done, error = self.done, self.error
+                position += len(new)
+                for chunk in new:
+                    yield chunk
+                if done and position == len(self.chunks):
+                    if error is not None:
+                        raise error
+                    return
+                if not new:
+                    await waiter[1].wait()
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+
+    @staticmethod
+    def _wake(waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Event]]) -> None:
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # 订阅者的事件循环已经关闭
+
+
+class SingleFlight:
+    """按 key 合并进行中的调用；invoke 用 Future 共享结果，stream 用 _Broadcast 共享块"""
+
+    def __init__(self) -> None:
+        self.stats = FlightStats()
+        self._calls: dict[str, Future] = {}
+        self._streams: dict[str, _Broadcast] = {}
+        self._lock = threading.Lock()
+        # 拉取异步流的后台事件循环，第一次异步发起流时创建
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def do(self, key: str, call: Callable[[], Any]) -> Any:
+        """执行 call 并返回结果；相同 key 的并发调用等待同一次执行"""
+        future, leader = self._begin(key)
+        if not leader:
+            return future.result()
+        try:
+            result = call()
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, result)
+        return result
+
+    async def ado(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """do 的异步版本，与同步调用共享合并"""
+        future, leader = self._begin(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        async def run() -> Any:
+            try:
+                result = await call()
+            except BaseException as e:
+                self._settle(key, future, error=e)
+                raise
+            self._settle(key, future, result)
+            return result
+
+        # 发起者被取消时请求继续进行，等待中的调用仍然能拿到结果
+        return await asyncio.shield(asyncio.ensure_future(run()))
+
+    def stream(self, key: str, start: Callable[[], Iterator[Any]]) -> Iterator[Any]:
+        """订阅 key 对应的流，没有进行中的流时在后台线程中执行 start() 并广播其产生的块"""
+        broadcast, leader = self._subscribe(key)
+        if leader:
+            threading.Thread(target=self._pump, args=(key, broadcast, start), daemon=True).start()
+        try:
+            yield from broadcast
+        finally:
+            broadcast.unsubscribe()
+
+    async def astream(self, key: str, start: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """stream 的异步版本，没有进行中的流时在后台事件循环中创建任务拉取 start()
+
+        拉取不在调用者的事件循环中进行：发起者所在的 asyncio.run() 结束时，
+        同步或其他事件循环中的订阅者仍然能读完整个流
+        """
+        broadcast, leader = self._subscribe(key)
+        if leader:
+            future = asyncio.run_coroutine_threadsafe(self._apump(key, broadcast, start), self._pump_loop())
+            broadcast.cancel = future.cancel
+        try:
+            async for chunk in broadcast:
+                yield chunk
+        finally:
+            broadcast.unsubscribe()
+
+    def _begin(self, key: str) -> tuple[Future, bool]:
+        """返回 (进行中的 Future, 是否由当前调用执行)"""
+        with self._lock:
+            self.stats.calls += 1
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            self.stats.upstream_calls += 1
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _settle(self, key: str, future: Future, result: Any = None, error: BaseException | None = None) -> None:
+        with self._lock:
+            del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _subscribe(self, key: str) -> tuple[_Broadcast, bool]:
+        with self._lock:
+            self.stats.calls += 1
+            broadcast = self._streams.get(key)
+            # 订阅者刚刚全部退出的流已被取消，即使还没有移出 _streams 也不能加入
+            missed = broadcast.subscribe() if broadcast is not None else None
+            leader = missed is None
+            if leader:
+                self.stats.upstream_calls += 1
+                broadcast = self._streams[key] = _Broadcast(self._abandon)
+                missed = broadcast.subscribe()
+            if missed:
+                self.stats.late_joins += 1
+                self.stats.replayed_chunks += missed
+        return broadcast, leader
+
+    def _pump_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="singleflight", daemon=True).start()
+            return self._loop
+
+    def _abandon(self, broadcast: _Broadcast) -> None:
+        # 之后的相同请求重新发出，不再加入这个被取消的流
+        with self._lock:
+            self.stats.abandoned += 1
+            for key, value in self._streams.items():
+                if value is broadcast:
+                    del self._streams[key]
+                    break
+
+    def _done(self, key: str, broadcast: _Broadcast) -> None:
+        with self._lock:
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+
+    def _pump(self, key: str, broadcast: _Broadcast, start: Callable[[], Iterator[Any]]) -> None:
+        error = None
+        iterator = None
+        try:
+            iterator = start()
+            for chunk in iterator:
+                if broadcast.cancelled:
+                    break
+                broadcast.publish(chunk)
+        except BaseException as e:
+            error = e
+        finally:
+            if iterator is not None and hasattr(iterator, "close"):
+                iterator.close()
+            # 先移出进行中的流再结束广播，结束之后到达的请求不会再加入它
+            self._done(key, broadcast)
+            broadcast.finish(error)
+
+    async def _apump(self, key: str, broadcast: _Broadcast, start: Callable[[], AsyncIterator[Any]]) -> None:
+        error = None
+        try:
+            async for chunk in start():
+                broadcast.publish(chunk)
+        except asyncio.CancelledError:
+            # 只在订阅者全部退出时取消；不把 CancelledError 交给订阅者，它会绕过 except Exception
+            error = RuntimeError("上游流已取消")
+            raise
+        except BaseException as e:
+            error = e
+        finally:
+            self._done(key, broadcast)
+            broadcast.finish(error)
+
+
+class CoalescingChatModel(BaseChatModel):
+    """合并相同的进行中请求的聊天模型包装，用法与被包装的模型相同"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    model: BaseChatModel
+    flights: SingleFlight = Field(default_factory=SingleFlight, exclude=True)
+
+    @property
+    def stats(self) -> FlightStats:
+        return self.flights.stats
+
+    @property
+    def _llm_type(self) -> str:
+        return f"coalescing-{self.model._llm_type}"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return self.model._identifying_params
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> Any:
+        # 由被包装的模型转换工具格式，转换结果作为调用参数传回，也参与 key 的计算
+        return self.bind(**self.model.bind_tools(tools, **kwargs).kwargs)
+
+    def request_key(self, messages: list[BaseMessage], stop: list[str] | None = None, **kwargs: Any) -> str:
+        """规范化的消息 + 模型和调用参数的哈希"""
+        return cache_key(normalize_messages(messages), self.model._get_llm_string(stop=stop, **kwargs))
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = self.flights.do(
+            "invoke:" + self.request_key(messages, stop, **kwargs),
+            lambda: self.model.invoke(messages, stop=stop, **kwargs),
+        )
+        return _result(message)
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = await self.flights.ado(
+            "invoke:" + self.request_key(messages, stop, **kwargs),
+            lambda: self.model.ainvoke(messages, stop=stop, **kwargs),
+        )
+        return _result(message)
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        chunks = self.flights.stream(
+            "stream:" + self.request_key(messages, stop, **kwargs),
+            lambda: self.model.stream(messages, stop=stop, **kwargs),
+        )
+        for chunk in chunks:
+            generation = _chunk(chunk)
+            if run_manager is not None:
+                run_manager.on_llm_new_token(generation.text, chunk=generation)
+            yield generation
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        chunks = self.flights.astream(
+            "stream:" + self.request_key(messages, stop, **kwargs),
+            lambda: self.model.astream(messages, stop=stop, **kwargs),
+        )
+        async for chunk in chunks:
+            generation = _chunk(chunk)
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(generation.text, chunk=generation)
+            yield generation
+
+
+def _result(message: AIMessage) -> ChatResult:
+    # 每个等待者一份浅拷贝，BaseChatModel 会在返回前修改消息的 id 和 response_metadata
+    return ChatResult(generations=[ChatGeneration(message=message.model_copy())])
+
+
+def _chunk(chunk: AIMessageChunk) -> ChatGenerationChunk:
+    return ChatGenerationChunk(message=chunk.model_copy())
@@ -0,0 +1,176 @@
+"""
+分阶段耗时分析器
+
+在 profile() 上下文中，临时给 LangChain、openai SDK 和 httpcore 的关键函数包上计时器，
+统计每个请求在各阶段花费的时间（扣除子阶段后的自身耗时）：
+
+    message_conversion   LangChain 输入转换为消息对象、消息对象转换为 OpenAI 格式的字典
+    payload_build        LangChain 组装请求参数
+    payload_serialization openai SDK 构造 HTTP 请求（JSON 序列化）
+    connect              建立 TCP 连接
+    http_send            写出请求
+    first_byte           等待服务端返回第一个字节
+    network_read         读取后续响应数据（流式时为等待下一个块）
+    response_parsing     SSE 解码、JSON 解析和 openai 响应对象构造（流式时逐块进行）
+    message_construction LangChain 把响应转换为 AIMessage / AIMessageChunk
+    callbacks            LangChain 回调
+    other                以上之外的自身耗时（框架调度、参数校验等）
+
+每个请求的结果是一个 RequestProfile；所有调用栈可以导出为折叠栈格式 (folded stacks)，
+直接交给 flamegraph.pl 或 speedscope 生成火焰图。
+计时器本身每次调用有几微秒的开销，逐行解析 SSE 时会被放大，适合用来对比不同路径，而不是测绝对值。
+
+用法:
+    profiler = StageProfiler()
+    with profiler.profile():
+        with profiler.request("langchain.invoke") as record:
+            model.invoke(messages)
+    print(record.stages)
+    profiler.write_folded("profile.folded")
+"""
+import contextlib
+import functools
+import importlib
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+# (模块, 属性路径, 阶段名)
+_TARGETS = [
+    ("langchain_core.language_models.chat_models", "BaseChatModel._convert_input", "message_conversion"),
+    ("langchain_openai.chat_models.base", "_convert_message_to_dict", "message_conversion"),
+    ("langchain_openai.chat_models.base", "BaseChatOpenAI._get_request_payload", "payload_build"),
+    ("langchain_openai.chat_models.base", "_convert_dict_to_message", "message_construction"),
+    ("langchain_openai.chat_models.base", "BaseChatOpenAI._create_chat_result", "message_construction"),
+    ("langchain_openai.chat_models.base", "BaseChatOpenAI._convert_chunk_to_generation_chunk", "message_construction"),
+    ("langchain_core.callbacks.manager", "CallbackManager.on_chat_model_start", "callbacks"),
+    ("langchain_core.callbacks.manager", "CallbackManagerForLLMRun.on_llm_new_token", "callbacks"),
+    ("langchain_core.callbacks.manager", "CallbackManagerForLLMRun.on_llm_end", "callbacks"),
+    ("openai._base_client", "BaseClient._build_request", "payload_serialization"),
+    ("openai._base_client", "BaseClient._process_response_data", "response_parsing"),
+    ("openai._streaming", "SSEDecoder.decode", "response_parsing"),
+    ("openai._streaming", "ServerSentEvent.json", "response_parsing"),
+    ("httpcore._backends.sync", "SyncBackend.connect_tcp", "connect"),
+    ("httpcore._backends.sync", "SyncStream.write", "http_send"),
+    ("httpcore._backends.sync", "SyncStream.read", "network_read"),
+]
+
+# 这些阶段是在等待网络，不计入客户端 CPU 开销
+WAIT_STAGES = {"connect", "first_byte", "network_read"}
+
+
+@dataclass
+class RequestProfile:
+    """单个请求的分阶段耗时（秒）"""
+    label: str
+    total: float = 0.0
+    chunks: int = 0
+    stages: dict[str, float] = field(default_factory=lambda: defaultdict(float))
+
+    @property
+    def cpu(self) -> float:
+        """扣除网络等待后的客户端耗时"""
+        return self.total - sum(self.stages.get(stage, 0.0) for stage in WAIT_STAGES)
+
+
+class _Frame:
+    __slots__ = ("name", "start", "children")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.children = 0.0
+
+
+class StageProfiler:
+    """按调用栈统计各阶段自身耗时"""
+
+    def __init__(self):
+        self.requests: list[RequestProfile] = []
+        # 折叠栈: ("label", "stage", ...) -> 自身耗时
+        self.folded: dict[tuple[str, ...], float] = defaultdict(float)
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def profile(self):
+        """启用计时：在退出时恢复所有被替换的函数"""
+        patched = []
+        try:
+            for module_name, path, stage in _TARGETS:
+                owner = importlib.import_module(module_name)
+                *parents, attr = path.split(".")
+                for parent in parents:
+                    owner = getattr(owner, parent)
+                original = owner.__dict__[attr]
+                setattr(owner, attr, self._wrap(original, stage))
+                patched.append((owner, attr, original))
+            yield self
+        finally:
+            for owner, attr, original in reversed(patched):
+                setattr(owner, attr, original)
+
+    @contextlib.contextmanager
+    def request(self, label: str):
+        """把其中的调用记为一个请求，label 作为火焰图的根节点"""
+        record = RequestProfile(label)
+        self._local.record = record
+        self._local.stack = [_Frame(label)]
+        self._local.awaiting_first_byte = False
+        try:
+            yield record
+        finally:
+            root = self._local.stack.pop()
+            record.total = time.perf_counter() - root.start
+            self._record(record, (label,), record.total - root.children, "other")
+            self._local.record = None
+            self.requests.append(record)
+
+    def folded_lines(self, unit: float = 1e-6) -> list[str]:
+        """折叠栈格式的每一行: "frame;frame;frame 数值"，数值默认单位为微秒"""
+        return [f"{';'.join(stack)} {round(value / unit)}" for stack, value in sorted(self.folded.items())]
+
+    def write_folded(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(self.folded_lines()) + "\n")
+
+    def _wrap(self, func, stage: str):
+        profiler = self
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            local = profiler._local
+            stack = getattr(local, "stack", None)
+            if not stack or getattr(local, "record", None) is None:
+                return func(*args, **kwargs)
+            name = stage
+            if stage == "http_send":
+                local.awaiting_first_byte = True
+            elif stage == "network_read" and local.awaiting_first_byte:
+                name = "first_byte"
+                local.awaiting_first_byte = False
+            frame = _Frame(name)
+            stack.append(frame)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stack.pop()
+                elapsed = time.perf_counter() - frame.start
+                stack[-1].children += elapsed
+                path = tuple(f.name for f in stack) + (name,)
+                profiler._record(local.record, path, elapsed - frame.children, name)
+
+        return wrapper
+
+    def _record(self, record: RequestProfile, path: tuple[str, ...], self_time: float, stage: str) -> None:
+        record.stages[stage] += self_time
+        self.folded[path] += self_time
+
+
+def average_stages(records: list[RequestProfile]) -> dict[str, float]:
+    """多个请求各阶段的平均耗时"""
+    totals: dict[str, float] = defaultdict(float)
+    for record in records:
+        for stage, value in record.stages.items():
+            totals[stage] += value
+    return {stage: value / len(records) for stage, value in totals.items()} if records else {}
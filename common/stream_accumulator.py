@@ -0,0 +1,144 @@
+"""
+线性时间的流式消息累积器
+
+示例中常见的写法 `full = chunk if full is None else full + chunk` 每合并一次都会
+复制之前累积的全部内容，生成 n 个块的总开销是 O(n²)，并产生大量临时对象。
+StreamAccumulator 只把各个增量追加到列表中，流结束时才拼接并构造一次最终的 AIMessage：
+- 文本增量：按顺序保存，最后 "".join
+- 工具调用片段 (tool_call_chunks)：按 index 分组保存参数片段，最后拼接并解析
+- usage_metadata：逐块累加
+
+默认不保留块对象，处理完即可被回收；需要时可以设置 keep_chunks=True。
+
+用法:
+    acc = StreamAccumulator()
+    for chunk in model.stream("天空是什么颜色？"):
+        print(chunk.content, end="", flush=True)
+        acc.add(chunk)
+    message = acc.message()
+"""
+from collections.abc import AsyncIterable, Iterable
+
+from langchain_core.messages import AIMessage, AIMessageChunk, message_chunk_to_message
+from langchain_core.messages.ai import UsageMetadata, add_usage
+
+
+class StreamAccumulator:
+    """以 O(n) 的代价把 AIMessageChunk 流合并为一条 AIMessage"""
+
+    def __init__(self, keep_chunks: bool = False):
+        self.chunk_count = 0
+        self.chunks: list[AIMessageChunk] | None = [] if keep_chunks else None
+        self._text_parts: list[str] = []
+        # 内容为 content block 列表时，按 block 的 index 分组保存文本片段（按首次出现的顺序）
+        self._blocks: dict[int | tuple, dict] = {}
+        self._block_text: dict[int | tuple, list[str]] = {}
+        # 工具调用片段：index -> {"id", "name", "args": [参数片段]}
+        self._tool_calls: dict[int, dict] = {}
+        self._usage: UsageMetadata | None = None
+        self._response_metadata: dict = {}
+        self._additional_kwargs: dict = {}
+        self._id: str | None = None
+
+    @property
+    def text(self) -> str:
+        """目前为止累积的文本内容"""
+        return "".join(self._text_parts)
+
+    def add(self, chunk: AIMessageChunk) -> None:
+        self.chunk_count += 1
+        if self.chunks is not None:
+            self.chunks.append(chunk)
+
+        content = chunk.content
+        if isinstance(content, str):
+            if content:
+                self._text_parts.append(content)
+        else:
+            self._add_blocks(content)
+
+        for tool_chunk in chunk.tool_call_chunks:
+            index = tool_chunk.get("index")
+            if index is None:
+                index = len(self._tool_calls)
+            call = self._tool_calls.get(index)
+            if call is None:
+                call = self._tool_calls[index] = {"id": None, "name": None, "args": []}
+            if tool_chunk.get("id"):
+                call["id"] = tool_chunk["id"]
+            if tool_chunk.get("name"):
+                call["name"] = tool_chunk["name"]
+            if tool_chunk.get("args"):
+                call["args"].append(tool_chunk["args"])
+
+        if chunk.usage_metadata:
+            self._usage = add_usage(self._usage, chunk.usage_metadata)
+        if chunk.response_metadata:
+            self._response_metadata.update(chunk.response_metadata)
+        for key, value in chunk.additional_kwargs.items():
+            if isinstance(value, str):
+                self._additional_kwargs.setdefault(key, []).append(value)
+            else:
+                self._additional_kwargs[key] = value
+        # 与 AIMessageChunk 相加的规则一致：优先使用服务端返回的 id，而不是 LangChain 生成的 lc_ 前缀 id
+        if chunk.id and (self._id is None or (self._id.startswith("lc_") and not chunk.id.startswith("lc_"))):
+            self._id = chunk.id
+
+    def consume(self, stream: Iterable[AIMessageChunk]) -> AIMessage:
+        """消费整个同步流并返回最终消息"""
+        for chunk in stream:
+            self.add(chunk)
+        return self.message()
+
+    async def aconsume(self, stream: AsyncIterable[AIMessageChunk]) -> AIMessage:
+        """消费整个异步流并返回最终消息"""
+        async for chunk in stream:
+            self.add(chunk)
+        return self.message()
+
+    def message(self) -> AIMessage:
+        """拼接所有增量，构造最终的 AIMessage"""
+        if self._blocks:
+            for index, parts in self._block_text.items():
+                self._blocks[index]["text"] = "".join(parts)
+            blocks = list(self._blocks.values())
+            content = [{"type": "text", "text": self.text}, *blocks] if self._text_parts else blocks
+        else:
+            content = self.text
+
+        tool_call_chunks = [
+            {
+                "index": index,
+                "id": call["id"],
+                "name": call["name"],
+                "args": "".join(call["args"]),
+                "type": "tool_call_chunk",
+            }
+            for index, call in sorted(self._tool_calls.items())
+        ]
+        additional_kwargs = {
+            key: "".join(value) if isinstance(value, list) else value
+            for key, value in self._additional_kwargs.items()
+        }
+        # 只在最后构造一次 AIMessageChunk，由它完成工具调用参数的 JSON 解析
+        merged = AIMessageChunk(
+            content=content,
+            tool_call_chunks=tool_call_chunks,
+            usage_metadata=self._usage,
+            response_metadata=self._response_metadata,
+            additional_kwargs=additional_kwargs,
+            id=self._id,
+        )
+        return message_chunk_to_message(merged)
+
+    def _add_blocks(self, blocks: list) -> None:
+        for block in blocks:
+            if isinstance(block, str):
+                self._text_parts.append(block)
+                continue
+            # 没有 index 的 block 各自独立，不与其他块合并
+            index = block.get("index", ("block", len(self._blocks)))
+            if index not in self._blocks:
+                self._blocks[index] = {k: v for k, v in block.items() if k != "index"}
+            if block.get("type") == "text":
+                self._block_text.setdefault(index, []).append(block.get("text", ""))
@@ -0,0 +1,178 @@
+"""
+流式增量合并
+
+流式示例对每个块都调用一次 print(..., flush=True)，每个 token 一次系统调用；服务中同样的写法
+变成每个 token 一个 websocket 帧或一次回调，流一多，这部分开销就占满 CPU。
+coalesce / acoalesce 把连续的 AIMessageChunk 合并成帧再交给下游：
+- 时间窗口：帧中第一个块到达后 interval 秒（默认 30ms）发出
+- 大小：帧中文本和工具参数累计达到 max_bytes 字节时立即发出
+- 第一个带内容的块立即发出，不增加首 token 延迟
+- 工具调用边界（新工具调用的第一个片段）：先发出之前累积的内容，工具调用的开头单独成帧
+- 流结束时发出剩余内容
+合并后的帧仍是 AIMessageChunk（按 AIMessageChunk 相加的规则合并），下游代码不需要修改，
+帧序列相加的结果与原始块序列相加的结果一致。
+
+同步版本只能在新块到达时检查时间窗口：流停顿时，已累积的内容要等到下一个块或流结束才发出
+（最多延迟一个 token 间隔）。异步版本在第一帧之前直接读取源流（首帧不经过任务切换），
+之后由单独的任务读取，时间窗口到期时由事件循环的定时器发出帧，不受流停顿影响；
+每帧只经过一次队列，而不是每个块一次。
+
+用法:
+    for frame in coalesce(model.stream("写一首诗")):
+        print(frame.content, end="", flush=True)
+
+    async for frame in acoalesce(model.astream("写一首诗"), interval=0.05):
+        await websocket.send_text(frame.content)
+"""
+import asyncio
+import time
+from collections.abc import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+from langchain_core.messages import AIMessageChunk
+from langchain_core.messages.ai import add_ai_message_chunks
+
+# 异步版本中表示流结束的标记
+_END = object()
+
+
+class _Framer:
+    """按时间窗口、大小和边界把块分帧，同步、异步版本共用"""
+
+    def __init__(self, interval: float, max_bytes: int):
+        if interval < 0 or max_bytes < 1:
+            raise ValueError("interval 不能为负数，max_bytes 必须大于 0")
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.pending: list[AIMessageChunk] = []
+        # 当前帧中第一个块的到达时间，以及累计的文本和工具参数字节数
+        self.started = 0.0
+        self.size = 0
+        self._first = True
+
+    def push(self, chunk: AIMessageChunk, now: float) -> list[AIMessageChunk]:
+        """加入一个块，返回需要立即发出的帧"""
+        frames = []
+        boundary = any(c.get("id") or c.get("name") for c in chunk.tool_call_chunks)
+        if boundary and self.pending:
+            frames.append(self.flush())
+        if not self.pending:
+            self.started = now
+        self.pending.append(chunk)
+        size = _payload_size(chunk)
+        self.size += size
+        if (
+            boundary
+            or (self._first and size)
+            or self.size >= self.max_bytes
+            or now - self.started >= self.interval
+        ):
+            self._first = self._first and not size
+            frames.append(self.flush())
+        return frames
+
+    def flush(self) -> AIMessageChunk:
+        pending, self.pending, self.size = self.pending, [], 0
+        if len(pending) == 1:
+            return pending[0]
+        return add_ai_message_chunks(pending[0], *pending[1:])
+
+
+def coalesce(
+    chunks: Iterable[AIMessageChunk],
+    *,
+    interval: float = 0.03,
+    max_bytes: int = 4096,
+) -> Iterator[AIMessageChunk]:
+    """把同步流合并成帧
+
+    Args:
+        chunks: model.stream() 返回的块
+        interval: 时间窗口（秒），0 表示不按时间合并（每个块单独成帧）
+        max_bytes: 一帧中文本和工具参数的字节数上限
+    """
+    framer = _Framer(interval, max_bytes)
+    for chunk in chunks:
+        yield from framer.push(chunk, time.monotonic())
+    if framer.pending:
+        yield framer.flush()
+
+
+async def acoalesce(
+    chunks: AsyncIterable[AIMessageChunk],
+    *,
+    interval: float = 0.03,
+    max_bytes: int = 4096,
+) -> AsyncIterator[AIMessageChunk]:
+    """把异步流合并成帧，参数与 coalesce 一致"""
+    loop = asyncio.get_running_loop()
+    framer = _Framer(interval, max_bytes)
+    iterator = aiter(chunks)
+    async for chunk in iterator:
+        frames = framer.push(chunk, loop.time())
+        for frame in frames:
+            yield frame
+        if frames:
+            break
+    else:
+        if framer.pending:
+            yield framer.flush()
+        return
+
+    queue: asyncio.Queue = asyncio.Queue()
+    timer: asyncio.TimerHandle | None = None
+
+    def on_timer() -> None:
+        nonlocal timer
+        timer = None
+        if framer.pending:
+            queue.put_nowait(framer.flush())
+
+    async def pump() -> None:
+        nonlocal timer
+        try:
+            async for chunk in iterator:
+                for frame in framer.push(chunk, loop.time()):
+                    queue.put_nowait(frame)
+                if not framer.pending:
+                    if timer is not None:
+                        timer.cancel()
+                        timer = None
+                elif timer is None:
+                    timer = loop.call_at(framer.started + framer.interval, on_timer)
+            if timer is not None:
+                timer.cancel()
+            if framer.pending:
+                queue.put_nowait(framer.flush())
+            queue.put_nowait(_END)
+        except Exception as e:
+            queue.put_nowait(e)
+
+    task = loop.create_task(pump())
+    try:
+        while True:
+            frame = await queue.get()
+            if frame is _END:
+                break
+            if isinstance(frame, Exception):
+                raise frame
+            yield frame
+    finally:
+        # 下游提前结束时停止读取源流
+        task.cancel()
+        if timer is not None:
+            timer.cancel()
+
+
+def _payload_size(chunk: AIMessageChunk) -> int:
+    """块中文本和工具参数的字节数"""
+    content = chunk.content
+    if isinstance(content, str):
+        size = len(content.encode("utf-8"))
+    else:
+        size = sum(
+            len((block if isinstance(block, str) else block.get("text") or "").encode("utf-8"))
+            for block in content
+        )
+    for tool_chunk in chunk.tool_call_chunks:
+        size += len((tool_chunk.get("args") or "").encode("utf-8"))
+    return size
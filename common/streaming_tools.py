@@ -0,0 +1,183 @@
+"""
+边流式接收边执行工具调用
+
+invoke 要等整个响应返回后才能看到 tool_calls。流式输出时，工具调用的参数以 tool_call_chunks
+的形式逐段到达，前面的调用往往在响应结束之前就已经完整了。
+stream_with_tools 在流式接收的同时逐段扫描每个调用的参数 JSON（只维护括号深度和字符串状态，
+每个片段的开销与片段长度成正比），某个调用的参数一完整就交给 ToolExecutor 执行，
+后面的调用继续流式接收，这样模型生成和工具执行就重叠起来了。
+
+流结束后用 StreamAccumulator 合并出完整的 AIMessage；没有在流中提前完成的调用（例如没有参数）
+此时再执行；参数无法解析的调用返回 status="error" 的 ToolMessage。
+ToolMessage 的顺序与 tool_calls 一致，所有结果在一次后续调用中发回模型，与 invoke_with_tools 相同。
+
+用法:
+    executor = ToolExecutor([get_weather])
+    messages = stream_with_tools(model.bind_tools([get_weather]), "北京和上海的天气怎么样？", executor)
+    print(messages[-1].content)
+"""
+import asyncio
+import json
+from collections.abc import Callable
+
+from langchain_core.language_models import LanguageModelInput
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from common.stream_accumulator import StreamAccumulator
+from common.tool_executor import ToolExecutor, input_to_messages
+
+
+class JsonCompletion:
+    """增量判断 JSON 对象/数组是否已经完整（不做完整解析）"""
+    __slots__ = ("depth", "in_string", "escape", "started", "complete")
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.complete = False
+
+    def feed(self, text: str) -> bool:
+        """追加一个片段，返回 JSON 是否已经完整"""
+        if self.complete:
+            return True
+        for char in text:
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+                self.started = True
+            elif char in "}]":
+                self.depth -= 1
+                if self.started and self.depth == 0:
+                    self.complete = True
+                    return True
+        return False
+
+
+class _PendingCall:
+    __slots__ = ("id", "name", "args", "scanner", "task")
+
+    def __init__(self):
+        self.id: str | None = None
+        self.name: str | None = None
+        self.args: list[str] = []
+        self.scanner = JsonCompletion()
+        self.task: asyncio.Task | None = None
+
+
+async def astream_with_tools(
+    model: Runnable,
+    messages: LanguageModelInput,
+    executor: ToolExecutor,
+    *,
+    max_rounds: int = 5,
+    config: RunnableConfig | None = None,
+    on_chunk: Callable[[AIMessageChunk], None] | None = None,
+) -> list[BaseMessage]:
+    """流式工具调用循环，工具在参数完整时立即开始执行
+
+    Args:
+        model: 绑定了工具的模型
+        messages: 初始输入
+        executor: 执行工具的 ToolExecutor
+        max_rounds: 最多执行几轮工具调用
+        config: 传给模型和工具的配置
+        on_chunk: 每收到一个块调用一次，例如用来打印文本
+
+    Returns:
+        完整的消息列表，最后一条是模型的最终回答
+    """
+    history = input_to_messages(messages)
+    for round_ in range(max_rounds + 1):
+        last_round = round_ == max_rounds
+        accumulator = StreamAccumulator()
+        calls: dict[int, _PendingCall] = {}
+        try:
+            async for chunk in model.astream(history, config):
+                accumulator.add(chunk)
+                if on_chunk is not None:
+                    on_chunk(chunk)
+                if last_round:
+                    continue
+                for tool_chunk in chunk.tool_call_chunks:
+                    index = tool_chunk.get("index")
+                    if index is None:
+                        index = len(calls)
+                    call = calls.get(index)
+                    if call is None:
+                        call = calls[index] = _PendingCall()
+                    call.id = tool_chunk.get("id") or call.id
+                    call.name = tool_chunk.get("name") or call.name
+                    fragment = tool_chunk.get("args")
+                    if fragment:
+                        call.args.append(fragment)
+                        if call.task is None and call.scanner.feed(fragment):
+                            _dispatch(call, executor, config)
+            response = accumulator.message()
+            history.append(response)
+            if last_round or not (response.tool_calls or response.invalid_tool_calls):
+                break
+            history.extend(await _collect(response, calls, executor, config))
+        finally:
+            # 出错时取消尚未完成的工具
+            for call in calls.values():
+                if call.task is not None and not call.task.done():
+                    call.task.cancel()
+    return history
+
+
+def stream_with_tools(
+    model: Runnable,
+    messages: LanguageModelInput,
+    executor: ToolExecutor,
+    **kwargs,
+) -> list[BaseMessage]:
+    """astream_with_tools 的同步版本，参数相同；不能在运行中的事件循环里调用"""
+    return asyncio.run(astream_with_tools(model, messages, executor, **kwargs))
+
+
+def _dispatch(call: _PendingCall, executor: ToolExecutor, config: RunnableConfig | None) -> None:
+    if call.id is None or call.name is None:
+        return
+    try:
+        args = json.loads("".join(call.args))
+    except json.JSONDecodeError:
+        # 括号配平但不是合法 JSON，留到流结束后按无效调用处理
+        return
+    tool_call = {"name": call.name, "args": args, "id": call.id, "type": "tool_call"}
+    call.task = asyncio.create_task(executor.arun_call(tool_call, config))
+
+
+async def _collect(
+    response: AIMessage,
+    calls: dict[int, _PendingCall],
+    executor: ToolExecutor,
+    config: RunnableConfig | None,
+) -> list[ToolMessage]:
+    """按 tool_calls 的顺序收集结果：已经在执行的直接等待，其余的现在执行"""
+    started = {call.id: call.task for call in calls.values() if call.task is not None}
+    pending = []
+    for tool_call in response.tool_calls:
+        task = started.get(tool_call["id"])
+        pending.append(task if task is not None else executor.arun_call(tool_call, config))
+    results = list(await asyncio.gather(*pending))
+    for invalid in response.invalid_tool_calls:
+        results.append(
+            ToolMessage(
+                content=f"工具参数不是合法的 JSON: {invalid.get('args')}",
+                name=invalid.get("name") or "",
+                tool_call_id=invalid.get("id") or "",
+                status="error",
+            )
+        )
+    return results
@@ -0,0 +1,291 @@
+"""
+带本地修复的结构化输出校验
+
+with_structured_output(Movie, include_raw=True) 收到格式有问题的 JSON 时（代码块包裹、前后多了说明文字、
+单引号、数字写成 "2010年" 之类的字符串），parsed 直接为 None，通常只能把完整的提示词重新发送一遍。
+RepairingStructuredOutput 在本地先尝试修复，只有修复不了时才发送一个很短的修复请求：
+1. 快速路径：用缓存的 TypeAdapter 直接校验原始文本（pydantic-core 解析 JSON，不经过 json.loads）
+2. 本地修复：截取第一个完整的 JSON 对象（去掉代码块和前后文字），按 Python 字面量宽松解析
+   （单引号、True/False/None、末尾逗号），再根据校验错误把 "2010年" 这类字符串中的数字取出来
+3. 远程修复：只发送原始输出和校验错误，请模型返回修正后的 JSON，不重发原始提示词
+每个 schema 的 TypeAdapter 只创建一次；stats 统计各条路径的次数，以及相比重发完整请求省下的往返。
+
+用法:
+    structured = RepairingStructuredOutput(model, Movie)
+    result = structured.invoke("请以 JSON 格式提供电影《盗梦空间》的详细信息")
+    result["parsed"], result["repair"]  # Movie(...), "local"
+    print(structured.stats)
+"""
+import ast
+import functools
+import json
+import re
+import warnings
+from dataclasses import dataclass
+from typing import Any, Literal
+
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_openai.chat_models.base import _convert_to_openai_response_format
+from pydantic import TypeAdapter, ValidationError
+
+# 修复方式: none 原始输出有效，local 本地修复，remote 发送了修复请求，failed 都没有成功
+RepairKind = Literal["none", "local", "remote", "failed"]
+
+REPAIR_PROMPT = (
+    "下面是一段不符合要求的 JSON 输出和校验错误。"
+    "请只返回修正后的 JSON，保留原有的数据，不要添加任何说明。"
+)
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?")
+_NUMBER_ERRORS = {"int_parsing", "float_parsing", "int_from_float", "decimal_parsing"}
+_NAMES = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+
+
+@functools.cache
+def validator(schema: type) -> TypeAdapter:
+    """schema 对应的 TypeAdapter，每个 schema 只编译一次"""
+    return TypeAdapter(schema)
+
+
+@dataclass
+class RepairStats:
+    """各条路径的次数"""
+    calls: int = 0
+    valid: int = 0
+    local_repairs: int = 0
+    remote_repairs: int = 0
+    failures: int = 0
+    # 修复请求的输入 token（按服务返回的 usage 统计）
+    repair_input_tokens: int = 0
+
+    @property
+    def round_trips_saved(self) -> int:
+        """本地修复的次数：不修复时每次都要重发完整请求"""
+        return self.local_repairs
+
+
+def repair_locally(text: str, schema: type) -> tuple[Any, ValidationError | ValueError | None, RepairKind]:
+    """只在本地校验和修复 text，返回 (结果或 None, 最后的错误, "none"/"local"/"failed")"""
+    adapter = validator(schema)
+    try:
+        return adapter.validate_json(text), None, "none"
+    except ValidationError as e:
+        error: ValidationError | ValueError = e
+    candidate = _extract_json(text)
+    if candidate is None:
+        return None, ValueError("输出中没有 JSON 对象"), "failed"
+    try:
+        value = _loads_lenient(candidate)
+    except (ValueError, SyntaxError):
+        return None, error, "failed"
+    try:
+        return adapter.validate_python(value), None, "local"
+    except ValidationError as e:
+        error = e
+    if _fix_numbers(value, error):
+        try:
+            return adapter.validate_python(value), None, "local"
+        except ValidationError as e:
+            error = e
+    return None, error, "failed"
+
+
+class RepairingStructuredOutput:
+    """结构化输出：缓存的校验器 + 本地修复 + 只带错误的短修复请求"""
+
+    def __init__(
+        self,
+        model: BaseChatModel,
+        schema: type,
+        *,
+        method: Literal["json_schema", "json_mode", "function_calling"] = "json_schema",
+        repair_model: BaseChatModel | None = None,
+        max_remote_repairs: int = 1,
+    ):
+        """
+        Args:
+            model: 聊天模型
+            schema: pydantic 模型、TypedDict 等 TypeAdapter 支持的类型
+            method: 与 with_structured_output 相同的绑定方式
+            repair_model: 发送修复请求的模型，默认与 model 相同
+            max_remote_repairs: 最多发送几次修复请求，0 表示只做本地修复
+        """
+        self.schema = schema
+        self.method = method
+        self.max_remote_repairs = max_remote_repairs
+        self.stats = RepairStats()
+        validator(schema)  # 预先编译
+        self._model = _bind(model, schema, method)
+        # 修复请求固定用 json_schema 约束输出
+        self._repair_model = _bind(repair_model or model, schema, "json_schema")
+
+    def invoke(self, input: LanguageModelInput, config: RunnableConfig | None = None) -> dict[str, Any]:
+        """返回 {"raw", "parsed", "parsing_error", "repair"}，前三项与 include_raw=True 的结果相同"""
+        raw = self._model.invoke(input, config)
+        parsed, error, kind = self._local(raw)
+        for _ in range(self.max_remote_repairs if kind == "failed" else 0):
+            repaired = self._repair_model.invoke(self._repair_messages(raw, error), config)
+            self._add_usage(repaired)
+            parsed, error, kind = self._local(repaired)
+            if kind != "failed":
+                kind = "remote"
+                break
+        return self._result(raw, parsed, error, kind)
+
+    async def ainvoke(self, input: LanguageModelInput, config: RunnableConfig | None = None) -> dict[str, Any]:
+        """invoke 的异步版本"""
+        raw = await self._model.ainvoke(input, config)
+        parsed, error, kind = self._local(raw)
+        for _ in range(self.max_remote_repairs if kind == "failed" else 0):
+            repaired = await self._repair_model.ainvoke(self._repair_messages(raw, error), config)
+            self._add_usage(repaired)
+            parsed, error, kind = self._local(repaired)
+            if kind != "failed":
+                kind = "remote"
+                break
+        return self._result(raw, parsed, error, kind)
+
+    def _local(self, message: AIMessage) -> tuple[Any, Exception | None, RepairKind]:
+        if self.method == "function_calling" and message.tool_calls:
+            # 参数已经是合法 JSON，只需校验
+            try:
+                return validator(self.schema).validate_python(message.tool_calls[0]["args"]), None, "none"
+            except ValidationError as e:
+                text = json.dumps(message.tool_calls[0]["args"], ensure_ascii=False)
+                parsed, error, kind = repair_locally(text, self.schema)
+                return parsed, error or e, kind
+        return repair_locally(_output_text(message, self.method), self.schema)
+
+    def _repair_messages(self, raw: AIMessage, error: Exception | None) -> list:
+        return [
+            SystemMessage(REPAIR_PROMPT),
+            HumanMessage(f"输出:\n{_output_text(raw, self.method)}\n\n校验错误:\n{error}"),
+        ]
+
+    def _add_usage(self, message: AIMessage) -> None:
+        if message.usage_metadata:
+            self.stats.repair_input_tokens += message.usage_metadata["input_tokens"]
+
+    def _result(self, raw: AIMessage, parsed: Any, error: Exception | None, kind: RepairKind) -> dict[str, Any]:
+        stats = self.stats
+        stats.calls += 1
+        if kind == "none":
+            stats.valid += 1
+        elif kind == "local":
+            stats.local_repairs += 1
+        elif kind == "remote":
+            stats.remote_repairs += 1
+        else:
+            stats.failures += 1
+        return {"raw": raw, "parsed": parsed, "parsing_error": error if parsed is None else None, "repair": kind}
+
+
+def _bind(model: BaseChatModel, schema: type, method: str) -> Runnable:
+    """与 with_structured_output 相同的请求参数，但不解析结果（response_format 用 dict，SDK 不会校验）"""
+    if method == "function_calling":
+        name = convert_to_openai_tool(schema)["function"]["name"]
+        return model.bind_tools([schema], tool_choice=name, parallel_tool_calls=False)
+    if method == "json_mode":
+        return model.bind(response_format={"type": "json_object"})
+    if method == "json_schema":
+        json_schema = validator(schema).json_schema()
+        json_schema.setdefault("title", getattr(schema, "__name__", "output"))
+        return model.bind(response_format=_convert_to_openai_response_format(json_schema))
+    raise ValueError(f"不支持的 method: {method}")
+
+
+def _output_text(message: AIMessage, method: str) -> str:
+    if method == "function_calling":
+        for call in message.invalid_tool_calls:
+            return call.get("args") or ""
+    return message.text
+
+
+def _extract_json(text: str) -> str | None:
+    """截取第一个括号配平的 JSON 对象或数组，同时识别单引号和双引号字符串"""
+    start = next((i for i, char in enumerate(text) if char in "{["), None)
+    if start is None:
+        return None
+    depth = 0
+    quote = None
+    escape = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if quote:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
+def _loads_lenient(text: str) -> Any:
+    """先按 JSON 解析，失败时按 Python 字面量解析（单引号、True/None、末尾逗号）"""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    # 模型输出中的 '\d' 等无效转义会触发 SyntaxWarning（-W error 时变成异常），这里按原样保留
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", SyntaxWarning)
+        tree = ast.parse(text.strip(), mode="eval")
+    return _literal(tree.body)
+
+
+def _literal(node: ast.AST | None) -> Any:
+    if not isinstance(node, ast.AST):
+        # 字典解包 {**b} 的 key 为 None
+        raise ValueError(f"不支持的字面量: {node!r}")
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Dict):
+        result = {}
+        for key, value in zip(node.keys, node.values):
+            key = _literal(key)
+            if isinstance(key, (list, dict)):
+                raise ValueError("字典的 key 不能是列表或字典")
+            result[key] = _literal(value)
+        return result
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [_literal(item) for item in node.elts]
+    if isinstance(node, ast.Name) and node.id in _NAMES:
+        return _NAMES[node.id]
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _literal(node.operand)
+        if isinstance(value, (int, float)):
+            return -value if isinstance(node.op, ast.USub) else value
+    raise ValueError(f"不支持的字面量: {ast.dump(node)[:80]}")
+
+
+def _fix_numbers(value: Any, error: ValidationError) -> bool:
+    """把校验错误中 "2010年"、"8.8分" 这类字符串替换为其中的数字，返回是否做了修改"""
+    changed = False
+    for item in error.errors():
+        if item["type"] not in _NUMBER_ERRORS or not isinstance(item["input"], str):
+            continue
+        match = _NUMBER.search(item["input"])
+        *path, last = item["loc"]
+        try:
+            container = value
+            for key in path:
+                container = container[key]
+            if match is not None and container[last] == item["input"]:
+                number = match.group()
+                container[last] = float(number) if item["type"] == "float_parsing" else int(float(number))
+                changed = True
+        except (KeyError, IndexError, TypeError):
+            continue
+    return changed
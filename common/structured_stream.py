@@ -0,0 +1,337 @@
+"""
+流式结构化输出
+
+model.with_structured_output(Movie) 默认（json_schema 方式）要等完整的 JSON 返回并校验后才有结果；
+function_calling 方式的 stream() 虽然会输出中间结果，但每个块都要把累计的参数字符串从头重新解析一遍，
+总开销随输出长度平方增长，而且会输出不完整的数字（2010 先变成 201）。
+
+stream_structured 用同样的方式绑定模型（json_schema / function_calling / json_mode），
+把流式输出的文本交给 PartialJsonParser 增量解析：
+- 每个字符只处理一次，解析状态（括号栈、当前字符串/数字）跨块保留，每个块的开销只与块的长度有关
+- 只有完整的值才会写入结果，不会出现被截断的字符串或数字
+- 每当某个块中有字段完成时产出一个 StructuredUpdate：这个块中完成的字段事件和部分填充的对象，
+  部分结果对象只创建一次，之后只写入新完成的字段，开销同样与已经收到的内容无关
+- 流结束后用 schema 完整校验，最后一个 StructuredUpdate 的 final 是校验后的对象
+
+用法:
+    for update in stream_structured(model, Movie, "请以 JSON 格式提供电影《盗梦空间》的详细信息"):
+        for path, value in update.fields:
+            print(path, value)          # ("title",) 盗梦空间
+    movie = update.final
+"""
+import functools
+import re
+from collections.abc import AsyncIterator, Iterator
+from dataclasses import dataclass, field
+from typing import Any, Literal, Optional
+
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_openai.chat_models.base import _convert_to_openai_response_format
+from pydantic import BaseModel, create_model
+
+from common.stream_accumulator import StreamAccumulator
+
+# 字段路径，如 ("actors", 0, "name")
+JsonPath = tuple[str | int, ...]
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r"[,}\]\s]")
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_LITERALS = {"true": True, "false": False, "null": None}
+
+# 解析状态
+_VALUE, _KEY, _COLON, _AFTER, _STRING, _SCALAR = range(6)
+
+
+class PartialJsonParser:
+    """增量 JSON 解析器，边接收边构建结果
+
+    顶层必须是对象或数组，之前的文本（例如 ```json）会被跳过，完成之后的文本被忽略。
+    value 是正在构建的结果，只包含已经完整的值（对象和数组在打开时就放进父容器，随后继续填充）。
+    """
+
+    def __init__(self):
+        self.value: dict | list | None = None
+        self.done = False
+        # 每层容器: [容器, 路径, 对象中等待值的 key]
+        self._stack: list[list] = []
+        self._state = _VALUE
+        # 当前字符串或数字的片段
+        self._parts: list[str] = []
+        self._is_key = False
+        # 跨块的转义序列，如 "\\u4e"
+        self._escape = ""
+        self._surrogates = False
+        self._events: list[tuple[JsonPath, Any]] = []
+
+    def feed(self, text: str) -> list[tuple[JsonPath, Any]]:
+        """追加一个片段，返回其中完成的值 (路径, 值)，按完成的顺序排列，对象和数组在闭合时报告"""
+        self._events = []
+        i, n = 0, len(text)
+        while i < n and not self.done:
+            state = self._state
+            if state == _STRING:
+                i = self._scan_string(text, i)
+                continue
+            if state == _SCALAR:
+                match = _SCALAR_END.search(text, i)
+                end = match.start() if match else n
+                self._parts.append(text[i:end])
+                i = end
+                if match:
+                    self._finish_scalar()
+                continue
+            char = text[i]
+            i += 1
+            if char in " \t\r\n":
+                continue
+            if state == _VALUE:
+                if char == "{":
+                    self._open({})
+                elif char == "[":
+                    self._open([])
+                elif not self._stack:
+                    continue  # 顶层对象之前的文本
+                elif char == '"':
+                    self._is_key = False
+                    self._state = _STRING
+                elif char == "]" and isinstance(self._stack[-1][0], list):
+                    self._close()  # 空数组
+                else:
+                    self._parts.append(char)
+                    self._state = _SCALAR
+            elif state == _KEY:
+                if char == '"':
+                    self._is_key = True
+                    self._state = _STRING
+                elif char == "}":
+                    self._close()  # 空对象
+                else:
+                    raise ValueError(f"JSON 格式错误：期望 key，收到 {char!r}")
+            elif state == _COLON:
+                if char != ":":
+                    raise ValueError(f"JSON 格式错误：期望 ':'，收到 {char!r}")
+                self._state = _VALUE
+            elif char == ",":
+                self._state = _KEY if isinstance(self._stack[-1][0], dict) else _VALUE
+            elif char in "}]":
+                self._close()
+            else:
+                raise ValueError(f"JSON 格式错误：期望 ',' 或结束括号，收到 {char!r}")
+        return self._events
+
+    def result(self) -> dict | list:
+        """完整的解析结果，JSON 还没有结束时抛出 ValueError"""
+        if not self.done:
+            raise ValueError("JSON 不完整")
+        return self.value
+
+    def _scan_string(self, text: str, i: int) -> int:
+        n = len(text)
+        parts = self._parts
+        while i < n:
+            if self._escape:
+                self._escape += text[i]
+                i += 1
+                escape = self._escape
+                if escape[1] == "u":
+                    if len(escape) < 6:
+                        continue
+                    code = int(escape[2:], 16)
+                    self._surrogates = self._surrogates or 0xD800 <= code <= 0xDFFF
+                    parts.append(chr(code))
+                else:
+                    parts.append(_ESCAPES.get(escape[1], escape[1]))
+                self._escape = ""
+                continue
+            match = _STRING_SPECIAL.search(text, i)
+            if match is None:
+                parts.append(text[i:])
+                return n
+            j = match.start()
+            if j > i:
+                parts.append(text[i:j])
+            if text[j] == "\\":
+                self._escape = "\\"
+                i = j + 1
+                continue
+            string = "".join(parts)
+            parts.clear()
+            if self._surrogates:
+                # \ud83d\ude00 这样的代理对合并为一个字符
+                string = string.encode("utf-16", "surrogatepass").decode("utf-16")
+                self._surrogates = False
+            if self._is_key:
+                self._stack[-1][2] = string
+                self._state = _COLON
+            else:
+                self._complete(string)
+            return j + 1
+        return i
+
+    def _finish_scalar(self) -> None:
+        token = "".join(self._parts)
+        self._parts.clear()
+        if token in _LITERALS:
+            value = _LITERALS[token]
+        else:
+            try:
+                value = float(token) if any(c in token for c in ".eE") else int(token)
+            except ValueError:
+                raise ValueError(f"JSON 格式错误：无法解析 {token!r}") from None
+        self._complete(value)
+
+    def _attach(self, value: Any) -> JsonPath:
+        if not self._stack:
+            self.value = value
+            return ()
+        container, path, key = self._stack[-1]
+        if isinstance(container, dict):
+            container[key] = value
+            return (*path, key)
+        container.append(value)
+        return (*path, len(container) - 1)
+
+    def _complete(self, value: Any) -> None:
+        self._events.append((self._attach(value), value))
+        self._state = _AFTER
+
+    def _open(self, container: dict | list) -> None:
+        path = self._attach(container)
+        self._stack.append([container, path, None])
+        self._state = _KEY if isinstance(container, dict) else _VALUE
+
+    def _close(self) -> None:
+        container, path, _ = self._stack.pop()
+        self._events.append((path, container))
+        self._state = _AFTER
+        if not self._stack:
+            self.done = True
+
+
+@dataclass
+class StructuredUpdate:
+    """一次进度更新"""
+    # 这个块中完成的字段 (路径, 值)
+    fields: list[tuple[JsonPath, Any]]
+    # 部分填充的对象，在后续的块中继续填充（每次更新都是同一个对象）：
+    # pydantic schema 为所有字段都可以为 None 的同名模型，只包含完整的顶层字段，嵌套对象是 dict；
+    # 其他 schema 为正在构建的 dict
+    partial: Any
+    # 最后一次更新中为完整校验后的结果，其余为 None
+    final: Any = None
+    # 最后一次更新中为合并后的原始消息
+    raw: AIMessage | None = field(default=None, repr=False)
+
+
+def stream_structured(
+    model: BaseChatModel,
+    schema: type[BaseModel] | dict,
+    input: LanguageModelInput,
+    *,
+    method: Literal["json_schema", "function_calling", "json_mode"] = "json_schema",
+    strict: bool | None = None,
+    config: RunnableConfig | None = None,
+) -> Iterator[StructuredUpdate]:
+    """流式的 with_structured_output，参数与 with_structured_output 相同
+
+    Yields:
+        每个有字段完成的块产出一个 StructuredUpdate，最后一个的 final 是校验后的结果
+    """
+    bound, from_tool = _bind(model, schema, method, strict)
+    builder = _UpdateBuilder(schema, from_tool)
+    for chunk in bound.stream(input, config):
+        update = builder.add(chunk)
+        if update is not None:
+            yield update
+    yield builder.finish()
+
+
+async def astream_structured(
+    model: BaseChatModel,
+    schema: type[BaseModel] | dict,
+    input: LanguageModelInput,
+    *,
+    method: Literal["json_schema", "function_calling", "json_mode"] = "json_schema",
+    strict: bool | None = None,
+    config: RunnableConfig | None = None,
+) -> AsyncIterator[StructuredUpdate]:
+    """stream_structured 的异步版本"""
+    bound, from_tool = _bind(model, schema, method, strict)
+    builder = _UpdateBuilder(schema, from_tool)
+    async for chunk in bound.astream(input, config):
+        update = builder.add(chunk)
+        if update is not None:
+            yield update
+    yield builder.finish()
+
+
+def _bind(model: BaseChatModel, schema, method: str, strict: bool | None) -> tuple[Runnable, bool]:
+    """与 with_structured_output 相同的绑定方式，返回 (绑定后的模型, 结果是否在工具参数中)"""
+    structured_format = {"kwargs": {"method": method, "strict": strict}, "schema": schema}
+    if method == "function_calling":
+        tool_name = convert_to_openai_tool(schema)["function"]["name"]
+        bound = model.bind_tools(
+            [schema],
+            tool_choice=tool_name,
+            parallel_tool_calls=False,
+            strict=strict,
+            ls_structured_output_format=structured_format,
+        )
+        return bound, True
+    if method == "json_schema":
+        response_format = _convert_to_openai_response_format(schema, strict=strict)
+    elif method == "json_mode":
+        response_format = {"type": "json_object"}
+    else:
+        raise ValueError(f"不支持的 method: {method}")
+    return model.bind(response_format=response_format, ls_structured_output_format=structured_format), False
+
+
+class _UpdateBuilder:
+    def __init__(self, schema, from_tool: bool):
+        self.schema = schema
+        self.from_tool = from_tool
+        self.parser = PartialJsonParser()
+        self.accumulator = StreamAccumulator()
+        # pydantic schema 时只创建一次部分结果对象，之后按顶层字段逐个填入
+        self._partial = _partial_model(schema).model_construct() if _is_pydantic(schema) else None
+
+    def add(self, chunk: AIMessageChunk) -> StructuredUpdate | None:
+        self.accumulator.add(chunk)
+        if self.from_tool:
+            # parallel_tool_calls=False，只有第一个调用
+            text = "".join(c.get("args") or "" for c in chunk.tool_call_chunks if c.get("index", 0) in (0, None))
+        else:
+            text = chunk.text
+        if not text:
+            return None
+        fields = self.parser.feed(text)
+        if not fields:
+            return None
+        if self._partial is None:
+            return StructuredUpdate(fields, self.parser.value)
+        state = self._partial.__dict__
+        for path, value in fields:
+            if len(path) == 1 and path[0] in state:
+                state[path[0]] = value
+        return StructuredUpdate(fields, self._partial)
+
+    def finish(self) -> StructuredUpdate:
+        value = self.parser.result()
+        final = self.schema.model_validate(value) if _is_pydantic(self.schema) else value
+        return StructuredUpdate([], final, final, self.accumulator.message())
+
+
+def _is_pydantic(schema) -> bool:
+    return isinstance(schema, type) and issubclass(schema, BaseModel)
+
+
+@functools.cache
+def _partial_model(schema: type[BaseModel]) -> type[BaseModel]:
+    """所有字段都可以为 None、默认为 None 的同名模型，用来表示部分结果"""
+    fields = {name: (Optional[info.annotation], None) for name, info in schema.model_fields.items()}
+    return create_model(schema.__name__, __doc__=schema.__doc__, **fields)
@@ -0,0 +1,535 @@
+"""
+通义千问模型的离线 token 估算器
+
+在发起请求之前预估输入 token 数，不需要网络和分词器词表，可用于准入控制（请求是否超出上下文或预算）
+和批量任务提交前的成本预测。
+
+估算是一个线性模型：先用正则统计文本特征（汉字、英文字母和单词、数字、标点符号、换行等），
+再加上消息模板、图片和工具定义的开销，乘以各自的权重求和：
+- 文本：千问分词器中常见词语会合并为一个 token，平均约 1.3～1.5 个汉字一个 token；
+  英文约 1 个单词 1～1.3 个 token；数字逐位切分
+- 消息：每条消息外面包着 <|im_start|>role\\n ... <|im_end|>\\n，回复前还有 <|im_start|>assistant\\n
+- 图片：按 28×28 像素一个 token 计算（4～1280 个，另加 2 个边界 token）。base64 图片从文件头读取尺寸，
+  URL 图片无法得知尺寸，按上限估算；音频、视频和文件同样按上限估算
+- 工具：工具定义序列化后按文本计算，另加每个工具的模板开销
+
+默认权重是经验值，误差通常在 10%～20% 以内。用 UsageRecorder 记录真实调用的 usage_metadata 后，
+calibrate() 会用这些记录拟合权重，并报告校准前后的误差。
+
+用法:
+    estimator = TokenEstimator()
+    estimator.estimate("你好！")
+    estimator.estimate([SystemMessage("你是一位编程助手。"), HumanMessage("什么是 Python？")])
+    estimator.estimate_jsonl("prompts.jsonl", processes=4)
+
+命令行:
+    python common/token_estimator.py count prompts.jsonl --price 0.0008
+    python common/token_estimator.py calibrate .cache/usage.jsonl --output .cache/token_weights.json
+"""
+import argparse
+import base64
+import functools
+import json
+import math
+import operator
+import re
+import struct
+import sys
+import threading
+import time
+from collections.abc import Iterable, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage, convert_to_messages
+from langchain_core.messages.utils import convert_to_openai_messages
+from langchain_core.outputs import LLMResult
+
+FEATURES = (
+    "cjk",          # 汉字、假名、谚文
+    "letters",      # 英文字母
+    "words",        # 英文单词
+    "digits",       # 数字（逐位切分）
+    "symbols",      # 标点和符号
+    "other",        # 其他非空白字符
+    "newlines",     # 连续换行
+    "messages",     # 消息模板开销
+    "media_tokens", # 图片等多模态内容
+    "tools",        # 工具定义的模板开销
+    "bias",         # 每个请求固定的开销（回复前缀）
+)
+
+DEFAULT_WEIGHTS = {
+    "cjk": 0.72,
+    "letters": 0.05,
+    "words": 1.0,
+    "digits": 1.0,
+    "symbols": 0.9,
+    "other": 0.8,
+    "newlines": 1.0,
+    "messages": 5.0,
+    "media_tokens": 1.0,
+    "tools": 20.0,
+    "bias": 3.0,
+}
+
+# 千问 VL：28×28 像素一个 token
+IMAGE_PATCH = 28
+MIN_IMAGE_TOKENS = 4
+MAX_IMAGE_TOKENS = 1280
+IMAGE_SPECIAL_TOKENS = 2
+# 无法得知尺寸或时长的多模态内容按上限估算
+UNKNOWN_MEDIA_TOKENS = MAX_IMAGE_TOKENS + IMAGE_SPECIAL_TOKENS
+
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+_WORD = re.compile(r"[A-Za-z]+")
+_DIGIT = re.compile(r"[0-9]")
+_SYMBOL = re.compile(r"[^\w\s]")
+_SPACE = re.compile(r"\s")
+_NEWLINES = re.compile(r"\n+")
+_JSONL_FIELDS = ("messages", "prompt", "input", "text")
+
+_INDEX = {name: i for i, name in enumerate(FEATURES)}
+
+# UsageRecorder 默认的记录文件（项目根目录下的 .cache/，已加入 .gitignore）
+DEFAULT_USAGE_PATH = Path(__file__).resolve().parents[1] / ".cache" / "usage.jsonl"
+
+
+def text_features(text: str) -> tuple[float, ...]:
+    """统计一段文本的特征向量（不含消息、图片等开销）"""
+    row = [0.0] * len(FEATURES)
+    if not text:
+        return tuple(row)
+    cjk = len(_CJK.findall(text))
+    words = _WORD.findall(text)
+    letters = sum(map(len, words))
+    digits = len(_DIGIT.findall(text))
+    # \w 包含汉字、字母、数字，所以这里只统计标点和符号
+    symbols = len(_SYMBOL.findall(text))
+    spaces = len(_SPACE.findall(text))
+    row[0] = cjk
+    row[1] = letters
+    row[2] = len(words)
+    row[3] = digits
+    row[4] = symbols
+    row[5] = max(0, len(text) - cjk - letters - digits - symbols - spaces)
+    row[6] = len(_NEWLINES.findall(text))
+    return tuple(row)
+
+
+# 批量估算时系统提示、工具定义等文本会在每一行重复出现，缓存最近用到的文本特征
+_cached_text_features = functools.lru_cache(maxsize=4096)(text_features)
+
+
+def image_size(data: bytes) -> tuple[int, int] | None:
+    """从 PNG / JPEG / GIF / WebP 文件头读取 (宽, 高)，无法识别时返回 None"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        return struct.unpack("<HH", data[6:10])
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP" and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b"VP8X":
+            width = int.from_bytes(data[24:27], "little") + 1
+            height = int.from_bytes(data[27:30], "little") + 1
+            return width, height
+        if chunk == b"VP8L":
+            bits = int.from_bytes(data[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        return None
+    if data[:2] == b"\xff\xd8":
+        # 逐个跳过 JPEG 段，直到 SOF 段
+        i = 2
+        while i + 9 < len(data):
+            if data[i] != 0xFF:
+                return None
+            marker = data[i + 1]
+            if marker == 0xFF:
+                i += 1
+                continue
+            length = int.from_bytes(data[i + 2:i + 4], "big")
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">HH", data[i + 5:i + 9])
+                return width, height
+            i += 2 + length
+    return None
+
+
+def image_tokens(width: int, height: int) -> int:
+    """千问 VL 的图片 token 数：按 28×28 像素切块，缩放到 4～1280 块之间"""
+    patches = math.ceil(width / IMAGE_PATCH) * math.ceil(height / IMAGE_PATCH)
+    return min(max(patches, MIN_IMAGE_TOKENS), MAX_IMAGE_TOKENS) + IMAGE_SPECIAL_TOKENS
+
+
+def prompt_from_record(record: Any, field: str | None = None) -> tuple[Any, list | None]:
+    """从 JSONL 中的一条记录取出 (模型输入, tools)
+
+    记录不是对象时整条作为输入；指定 field 时取该字段，否则依次查找 messages、prompt、input、text 字段。
+    找不到时抛出 ValueError。
+    """
+    if not isinstance(record, dict):
+        return record, None
+    if field is not None:
+        return record[field], record.get("tools")
+    for name in _JSONL_FIELDS:
+        if name in record:
+            return record[name], record.get("tools")
+    raise ValueError(f"无法识别的记录，需要包含以下字段之一: {', '.join(_JSONL_FIELDS)}")
+
+
+class TokenEstimator:
+    """按文本特征加权求和的 token 估算器"""
+
+    def __init__(self, weights: dict[str, float] | None = None):
+        merged = {**DEFAULT_WEIGHTS, **(weights or {})}
+        unknown = set(merged) - set(FEATURES)
+        if unknown:
+            raise ValueError(f"未知的特征: {sorted(unknown)}")
+        self.weights = merged
+        self._vector = [merged[name] for name in FEATURES]
+
+    @classmethod
+    def load(cls, path: str | Path) -> "TokenEstimator":
+        return cls(json.loads(Path(path).read_text(encoding="utf-8")))
+
+    def save(self, path: str | Path) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(self.weights, indent=2), encoding="utf-8")
+
+    def count_text(self, text: str) -> int:
+        """一段纯文本的 token 数（不含消息模板）"""
+        return round(self._dot(_cached_text_features(text)))
+
+    def count_message(self, message: BaseMessage | dict | str) -> int:
+        """单条消息的 token 数（含消息模板，不含每个请求固定的开销）"""
+        return round(self._dot(self._message_features(message)))
+
+    def features(self, value: Any, tools: Sequence[Any] | None = None) -> list[float]:
+        """一次请求输入的特征向量，value 可以是字符串、消息或消息列表（与 model.invoke 的输入相同）"""
+        if isinstance(value, (str, BaseMessage, dict)):
+            value = [value]
+        row = [0.0] * len(FEATURES)
+        for message in value:
+            _add(row, self._message_features(message))
+        if tools:
+            _add(row, _cached_text_features(json.dumps(list(tools), ensure_ascii=False, default=str)))
+            row[_INDEX["tools"]] += len(tools)
+        row[_INDEX["bias"]] = 1
+        return row
+
+    def estimate(self, value: Any, tools: Sequence[Any] | None = None) -> int:
+        """预估一次请求的输入 token 数"""
+        return round(self._dot(self.features(value, tools)))
+
+    def estimate_batch(self, values: Iterable[Any], tools: Sequence[Any] | None = None) -> list[int]:
+        """批量估算：先提取全部特征，再统一与权重向量相乘"""
+        rows = [self.features(value, tools) for value in values]
+        return [round(self._dot(row)) for row in rows]
+
+    def estimate_jsonl(
+        self,
+        path: str | Path,
+        *,
+        field: str | None = None,
+        processes: int | None = None,
+        chunk_size: int = 2000,
+    ) -> list[int]:
+        """估算 JSONL 文件中每一行提示的 token 数
+
+        Args:
+            path: 每行一个 JSON：字符串、消息列表，或包含 messages / prompt / input / text 字段的对象
+            field: 指定读取的字段，默认按上面的顺序自动识别；对象中的 tools 字段会一并计入
+            processes: 大于 1 时按块分发到多个进程
+            chunk_size: 每个进程任务处理的行数
+        """
+        with open(path, encoding="utf-8") as f:
+            lines = [line for line in f if line.strip()]
+        if not processes or processes <= 1 or len(lines) <= chunk_size:
+            return self._estimate_lines(lines, field)
+        chunks = [lines[i:i + chunk_size] for i in range(0, len(lines), chunk_size)]
+        with ProcessPoolExecutor(processes) as pool:
+            results = pool.map(self._estimate_lines, chunks, [field] * len(chunks))
+            return [count for chunk in results for count in chunk]
+
+    def _estimate_lines(self, lines: list[str], field: str | None) -> list[int]:
+        counts = []
+        for line in lines:
+            value, tools = prompt_from_record(json.loads(line), field)
+            counts.append(self.estimate(value, tools))
+        return counts
+
+    def _message_features(self, message: BaseMessage | dict | Any) -> list[float]:
+        # OpenAI 格式的字典直接读取字段，批量估算时不必先构造消息对象
+        if isinstance(message, BaseMessage):
+            content, name = message.content, message.name
+            calls = [
+                (call["name"], json.dumps(call["args"], ensure_ascii=False))
+                for call in getattr(message, "tool_calls", ())
+            ]
+        elif isinstance(message, dict) and "role" in message:
+            content, name = message.get("content") or "", message.get("name")
+            calls = []
+            for call in message.get("tool_calls") or ():
+                function = call.get("function")
+                if function is not None:
+                    calls.append((function.get("name", ""), function.get("arguments") or ""))
+                else:
+                    calls.append((call.get("name", ""), json.dumps(call.get("args", {}), ensure_ascii=False)))
+        else:
+            [converted] = convert_to_messages([message])
+            return self._message_features(converted)
+
+        row = [0.0] * len(FEATURES)
+        row[_INDEX["messages"]] = 1
+        if isinstance(content, str):
+            _add(row, _cached_text_features(content))
+        else:
+            for block in content:
+                if isinstance(block, str):
+                    _add(row, _cached_text_features(block))
+                elif block.get("type") == "text":
+                    _add(row, _cached_text_features(block.get("text", "")))
+                else:
+                    row[_INDEX["media_tokens"]] += _block_tokens(block)
+        if name:
+            _add(row, _cached_text_features(name))
+        for call_name, arguments in calls:
+            _add(row, _cached_text_features(f'{{"name": "{call_name}", "arguments": {arguments}}}'))
+        return row
+
+    def _dot(self, row: list[float]) -> float:
+        return sum(map(operator.mul, row, self._vector))
+
+
+def _add(row: list[float], other: Sequence[float]) -> None:
+    for i, value in enumerate(other):
+        if value:
+            row[i] += value
+
+
+def _block_tokens(block: dict) -> int:
+    """多模态内容块的 token 数：能读到尺寸的图片按尺寸计算，其余按上限"""
+    kind = block.get("type")
+    if kind not in ("image", "image_url"):
+        return UNKNOWN_MEDIA_TOKENS
+    data = block.get("base64") or block.get("data")
+    url = block.get("url")
+    if kind == "image_url":
+        image_url = block.get("image_url")
+        url = image_url.get("url") if isinstance(image_url, dict) else image_url
+    if not data and isinstance(url, str) and url.startswith("data:"):
+        data = url.partition(",")[2]
+    if not data:
+        return UNKNOWN_MEDIA_TOKENS
+    # 只解码开头一部分就足够读取文件头（JPEG 的 SOF 段可能在 EXIF 之后）
+    head = data[:87384] if isinstance(data, str) else data
+    try:
+        raw = base64.b64decode(head[: len(head) // 4 * 4]) if isinstance(head, str) else head
+    except ValueError:
+        return UNKNOWN_MEDIA_TOKENS
+    size = image_size(raw)
+    return image_tokens(*size) if size else UNKNOWN_MEDIA_TOKENS
+
+
+class UsageRecorder(BaseCallbackHandler):
+    """把每次调用的输入消息和真实的 input_tokens 追加到 JSONL 文件，供 calibrate() 使用
+
+    用法:
+        recorder = UsageRecorder()  # 默认写入 .cache/usage.jsonl
+        model.invoke("你好", config={"callbacks": [recorder]})
+    """
+
+    def __init__(self, path: str | Path = DEFAULT_USAGE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._pending: dict[UUID, tuple[list[dict], list | None]] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: list[list[BaseMessage]],
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        tools = (kwargs.get("invocation_params") or {}).get("tools")
+        self._pending[run_id] = (convert_to_openai_messages(messages[0]), tools)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        pending = self._pending.pop(run_id, None)
+        if pending is None:
+            return
+        try:
+            usage = response.generations[0][0].message.usage_metadata
+        except (IndexError, AttributeError):
+            usage = None
+        if not usage:
+            return
+        messages, tools = pending
+        record = {"messages": messages, "input_tokens": usage["input_tokens"]}
+        if tools:
+            record["tools"] = tools
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._pending.pop(run_id, None)
+
+
+@dataclass
+class ErrorStats:
+    """估算值相对真实值的误差"""
+    count: int
+    mean_abs_pct: float
+    p95_abs_pct: float
+    bias_pct: float  # 正数表示整体高估
+
+    def __str__(self) -> str:
+        return (
+            f"{self.count} 条记录，平均绝对误差 {self.mean_abs_pct:.1%}，"
+            f"p95 {self.p95_abs_pct:.1%}，整体偏差 {self.bias_pct:+.1%}"
+        )
+
+
+@dataclass
+class CalibrationReport:
+    before: ErrorStats
+    after: ErrorStats
+    estimator: TokenEstimator
+
+
+def error_stats(estimates: Sequence[float], actuals: Sequence[float]) -> ErrorStats:
+    errors = sorted(abs(e - a) / a for e, a in zip(estimates, actuals) if a)
+    if not errors:
+        return ErrorStats(0, 0.0, 0.0, 0.0)
+    p95 = errors[min(len(errors) - 1, math.ceil(0.95 * len(errors)) - 1)]
+    bias = (sum(estimates) - sum(actuals)) / sum(actuals)
+    return ErrorStats(len(errors), sum(errors) / len(errors), p95, bias)
+
+
+def load_usage_records(path: str | Path) -> list[dict]:
+    """读取 UsageRecorder 写入的记录；也接受带 usage_metadata 字段的记录"""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "input_tokens" not in record:
+                record["input_tokens"] = record["usage_metadata"]["input_tokens"]
+            records.append(record)
+    return records
+
+
+def calibrate(
+    records: Sequence[dict],
+    estimator: TokenEstimator | None = None,
+    *,
+    regularization: float = 1e-3,
+) -> CalibrationReport:
+    """用真实的 input_tokens 拟合权重
+
+    最小化 Σ(估算 - 真实)² + λ·Σ(w - 原权重)²：记录中没有出现的特征保持原来的权重不变。
+
+    Args:
+        records: 每条包含 messages（或 prompt 等）、可选的 tools 和 input_tokens
+        estimator: 作为起点的估算器，默认使用默认权重
+        regularization: λ 相对于各特征尺度 (XᵀX 对角线) 的比例
+    """
+    estimator = estimator or TokenEstimator()
+    rows, actuals = [], []
+    for record in records:
+        value, tools = prompt_from_record(record)
+        rows.append(estimator.features(value, tools))
+        actuals.append(float(record["input_tokens"]))
+    before = error_stats([estimator._dot(row) for row in rows], actuals)
+
+    size = len(FEATURES)
+    prior = estimator._vector
+    # 正规方程 (XᵀX + λI) w = Xᵀy + λ·w0
+    xtx = [[sum(row[i] * row[j] for row in rows) for j in range(size)] for i in range(size)]
+    xty = [sum(row[i] * y for row, y in zip(rows, actuals)) for i in range(size)]
+    for i in range(size):
+        # 按各特征自身的尺度收缩；记录中没有出现的特征只剩 1e-9 这一项，解就是原权重
+        lam = regularization * xtx[i][i] + 1e-9
+        xtx[i][i] += lam
+        xty[i] += lam * prior[i]
+    solution = _solve(xtx, xty)
+
+    fitted = TokenEstimator({name: max(0.0, value) for name, value in zip(FEATURES, solution)})
+    after = error_stats([fitted._dot(row) for row in rows], actuals)
+    return CalibrationReport(before, after, fitted)
+
+
+def _solve(a: list[list[float]], b: list[float]) -> list[float]:
+    """高斯消元（列主元），矩阵很小，不需要 numpy"""
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        m[col], m[pivot] = m[pivot], m[col]
+        if m[col][col] == 0:
+            continue
+        for r in range(n):
+            if r != col and m[r][col]:
+                factor = m[r][col] / m[col][col]
+                m[r] = [x - factor * y for x, y in zip(m[r], m[col])]
+    return [m[i][n] / m[i][i] if m[i][i] else 0.0 for i in range(n)]
+
+
+def _count_command(args: argparse.Namespace) -> None:
+    estimator = TokenEstimator.load(args.weights) if args.weights else TokenEstimator()
+    start = time.perf_counter()
+    counts = estimator.estimate_jsonl(args.path, field=args.field, processes=args.processes)
+    elapsed = time.perf_counter() - start
+    if not counts:
+        print("文件中没有记录")
+        return
+    ordered = sorted(counts)
+    total = sum(counts)
+    print(f"记录数: {len(counts)}，耗时 {elapsed:.2f}s（{len(counts) / elapsed:,.0f} 条/秒）")
+    print(f"输入 tokens: 总计 {total:,}，平均 {total / len(counts):,.1f}，"
+          f"p95 {ordered[math.ceil(0.95 * len(ordered)) - 1]:,}，最大 {ordered[-1]:,}")
+    if args.price is not None:
+        print(f"预计输入费用: {total / 1000 * args.price:,.4f}（单价 {args.price}/千 tokens）")
+
+
+def _calibrate_command(args: argparse.Namespace) -> None:
+    estimator = TokenEstimator.load(args.weights) if args.weights else TokenEstimator()
+    report = calibrate(load_usage_records(args.path), estimator)
+    print(f"校准前: {report.before}")
+    print(f"校准后: {report.after}")
+    for name in FEATURES:
+        print(f"  {name:<14}{estimator.weights[name]:>8.3f} -> {report.estimator.weights[name]:.3f}")
+    if args.output:
+        report.estimator.save(args.output)
+        print(f"权重已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="通义千问离线 token 估算")
+    parser.add_argument("--weights", help="calibrate 输出的权重文件")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    count_parser = commands.add_parser("count", help="估算 JSONL 提示文件的 token 数")
+    count_parser.add_argument("path")
+    count_parser.add_argument("--field", help="读取的字段，默认自动识别 messages / prompt / input / text")
+    count_parser.add_argument("--processes", type=int, default=None, help="并行进程数")
+    count_parser.add_argument("--price", type=float, default=None, help="每千输入 tokens 的单价，用于预估费用")
+    count_parser.set_defaults(handler=_count_command)
+
+    calibrate_parser = commands.add_parser("calibrate", help="用 UsageRecorder 的记录校准权重")
+    calibrate_parser.add_argument("path")
+    calibrate_parser.add_argument("--output", help="保存校准后的权重")
+    calibrate_parser.set_defaults(handler=_calibrate_command)
+
+    args = parser.parse_args()
+    sys.exit(args.handler(args))
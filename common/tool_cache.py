@@ -0,0 +1,252 @@
+"""
+工具结果缓存
+
+get_weather 这类工具经常被以相同的参数反复调用：同一段对话中多次查询，不同用户查询同一个城市。
+ToolCache 把工具包装成 CachedTool，按 (工具名, 规范化后的参数) 缓存结果：
+- 参数先用工具的 args_schema 校验（类型转换、补全默认值），再序列化为键有序的 JSON，
+  {"location": "北京"} 与 {"location": "北京", "unit": "celsius"}（unit 默认为 celsius）命中同一条
+- 每个工具可以单独设置 TTL；所有工具共享一个有容量上限的 LRU
+- 相同参数的并发调用只执行一次，其余调用等待这次执行的结果（同步和异步调用都一样）；
+  执行出错或返回 status="error" 的结果不会被缓存，等待中的调用得到同样的错误
+- 缓存的是 (content, artifact)，通过 ToolCall 调用时返回的 ToolMessage 保留 artifact
+- stats 统计命中率以及命中缓存省下的工具耗时
+
+包装后的工具与原工具同名、同参数 schema，可以直接传给 bind_tools 和 ToolExecutor。
+缓存 key 不区分用户，结果依赖调用者身份的工具不要缓存，或者把身份作为参数的一部分。
+
+用法:
+    cache = ToolCache(maxsize=1024)
+    get_weather = cache.wrap(get_weather, ttl=600)
+    model_with_tools = model.bind_tools([get_weather])
+    ...
+    print(cache.stats)
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from concurrent.futures import Future
+from dataclasses import dataclass, fields
+from typing import Any
+
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
+from langchain_core.messages import ToolMessage
+from langchain_core.tools import BaseTool, ToolException, tool as as_tool
+from pydantic import BaseModel
+
+# (content, artifact)
+ToolResult = tuple[Any, Any]
+
+
+@dataclass
+class ToolCacheStats:
+    """工具缓存统计，shared 是等待同一次正在执行的调用而没有重复执行的次数"""
+    hits: int = 0
+    misses: int = 0
+    shared: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    # 命中时按这条结果原本的执行耗时累计
+    saved_seconds: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        """没有真正执行工具的调用占比（包括 shared）"""
+        total = self.hits + self.shared + self.misses
+        return (self.hits + self.shared) / total if total else 0.0
+
+    def merge(self, other: "ToolCacheStats") -> None:
+        for field in fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+
+class _Entry:
+    __slots__ = ("expires_at", "value", "elapsed")
+
+    def __init__(self, expires_at: float | None, value: ToolResult, elapsed: float):
+        self.expires_at = expires_at
+        self.value = value
+        self.elapsed = elapsed
+
+
+class ToolCache:
+    """多个工具共享的 LRU 结果缓存，带 TTL 和并发去重"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None):
+        """
+        Args:
+            maxsize: 最多保留的结果数（所有工具合计）
+            ttl: 默认过期时间（秒），None 表示永不过期；wrap 时可以按工具覆盖
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.tool_stats: dict[str, ToolCacheStats] = {}
+        self._entries: OrderedDict[tuple[str, str], _Entry] = OrderedDict()
+        self._inflight: dict[tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> ToolCacheStats:
+        """所有工具合计的统计"""
+        total = ToolCacheStats()
+        with self._lock:
+            for stats in self.tool_stats.values():
+                total.merge(stats)
+        return total
+
+    def wrap(self, tool: BaseTool | Callable, *, ttl: float | None = None) -> "CachedTool":
+        """包装一个工具，普通函数会先用 @tool 包装；ttl 为 None 时使用缓存的默认值"""
+        if not isinstance(tool, BaseTool):
+            tool = as_tool(tool)
+        return CachedTool(
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            # 原工具处理过的错误在这里以 ToolException 重新抛出，需要同样转换为 status="error"
+            handle_tool_error=bool(tool.handle_tool_error),
+            handle_validation_error=tool.handle_validation_error,
+            tool=tool,
+            cache=self,
+            ttl=self.ttl if ttl is None else ttl,
+        )
+
+    def cached(self, *, ttl: float | None = None) -> Callable[[BaseTool | Callable], "CachedTool"]:
+        """wrap 的装饰器形式: @cache.cached(ttl=600)"""
+        return lambda tool: self.wrap(tool, ttl=ttl)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_call(
+        self,
+        key: tuple[str, str],
+        ttl: float | None,
+        call: Callable[[], ToolResult],
+    ) -> ToolResult:
+        """返回缓存的结果；没有时执行 call，相同 key 的并发调用等待同一次执行，call 抛出的异常不缓存"""
+        value, future, leader = self._begin(key)
+        if value is not None:
+            return value
+        if not leader:
+            return future.result()
+        start = time.perf_counter()
+        try:
+            result = call()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        return self._store(key, ttl, future, result, time.perf_counter() - start)
+
+    async def aget_or_call(
+        self,
+        key: tuple[str, str],
+        ttl: float | None,
+        call: Callable[[], Awaitable[ToolResult]],
+    ) -> ToolResult:
+        """get_or_call 的异步版本，与同步调用共享去重"""
+        value, future, leader = self._begin(key)
+        if value is not None:
+            return value
+        if not leader:
+            return await asyncio.wrap_future(future)
+        start = time.perf_counter()
+        try:
+            result = await call()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        return self._store(key, ttl, future, result, time.perf_counter() - start)
+
+    def _begin(self, key: tuple[str, str]) -> tuple[ToolResult | None, Future | None, bool]:
+        """返回 (缓存值, 正在执行的 Future, 是否由当前调用执行)"""
+        with self._lock:
+            stats = self.tool_stats.get(key[0])
+            if stats is None:
+                stats = self.tool_stats[key[0]] = ToolCacheStats()
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at is None or entry.expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    stats.hits += 1
+                    stats.saved_seconds += entry.elapsed
+                    return entry.value, None, False
+                del self._entries[key]
+                stats.expirations += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                stats.shared += 1
+                return None, future, False
+            stats.misses += 1
+            future = self._inflight[key] = Future()
+            return None, future, True
+
+    def _store(
+        self,
+        key: tuple[str, str],
+        ttl: float | None,
+        future: Future,
+        value: ToolResult,
+        elapsed: float,
+    ) -> ToolResult:
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = _Entry(expires_at, value, elapsed)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                evicted, _ = self._entries.popitem(last=False)
+                self.tool_stats[evicted[0]].evictions += 1
+            del self._inflight[key]
+        future.set_result(value)
+        return value
+
+    def _fail(self, key: tuple[str, str], future: Future, error: BaseException) -> None:
+        with self._lock:
+            del self._inflight[key]
+        future.set_exception(error)
+
+
+class CachedTool(BaseTool):
+    """带结果缓存的工具，由 ToolCache.wrap 创建"""
+
+    tool: BaseTool
+    cache: ToolCache
+    ttl: float | None = None
+    # 始终返回 (content, artifact)，通过 ToolCall 调用时 artifact 放进 ToolMessage
+    response_format: str = "content_and_artifact"
+
+    def cache_key(self, args: dict[str, Any]) -> tuple[str, str]:
+        """(工具名, 规范化后的参数 JSON)"""
+        schema = self.args_schema
+        if isinstance(schema, type) and issubclass(schema, BaseModel):
+            args = schema.model_validate(args).model_dump(mode="json")
+        return self.name, json.dumps(args, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+
+    def _run(self, run_manager: CallbackManagerForToolRun | None = None, **kwargs: Any) -> ToolResult:
+        callbacks = run_manager.get_child() if run_manager is not None else None
+
+        def call() -> ToolResult:
+            return _unpack(self.tool.invoke(self._tool_call(kwargs), {"callbacks": callbacks}))
+
+        return self.cache.get_or_call(self.cache_key(kwargs), self.ttl, call)
+
+    async def _arun(self, run_manager: AsyncCallbackManagerForToolRun | None = None, **kwargs: Any) -> ToolResult:
+        callbacks = run_manager.get_child() if run_manager is not None else None
+
+        async def call() -> ToolResult:
+            return _unpack(await self.tool.ainvoke(self._tool_call(kwargs), {"callbacks": callbacks}))
+
+        return await self.cache.aget_or_call(self.cache_key(kwargs), self.ttl, call)
+
+    def _tool_call(self, args: dict[str, Any]) -> dict[str, Any]:
+        # 以 ToolCall 调用原工具，才能拿到 artifact 和 status
+        return {"name": self.tool.name, "args": args, "id": "cached", "type": "tool_call"}
+
+
+def _unpack(message: ToolMessage) -> ToolResult:
+    """ToolMessage -> (content, artifact)；原工具返回的错误以异常的形式抛出，不进入缓存"""
+    if message.status == "error":
+        raise ToolException(message.content)
+    return message.content, message.artifact
@@ -0,0 +1,178 @@
+"""
+并发执行一条 AIMessage 中的所有工具调用
+
+模型一次返回多个工具调用（例如同时查询北京、上海、广州、巴黎的天气）时，逐个执行的总耗时是
+各个工具耗时之和。ToolExecutor 同时执行同一条消息中的所有调用：
+- 异步工具（定义了 coroutine 的工具）直接在事件循环中执行
+- 同步工具（例如 get_weather）提交到线程池
+- 每个工具可以单独设置超时；超时或出错的调用返回 status="error" 的 ToolMessage，
+  把错误交给模型处理，而不是中断整个流程
+- 返回的 ToolMessage 与 tool_calls 的顺序一致，tool_call_id 一一对应；
+  工具返回 (content, artifact) 时 artifact 会保留
+
+invoke_with_tools 把这些组合成完整的工具调用循环：调用模型 -> 并发执行工具 -> 把结果一次性发回模型。
+
+用法:
+    executor = ToolExecutor([get_weather], timeout=5)
+    messages = invoke_with_tools(model.bind_tools([get_weather]), "北京和上海的天气怎么样？", executor)
+    print(messages[-1].content)
+"""
+import asyncio
+import functools
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.language_models import LanguageModelInput
+from langchain_core.messages import AIMessage, BaseMessage, ToolCall, ToolMessage, convert_to_messages
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.tools import BaseTool, StructuredTool, tool as as_tool
+
+from common.tool_cache import CachedTool
+
+
+def _is_async(tool: BaseTool) -> bool:
+    """工具是否有原生的异步实现（否则 ainvoke 也只是放到默认线程池中执行 _run）"""
+    if isinstance(tool, StructuredTool):
+        return tool.coroutine is not None
+    if isinstance(tool, CachedTool):
+        return _is_async(tool.tool)
+    return type(tool)._arun is not BaseTool._arun
+
+
+class ToolExecutor:
+    """并发执行工具调用，按原始顺序返回 ToolMessage"""
+
+    def __init__(
+        self,
+        tools: Sequence[BaseTool | Callable],
+        *,
+        timeout: float | None = None,
+        timeouts: dict[str, float] | None = None,
+        max_workers: int | None = None,
+    ):
+        """
+        Args:
+            tools: 工具列表，普通函数会用 @tool 包装
+            timeout: 默认的单个工具超时（秒），None 表示不限制
+            timeouts: 按工具名单独设置的超时
+            max_workers: 执行同步工具的线程数，默认与 ThreadPoolExecutor 一致
+        """
+        self.tools: dict[str, BaseTool] = {}
+        for item in tools:
+            tool = item if isinstance(item, BaseTool) else as_tool(item)
+            self.tools[tool.name] = tool
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self._max_workers = max_workers
+        self._pool: ThreadPoolExecutor | None = None
+
+    def __enter__(self) -> "ToolExecutor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    async def arun(self, message: AIMessage, config: RunnableConfig | None = None) -> list[ToolMessage]:
+        """并发执行 message 中的所有工具调用"""
+        return list(await asyncio.gather(*(self.arun_call(call, config) for call in message.tool_calls)))
+
+    def run(self, message: AIMessage, config: RunnableConfig | None = None) -> list[ToolMessage]:
+        """arun 的同步版本，不能在运行中的事件循环里调用"""
+        return asyncio.run(self.arun(message, config))
+
+    async def arun_call(self, call: ToolCall, config: RunnableConfig | None = None) -> ToolMessage:
+        """执行单个工具调用，超时和异常都转换为 status="error" 的 ToolMessage"""
+        name = call["name"]
+        tool = self.tools.get(name)
+        if tool is None:
+            return _error_message(call, f"未知的工具: {name}")
+        timeout = self.timeouts.get(name, self.timeout)
+        call = {**call, "type": "tool_call"}
+        try:
+            if _is_async(tool):
+                pending = tool.ainvoke(call, config)
+            else:
+                # 线程中的工具超时后无法被强制终止，只是不再等待它的结果
+                pending = asyncio.get_running_loop().run_in_executor(
+                    self._executor(), functools.partial(tool.invoke, call, config)
+                )
+            result = await asyncio.wait_for(pending, timeout)
+        except TimeoutError:
+            return _error_message(call, f"工具 {name} 执行超时（{timeout}s）")
+        except Exception as e:
+            return _error_message(call, f"工具 {name} 执行出错: {e!r}")
+        # 传入的是 ToolCall 时，工具返回带 tool_call_id 的 ToolMessage
+        if isinstance(result, ToolMessage):
+            return result
+        return ToolMessage(content=str(result), name=name, tool_call_id=call["id"])
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self._max_workers, thread_name_prefix="tool")
+        return self._pool
+
+
+def input_to_messages(messages: LanguageModelInput) -> list[BaseMessage]:
+    """把模型输入（字符串、消息列表或 PromptValue）转换为可追加的消息列表"""
+    if isinstance(messages, PromptValue):
+        return messages.to_messages()
+    return convert_to_messages([messages] if isinstance(messages, str) else messages)
+
+
+def _error_message(call: ToolCall, content: str) -> ToolMessage:
+    return ToolMessage(content=content, name=call["name"], tool_call_id=call["id"], status="error")
+
+
+async def ainvoke_with_tools(
+    model: Runnable,
+    messages: LanguageModelInput,
+    executor: ToolExecutor,
+    *,
+    max_rounds: int = 5,
+    config: RunnableConfig | None = None,
+) -> list[BaseMessage]:
+    """工具调用循环：模型返回工具调用时并发执行，把所有结果放在一次后续调用中发回
+
+    Args:
+        model: 绑定了工具的模型
+        messages: 初始输入
+        executor: 执行工具的 ToolExecutor
+        max_rounds: 最多执行几轮工具调用，防止模型无限调用工具
+        config: 传给模型和工具的配置
+
+    Returns:
+        完整的消息列表，最后一条是模型的最终回答
+    """
+    history = input_to_messages(messages)
+    for round_ in range(max_rounds + 1):
+        response = await model.ainvoke(history, config)
+        history.append(response)
+        if not response.tool_calls or round_ == max_rounds:
+            break
+        history.extend(await executor.arun(response, config))
+    return history
+
+
+def invoke_with_tools(
+    model: Runnable,
+    messages: LanguageModelInput,
+    executor: ToolExecutor,
+    *,
+    max_rounds: int = 5,
+    config: RunnableConfig | None = None,
+) -> list[BaseMessage]:
+    """ainvoke_with_tools 的同步版本，参数相同"""
+    history = input_to_messages(messages)
+    for round_ in range(max_rounds + 1):
+        response = model.invoke(history, config)
+        history.append(response)
+        if not response.tool_calls or round_ == max_rounds:
+            break
+        history.extend(executor.run(response, config))
+    return history
@@ -0,0 +1,140 @@
+"""
+预编译的工具 schema
+
+model.bind_tools([get_weather]) 每次都要从函数签名和 docstring 重新生成 JSON schema
+（普通函数要先动态创建 pydantic 模型，每个工具约几毫秒），服务中每个请求都新建绑定模型时，
+这部分开销随工具数量线性增长。发送请求时 openai SDK 还要按类型定义把整个 tools 列表再遍历、序列化一遍。
+
+ToolRegistry 对每个工具只做一次：
+- 生成 OpenAI 格式的 schema（ToolSchema，一个带 encoded 属性的 dict）和它的 JSON 字节
+- bind_tools 把这些共享的 schema 对象直接传给 model.bind_tools，不再重新转换，
+  所有绑定模型共用同一份 schema
+- 通过 Conversation 发送时（registry.invoke 或 Conversation.invoke），请求体中的 tools
+  直接拼接预先序列化好的字节，跳过 SDK 的类型转换和重新序列化
+
+绑定模型仍然是普通的 RunnableBinding，invoke / stream / 回调 / ToolExecutor 照常使用。
+ToolSchema 在多个请求之间共享，不要修改。
+
+用法:
+    registry = ToolRegistry([get_weather, search_books])
+    model_with_tools = registry.bind_tools(model)                   # 全部工具
+    model_with_tools = registry.bind_tools(model, ["get_weather"])  # 按名称选取
+    response = registry.invoke(model_with_tools, "北京的天气怎么样？")
+    executor = ToolExecutor(registry.tools())
+"""
+import json
+from collections.abc import Callable, Iterable, Sequence
+from typing import Any
+
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable
+from langchain_core.tools import BaseTool, tool as as_tool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from common.conversation import Conversation
+from common.tool_executor import input_to_messages
+
+
+class ToolSchema(dict):
+    """OpenAI 格式的工具 schema，encoded 是它的 JSON 字节"""
+    __slots__ = ("encoded",)
+
+    def __init__(self, schema: dict):
+        super().__init__(schema)
+        # 与 Conversation 序列化消息的方式一致
+        self.encoded = json.dumps(schema, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class CompiledTool:
+    """一个工具编译后的结果：用于执行的 BaseTool 和发送给模型的 schema"""
+    __slots__ = ("name", "source", "tool", "schema")
+
+    def __init__(self, source: BaseTool | Callable, *, strict: bool | None = None):
+        self.source = source
+        self.tool = source if isinstance(source, BaseTool) else as_tool(source)
+        # 从原始对象生成 schema，与 model.bind_tools([source]) 发送的内容一致
+        self.schema = ToolSchema(convert_to_openai_tool(source, strict=strict))
+        self.name: str = self.schema["function"]["name"]
+
+
+class ToolRegistry:
+    """工具名 -> 编译好的工具，schema 只生成一次并在所有绑定模型之间共享"""
+
+    def __init__(self, tools: Iterable[BaseTool | Callable] = (), *, strict: bool | None = None):
+        """
+        Args:
+            tools: 要注册的工具，普通函数会用 @tool 包装后用于执行
+            strict: 生成 schema 时使用的 strict 设置
+        """
+        self.strict = strict
+        self._tools: dict[str, CompiledTool] = {}
+        # id(原始对象或包装后的 BaseTool) -> 编译结果，注册表持有这些对象的引用，id 不会被复用
+        self._by_id: dict[int, CompiledTool] = {}
+        for item in tools:
+            self.register(item)
+
+    def __len__(self) -> int:
+        return len(self._tools)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def register(self, tool: BaseTool | Callable) -> CompiledTool:
+        """编译并注册一个工具；同名工具会被替换"""
+        compiled = CompiledTool(tool, strict=self.strict)
+        self._tools[compiled.name] = compiled
+        self._by_id[id(compiled.source)] = self._by_id[id(compiled.tool)] = compiled
+        return compiled
+
+    def compiled(self, tool: str | BaseTool | Callable) -> CompiledTool:
+        """按名称或工具对象取得编译结果，未注册的工具对象会先注册"""
+        if isinstance(tool, str):
+            try:
+                return self._tools[tool]
+            except KeyError:
+                raise KeyError(f"未注册的工具: {tool}") from None
+        compiled = self._by_id.get(id(tool))
+        if compiled is None or self._tools.get(compiled.name) is not compiled:
+            compiled = self.register(tool)
+        return compiled
+
+    def schemas(self, tools: Sequence[str | BaseTool | Callable] | None = None) -> list[ToolSchema]:
+        """选取的工具的 schema，None 表示全部"""
+        if tools is None:
+            return [compiled.schema for compiled in self._tools.values()]
+        return [self.compiled(item).schema for item in tools]
+
+    def tools(self, tools: Sequence[str | BaseTool | Callable] | None = None) -> list[BaseTool]:
+        """选取的工具的 BaseTool，用于 ToolExecutor"""
+        if tools is None:
+            return [compiled.tool for compiled in self._tools.values()]
+        return [self.compiled(item).tool for item in tools]
+
+    def bind_tools(
+        self,
+        model: BaseChatModel,
+        tools: Sequence[str | BaseTool | Callable] | None = None,
+        **kwargs: Any,
+    ) -> Runnable[LanguageModelInput, AIMessage]:
+        """与 model.bind_tools 相同，但使用预编译的 schema
+
+        Args:
+            model: 聊天模型
+            tools: 工具名称或工具对象，None 表示全部已注册的工具
+            **kwargs: 传给 model.bind_tools 的其他参数，如 tool_choice、parallel_tool_calls；
+                strict 在注册时指定，这里传入无效
+        """
+        # 已经是 OpenAI 格式的 dict 会原样放进绑定参数，不会再次转换
+        return model.bind_tools(self.schemas(tools), **kwargs)
+
+    def invoke(self, model: Runnable, messages: LanguageModelInput, **kwargs: Any) -> AIMessage:
+        """通过 Conversation 发送，请求体中的 tools 直接拼接预先序列化的字节
+
+        不触发 LangChain 回调和 LLM 缓存，限制与 Conversation.invoke 相同。
+        """
+        return Conversation(input_to_messages(messages)).invoke(model, **kwargs)
+
+    async def ainvoke(self, model: Runnable, messages: LanguageModelInput, **kwargs: Any) -> AIMessage:
+        """invoke 的异步版本"""
+        return await Conversation(input_to_messages(messages)).ainvoke(model, **kwargs)
@@ -0,0 +1,319 @@
+"""
+低开销的调用指标聚合
+
+UsageMetadataCallbackHandler 只按模型累计 token 总数，没有延迟数据，也只在一个上下文中有效。
+UsageMetrics 按 (模型, 路由) 分别统计：
+- 计数器：请求数、失败数、输入/输出 token、流式块数
+- 直方图：延迟、首 token 延迟 (TTFT)、每次请求的输入/输出 token 和块数
+
+热路径上不加锁：每个线程写自己的分片（同一线程中的异步任务共享一个分片，事件循环是单线程的），
+只有第一次在某个线程中记录时才需要加锁登记分片；导出时再把所有分片合并。
+已经结束的线程的分片在登记新分片或导出时并入一个基础分片，线程池反复创建新线程时分片数不会一直增长。
+导出格式为 Prometheus 文本格式 (to_prometheus) 或 JSON (snapshot / to_json)。
+
+用法:
+    metrics = UsageMetrics()
+    callback = metrics.callback(route="chat")
+    model.invoke("你好", config={"callbacks": [callback]})
+    # 同一个回调也可以按调用区分路由
+    model.invoke("你好", config={"callbacks": [callback], "metadata": {"route": "summary"}})
+    print(metrics.to_prometheus())
+"""
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Sequence
+from typing import Any
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DEFAULT_TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536)
+DEFAULT_CHUNK_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000)
+
+# 计数器名称 -> 说明
+_COUNTERS = {
+    "requests": "调用次数",
+    "errors": "失败次数",
+    "input_tokens": "输入 token 总数",
+    "output_tokens": "输出 token 总数",
+    "chunks": "流式输出的块数",
+}
+# 直方图名称 -> (说明, Prometheus 中的指标名后缀)
+_HISTOGRAMS = {
+    "latency": ("调用耗时（秒）", "latency_seconds"),
+    "ttft": ("首个块的延迟（秒）", "ttft_seconds"),
+    "input_tokens_per_request": ("每次调用的输入 token", "input_tokens_per_request"),
+    "output_tokens_per_request": ("每次调用的输出 token", "output_tokens_per_request"),
+    "chunks_per_request": ("每次流式调用的块数", "chunks_per_request"),
+}
+
+
+class Histogram:
+    """固定分桶的直方图，counts 的最后一格是 +Inf"""
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram") -> None:
+        for i, value in enumerate(other.counts):
+            self.counts[i] += value
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> float | None:
+        """在所在的桶内线性插值估算分位数"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, value in enumerate(self.counts):
+            if value and seen + value >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                if i == len(self.bounds):
+                    return lower
+                return lower + (self.bounds[i] - lower) * (rank - seen) / value
+            seen += value
+        return self.bounds[-1]
+
+
+class _Series:
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self, buckets: dict[str, Sequence[float]]):
+        self.counters = dict.fromkeys(_COUNTERS, 0)
+        self.histograms = {name: Histogram(bounds) for name, bounds in buckets.items()}
+
+
+class UsageMetrics:
+    """按 (模型, 路由) 聚合的计数器和直方图"""
+
+    def __init__(
+        self,
+        latency_buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+        token_buckets: Sequence[float] = DEFAULT_TOKEN_BUCKETS,
+        chunk_buckets: Sequence[float] = DEFAULT_CHUNK_BUCKETS,
+    ):
+        self._buckets = {
+            "latency": latency_buckets,
+            "ttft": latency_buckets,
+            "input_tokens_per_request": token_buckets,
+            "output_tokens_per_request": token_buckets,
+            "chunks_per_request": chunk_buckets,
+        }
+        # 每个线程一个分片: (线程, {(模型, 路由) -> _Series})；已结束线程的分片并入 _base
+        self._shards: list[tuple[threading.Thread, dict[tuple[str, str], _Series]]] = []
+        self._base: dict[tuple[str, str], _Series] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def callback(self, route: str = "default") -> "UsageMetricsCallback":
+        """返回把调用记录到这里的回调处理器"""
+        return UsageMetricsCallback(self, route)
+
+    def record(
+        self,
+        model: str,
+        route: str = "default",
+        *,
+        latency: float,
+        ttft: float | None = None,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        chunks: int = 0,
+        error: bool = False,
+    ) -> None:
+        """记录一次调用"""
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._prune()
+                self._shards.append((threading.current_thread(), shard))
+        series = shard.get((model, route))
+        if series is None:
+            series = shard[(model, route)] = _Series(self._buckets)
+        counters = series.counters
+        histograms = series.histograms
+        counters["requests"] += 1
+        histograms["latency"].observe(latency)
+        if error:
+            counters["errors"] += 1
+            return
+        counters["input_tokens"] += input_tokens
+        counters["output_tokens"] += output_tokens
+        histograms["input_tokens_per_request"].observe(input_tokens)
+        histograms["output_tokens_per_request"].observe(output_tokens)
+        if ttft is not None:
+            histograms["ttft"].observe(ttft)
+        if chunks:
+            counters["chunks"] += chunks
+            histograms["chunks_per_request"].observe(chunks)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._base.clear()
+            for _, shard in self._shards:
+                shard.clear()
+
+    def merged(self) -> dict[tuple[str, str], _Series]:
+        """合并所有线程的分片；与写入并发时读到的是某一时刻附近的近似值"""
+        merged: dict[tuple[str, str], _Series] = {}
+        with self._lock:
+            self._prune()
+            self._fold(merged, self._base)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            self._fold(merged, shard)
+        return merged
+
+    def _prune(self) -> None:
+        """把已结束线程的分片并入 _base（调用者持有锁）；这些线程不会再写入，合并是安全的"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._fold(self._base, shard)
+        self._shards = alive
+
+    def _fold(self, target: dict[tuple[str, str], _Series], shard: dict[tuple[str, str], _Series]) -> None:
+        # list() 在持有 GIL 的情况下一次复制完，不会因为其他线程插入新的 key 而报错
+        for key, series in list(shard.items()):
+            into = target.get(key)
+            if into is None:
+                into = target[key] = _Series(self._buckets)
+            for name, value in series.counters.items():
+                into.counters[name] += value
+            for name, histogram in series.histograms.items():
+                into.histograms[name].merge(histogram)
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        """JSON 友好的快照，直方图附带 p50/p95/p99 估算值"""
+        result = []
+        for (model, route), series in sorted(self.merged().items()):
+            item: dict[str, Any] = {"model": model, "route": route, **series.counters}
+            for name, histogram in series.histograms.items():
+                item[name] = {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                    "buckets": dict(zip([*map(_format_number, histogram.bounds), "+Inf"], histogram.counts)),
+                }
+            result.append(item)
+        return result
+
+    def to_json(self, **kwargs: Any) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False, **kwargs)
+
+    def to_prometheus(self, prefix: str = "llm") -> str:
+        """Prometheus 文本格式"""
+        merged = sorted(self.merged().items())
+        lines = []
+        for name, description in _COUNTERS.items():
+            metric = f"{prefix}_{name}_total"
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} counter")
+            for (model, route), series in merged:
+                lines.append(f"{metric}{{{_labels(model, route)}}} {series.counters[name]}")
+        for name, (description, suffix) in _HISTOGRAMS.items():
+            metric = f"{prefix}_{suffix}"
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} histogram")
+            for (model, route), series in merged:
+                histogram = series.histograms[name]
+                labels = _labels(model, route)
+                cumulative = 0
+                for bound, count in zip([*map(_format_number, histogram.bounds), "+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{metric}_sum{{{labels}}} {_format_number(histogram.sum)}")
+                lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(model: str, route: str) -> str:
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return f'model="{escape(model)}",route="{escape(route)}"'
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class UsageMetricsCallback(BaseCallbackHandler):
+    """把每次聊天模型调用的延迟、TTFT、块数和 token 用量记录到 UsageMetrics
+
+    路由取自调用配置的 metadata["route"]，没有时使用创建回调时指定的 route。
+    """
+
+    # 在异步调用中直接在事件循环里执行，不切换到线程池
+    run_inline = True
+
+    def __init__(self, metrics: UsageMetrics, route: str = "default"):
+        self.metrics = metrics
+        self.route = route
+        # run_id -> [开始时间, 首个块的时间, 块数, 模型, 路由]
+        self._runs: dict[UUID, list] = {}
+
+    def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: list[list[Any]],
+        *,
+        run_id: UUID,
+        metadata: dict[str, Any] | None = None,
+        **kwargs: Any,
+    ) -> None:
+        metadata = metadata or {}
+        params = kwargs.get("invocation_params") or {}
+        model = metadata.get("ls_model_name") or params.get("model") or params.get("model_name") or "unknown"
+        self._runs[run_id] = [time.perf_counter(), None, 0, model, metadata.get("route", self.route)]
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.get(run_id)
+        if run is not None:
+            if run[1] is None:
+                run[1] = time.perf_counter()
+            run[2] += 1
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        start, first, chunks, model, route = run
+        usage = None
+        try:
+            usage = response.generations[0][0].message.usage_metadata
+        except (IndexError, AttributeError):
+            pass
+        self.metrics.record(
+            model,
+            route,
+            latency=time.perf_counter() - start,
+            ttft=first - start if first is not None else None,
+            input_tokens=usage["input_tokens"] if usage else 0,
+            output_tokens=usage["output_tokens"] if usage else 0,
+            chunks=chunks,
+        )
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            self.metrics.record(run[3], run[4], latency=time.perf_counter() - run[0], error=True)
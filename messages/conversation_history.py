@@ -1,26 +1,27 @@
 """
 对话历史管理示例
+
+使用 Conversation 保存对话历史：每条消息只在加入时转换和序列化一次，
+之后每一轮只需处理新增的消息，长对话中客户端开销不会随轮数增长。
+TokenBudgetConversation 还会在超出 token 预算时丢弃最早的几轮，让每轮的输入 token 保持在预算内。
 """
-from langchain.chat_models import init_chat_model
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-import os
-from dotenv import load_dotenv
+import sys
+from pathlib import Path
+
+from langchain_core.messages import SystemMessage, HumanMessage
 
-load_dotenv()
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.history_window import TokenBudgetConversation
+from common.model_factory import get_chat_model
 
-# 初始化模型
-model = init_chat_model(
-    model="qwen-plus",
-    model_provider="openai",
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    api_key=os.getenv("DASHSCOPE_API_KEY"),
-)
+# 获取共享的模型实例（复用连接池）
+model = get_chat_model()
 
 
-# 初始化对话历史
-conversation_history = [
+# 初始化对话历史：SystemMessage 始终保留，发送的消息不超过 4000 个 token
+conversation_history = TokenBudgetConversation([
     SystemMessage("你是一个有帮助的编程助手。")
-]
+], max_tokens=4000)
 
 print("开始对话...\n")
 
@@ -28,25 +29,23 @@ print("开始对话...\n")
 print("用户: 什么是 Python？")
 conversation_history.append(HumanMessage("什么是 Python？"))
 
-response = model.invoke(conversation_history)
+# 只转换新增的用户消息，回复会自动追加到对话历史中
+response = conversation_history.invoke(model)
 print(f"AI: {response.content}\n")
-conversation_history.append(response)
 
 # 第二轮对话 - 引用之前的上下文
 print("用户: 它的主要特点是什么？")
 conversation_history.append(HumanMessage("它的主要特点是什么？"))
 
-response = model.invoke(conversation_history)
+response = conversation_history.invoke(model)
 print(f"AI: {response.content}\n")
-conversation_history.append(response)
 
 # 第三轮对话 - 继续引用上下文
 print("用户: 给我一个简单的代码示例")
 conversation_history.append(HumanMessage("给我一个简单的代码示例"))
 
-response = model.invoke(conversation_history)
+response = conversation_history.invoke(model)
 print(f"AI: {response.content}\n")
-conversation_history.append(response)
 
 # 显示完整对话历史
 print("\n完整对话历史:")
@@ -56,4 +55,6 @@ for i, msg in enumerate(conversation_history, 1):
     print(f"{i}. {role}: {content}")
 
 print(f"\n对话历史中共有 {len(conversation_history)} 条消息")
+print(f"预算窗口内有 {len(conversation_history.window_messages())} 条消息，"
+      f"约 {conversation_history.window_tokens} 个 token，丢弃了 {conversation_history.dropped_turns} 轮")
 
@@ -1,20 +1,16 @@
 """
 人类消息示例
 """
-from langchain.chat_models import init_chat_model
+import sys
+from pathlib import Path
+
 from langchain_core.messages import HumanMessage
-import os
-from dotenv import load_dotenv
 
-load_dotenv()
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.model_factory import get_chat_model
 
-# 初始化模型
-model = init_chat_model(
-    model="qwen-plus",
-    model_provider="openai",
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    api_key=os.getenv("DASHSCOPE_API_KEY"),
-)
+# 获取共享的模型实例（复用连接池）
+model = get_chat_model()
 
 print("1. 文本内容 - 消息对象")
 response = model.invoke([
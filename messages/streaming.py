@@ -1,19 +1,16 @@
 """
 流式传输和消息块示例
 """
-from langchain.chat_models import init_chat_model
-import os
-from dotenv import load_dotenv
+import sys
+from pathlib import Path
 
-load_dotenv()
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.model_factory import get_chat_model
+from common.stream_accumulator import StreamAccumulator
+from common.stream_coalescer import coalesce
 
-# 初始化模型
-model = init_chat_model(
-    model="qwen-plus",
-    model_provider="openai",
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    api_key=os.getenv("DASHSCOPE_API_KEY"),
-)
+# 获取共享的模型实例（复用连接池）
+model = get_chat_model()
 
 
 print("1. 基本流式传输:")
@@ -23,17 +20,21 @@ for chunk in model.stream("用一句话介绍机器学习"):
 print("\n")
 
 print("2. 收集所有块:")
-chunks = []
+# 累积器默认不保留块对象，每个块处理完即可被回收（需要保留时可传 keep_chunks=True）
+acc = StreamAccumulator()
+first_content = None
 for chunk in model.stream("什么是深度学习？"):
-    chunks.append(chunk)
-print(f"   收到 {len(chunks)} 个块")
-print(f"   第一个块: {chunks[0].content if chunks else 'N/A'}")
+    if first_content is None:
+        first_content = chunk.content
+    acc.add(chunk)
+print(f"   收到 {acc.chunk_count} 个块")
+print(f"   第一个块: {first_content if first_content is not None else 'N/A'}")
 print()
 
 print("3. 累积完整消息:")
-full_message = None
-for chunk in model.stream("解释神经网络"):
-    full_message = chunk if full_message is None else full_message + chunk
+# 不使用 full_message + chunk 逐块相加（每次都会复制已累积内容，O(n²)），
+# 而是由 StreamAccumulator 收集增量，最后一次性构造 AIMessage
+full_message = StreamAccumulator().consume(model.stream("解释神经网络"))
 
 print(f"   完整消息类型: {type(full_message)}")
 print(f"   完整消息内容: {full_message.content}")
@@ -47,3 +48,13 @@ for chunk in model.stream("写一首关于春天的短诗"):
     chunk_count += 1
 print(f"\n   (共 {chunk_count} 个块)")
 
+print("5. 合并增量后再输出:")
+# 逐块 print(..., flush=True) 每个 token 一次系统调用；coalesce 把 30ms 内到达的块合并成一帧，
+# 第一个 token 和结束时立即输出，首 token 延迟不变。服务端推送 websocket 帧时同理（异步流用 acoalesce）
+print("AI: ", end="", flush=True)
+frame_count = 0
+for frame in coalesce(model.stream("写一首关于秋天的短诗"), interval=0.03):
+    print(frame.content, end="", flush=True)
+    frame_count += 1
+print(f"\n   (共 {frame_count} 帧)")
+
@@ -1,19 +1,19 @@
 """
 Token 使用量示例
+
+调用前先用离线估算器预估输入 token 数，再与返回的 usage_metadata 对比。
 """
-from langchain.chat_models import init_chat_model
-import os
-from dotenv import load_dotenv
+import sys
+from pathlib import Path
 
-load_dotenv()
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.model_factory import get_chat_model
+from common.token_estimator import TokenEstimator
 
-# 初始化模型
-model = init_chat_model(
-    model="qwen-plus",
-    model_provider="openai",
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    api_key=os.getenv("DASHSCOPE_API_KEY"),
-)
+# 获取共享的模型实例（复用连接池）
+model = get_chat_model()
+# 离线 token 估算器，不需要网络
+estimator = TokenEstimator()
 
 print("Token 使用量示例\n")
 
@@ -21,6 +21,7 @@ print("Token 使用量示例\n")
 print("1. 简短消息的 token 使用量:")
 response = model.invoke("你好！")
 print(f"   输入内容: 你好！")
+print(f"   预估输入 tokens: {estimator.estimate('你好！')}")
 if response.usage_metadata:
     print(f"   输入 tokens: {response.usage_metadata.get('input_tokens', 0)}")
     print(f"   输出 tokens: {response.usage_metadata.get('output_tokens', 0)}")
@@ -32,6 +33,7 @@ print("2. 较长消息的 token 使用量:")
 long_message = "请详细解释什么是机器学习，包括它的定义、主要应用领域和常见算法。"
 response = model.invoke(long_message)
 print(f"   输入内容: {long_message}")
+print(f"   预估输入 tokens: {estimator.estimate(long_message)}")
 if response.usage_metadata:
     print(f"   输入 tokens: {response.usage_metadata.get('input_tokens', 0)}")
     print(f"   输出 tokens: {response.usage_metadata.get('output_tokens', 0)}")
@@ -46,6 +48,7 @@ messages = [
     {"role": "assistant", "content": "Python 是一种高级编程语言。"},
     {"role": "user", "content": "它有什么特点？"}
 ]
+print(f"   预估输入 tokens: {estimator.estimate(messages)}")
 response = model.invoke(messages)
 if response.usage_metadata:
     print(f"   输入 tokens (包含对话历史): {response.usage_metadata.get('input_tokens', 0)}")
@@ -1,19 +1,23 @@
 """
 工具调用示例
+
+模型一次返回多个工具调用时，用 ToolExecutor 并发执行，总耗时约等于最慢的那个工具。
+流式输出时还可以用 stream_with_tools 在每个调用的参数一完整就开始执行，与模型生成后续调用重叠。
+工具用 ToolCache 包装后，相同参数的重复调用直接返回缓存的结果。
+ToolRegistry 只生成一次工具 schema，之后每次绑定都复用。
 """
-from langchain.chat_models import init_chat_model
-import os
-from dotenv import load_dotenv
+import sys
+from pathlib import Path
 
-load_dotenv()
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.model_factory import get_chat_model
+from common.streaming_tools import stream_with_tools
+from common.tool_cache import ToolCache
+from common.tool_executor import ToolExecutor
+from common.tool_registry import ToolRegistry
 
-# 初始化模型
-model = init_chat_model(
-    model="qwen-plus",
-    model_provider="openai",
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    api_key=os.getenv("DASHSCOPE_API_KEY"),
-)
+# 获取共享的模型实例（复用连接池）
+model = get_chat_model()
 
 def get_weather(location: str) -> str:
     """获取某个位置的天气。"""
@@ -26,9 +30,15 @@ def get_weather(location: str) -> str:
     }
     return weather_data.get(location, f"{location}的天气未知")
 
+# 天气结果缓存 10 分钟，同名同参数的调用不再重复执行
+tool_cache = ToolCache(maxsize=256)
+weather_tool = tool_cache.wrap(get_weather, ttl=600)
+# 工具 schema 只生成一次，所有绑定模型共用
+tool_registry = ToolRegistry([weather_tool])
+
 print("工具调用示例")
-model_with_tools = model.bind_tools([get_weather])
-response = model_with_tools.invoke("北京的天气怎么样？")
+model_with_tools = tool_registry.bind_tools(model)
+response = model_with_tools.invoke("北京和上海的天气怎么样？")
 
 print("模型响应:")
 print(f"内容: {response.content}")
@@ -41,12 +51,23 @@ if response.tool_calls:
         print(f"  参数: {tool_call['args']}")
         print(f"  ID: {tool_call['id']}")
         print()
-        
-        # 执行工具调用
-        if tool_call['name'] == 'get_weather':
-            location = tool_call['args'].get('location', '')
-            result = get_weather(location)
-            print(f"  工具执行结果: {result}")
+
+    # 并发执行所有工具调用，结果与 tool_calls 的顺序一致
+    with ToolExecutor([weather_tool], timeout=10) as executor:
+        tool_messages = executor.run(response)
+    for tool_message in tool_messages:
+        print(f"  工具执行结果 ({tool_message.tool_call_id}): {tool_message.content}")
 else:
     print("没有工具调用")
 
+print("\n流式工具调用（参数完整的调用立即执行）")
+with ToolExecutor([weather_tool], timeout=10) as executor:
+    messages = stream_with_tools(model_with_tools, "北京和上海的天气怎么样？", executor)
+for message in messages[1:-1]:
+    if message.type == "tool":
+        print(f"  工具执行结果 ({message.tool_call_id}): {message.content}")
+print(f"最终回答: {messages[-1].content}")
+
+stats = tool_cache.stats
+print(f"\n工具缓存: 命中 {stats.hits} 次，未命中 {stats.misses} 次，命中率 {stats.hit_rate:.0%}")
+
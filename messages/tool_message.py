@@ -1,20 +1,19 @@
 """
 工具消息示例 - 完整的工具调用流程
 """
-from langchain.chat_models import init_chat_model
+import sys
+from pathlib import Path
+
 from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
-import os
-from dotenv import load_dotenv
+from langchain_core.tools import tool
 
-load_dotenv()
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.model_factory import get_chat_model
+from common.tool_cache import ToolCache
+from common.tool_executor import ToolExecutor
 
-# 初始化模型
-model = init_chat_model(
-    model="qwen-plus",
-    model_provider="openai",
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    api_key=os.getenv("DASHSCOPE_API_KEY"),
-)
+# 获取共享的模型实例（复用连接池）
+model = get_chat_model()
 
 print("完整的工具调用流程\n")
 
@@ -28,7 +27,7 @@ def get_weather(location: str) -> str:
     return weather_data.get(location, f"{location}的天气未知")
 
 # 步骤1: 用户提问
-user_question = "北京的天气怎么样？"
+user_question = "北京和上海的天气怎么样？"
 print(f"用户: {user_question}\n")
 
 # 步骤2: 绑定工具并调用模型
@@ -37,27 +36,22 @@ response = model_with_tools.invoke(user_question)
 
 # 步骤3: 检查是否有工具调用
 if response.tool_calls:
-    tool_call = response.tool_calls[0]
-    print(f"模型决定调用工具: {tool_call['name']}")
-    print(f"工具参数: {tool_call['args']}\n")
-    
-    # 步骤4: 执行工具
-    location = tool_call['args'].get('location', '')
-    weather_result = get_weather(location)
-    print(f"工具执行结果: {weather_result}\n")
-    
-    # 步骤5: 创建工具消息
-    tool_message = ToolMessage(
-        content=weather_result,
-        tool_call_id=tool_call['id'],
-        name="get_weather"
-    )
-    
-    # 步骤6: 将工具结果返回给模型
+    for tool_call in response.tool_calls:
+        print(f"模型决定调用工具: {tool_call['name']}，参数: {tool_call['args']}")
+    print()
+
+    # 步骤4-5: 并发执行所有工具，得到与 tool_calls 一一对应的工具消息（tool_call_id 相同）
+    with ToolExecutor([get_weather], timeout=10) as executor:
+        tool_messages = executor.run(response)
+    for tool_message in tool_messages:
+        print(f"工具执行结果 ({tool_message.tool_call_id}): {tool_message.content}")
+    print()
+
+    # 步骤6: 将所有工具结果一次性返回给模型
     messages = [
         HumanMessage(user_question),
         response,  # 包含工具调用的 AI 消息
-        tool_message,  # 工具执行结果
+        *tool_messages,  # 工具执行结果，顺序与 tool_calls 一致
     ]
     
     final_response = model.invoke(messages)
@@ -87,3 +81,19 @@ print(f"  - 文档ID: {tool_message.artifact['document_id']}")
 print(f"  - 页码: {tool_message.artifact['page']}")
 print(f"  - 来源: {tool_message.artifact['source']}")
 
+print("\n缓存的工具同样保留 artifact\n")
+
+tool_cache = ToolCache(maxsize=256)
+
+@tool_cache.cached(ttl=3600)
+@tool(response_format="content_and_artifact")
+def search_books(query: str) -> tuple[str, dict]:
+    """在书库中搜索句子。"""
+    return message_content, artifact
+
+search_call = {"name": "search_books", "args": {"query": "最好的时代"}, "type": "tool_call"}
+for call_id in ("call_456", "call_789"):
+    cached_message = search_books.invoke({**search_call, "id": call_id})
+    print(f"{cached_message.tool_call_id}: {cached_message.content} / {cached_message.artifact}")
+print(f"缓存统计: {tool_cache.stats}")
+
@@ -1,28 +1,65 @@
 """
 演示 model.batch() 批处理的用法
 """
-from langchain.chat_models import init_chat_model
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-# 初始化模型
-model = init_chat_model(
-    model="qwen-plus",
-    model_provider="openai",
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    api_key=os.getenv("DASHSCOPE_API_KEY"),
-)
+import asyncio
+import sys
+from pathlib import Path
 
-# 批量处理
-responses = model.batch([
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.adaptive_limiter import AdaptiveLimiter, RateLimitedChatModel
+from common.batch_engine import abatch_as_completed, batch
+from common.model_factory import get_chat_model
+
+# 获取共享的模型实例（复用连接池）
+model = get_chat_model()
+
+questions = [
     "为什么鹦鹉有五颜六色的羽毛？",
     "飞机是如何飞行的？",
     "什么是量子计算？"
-])
+]
+
+# 批量处理
+responses = model.batch(questions)
 
 for i, response in enumerate(responses, 1):
     print(f"\n问题 {i} 的回答:")
     print(response.content)
 
+# 异步批处理引擎：限制最大并发数，结果按输入顺序返回（与 model.batch 一致）
+responses = batch(
+    model,
+    questions,
+    max_concurrency=8,
+    on_progress=lambda done, total: print(f"\r进度: {done}/{total}", end="", flush=True),
+)
+print()
+
+
+# 按完成顺序处理结果，先完成的先输出，index 为问题在输入中的下标
+async def print_as_completed():
+    async for index, response in abatch_as_completed(model, questions, max_concurrency=8):
+        print(f"\n问题 {index + 1} 已完成: {questions[index]}")
+        print(response.content)
+
+asyncio.run(print_as_completed())
+
+
+# 自适应并发：不再猜一个固定的 max_concurrency。限制器根据 429 和延迟增减并发数，
+# 遵守 Retry-After，并按账号的 RPM/TPM 配额平摊发送（数值请按实际配额填写）
+# 收到 429 时由 RateLimitedChatModel 重试，被包装的模型关闭 openai 客户端自身的重试
+limiter = AdaptiveLimiter(requests_per_minute=600, tokens_per_minute=1_000_000)
+limited_model = RateLimitedChatModel(model=get_chat_model(max_retries=0), limiter=limiter)
+responses = limited_model.batch(questions, config={"max_concurrency": 64})
+print(f"\n限流统计: {limiter.stats}")
+
+# 数百万条提示的离线任务：用 common/bulk_pipeline.py 按分片在多个进程中处理，结果追加写入 JSONL，
+# 中断后重新运行同一命令会从检查点继续：
+#   python common/bulk_pipeline.py prompts.jsonl results.jsonl --workers 4 --concurrency 32
+
+# 不需要立即拿到结果时，可以改用 Batch API（common/batch_job.py）：按 token 计费更便宜，
+# 服务端在 24 小时内离线处理。保存任务 ID 后进程可以退出，之后用 BatchJob.resume 继续：
+#   job = BatchJob.submit(model, questions)
+#   print(job.id)
+#   job = BatchJob.resume(model, job_id)
+#   responses = job.collect()          # 等待完成，按输入顺序返回带 usage_metadata 的 AIMessage
@@ -1,19 +1,21 @@
 """
 演示 model.invoke() 的基本用法
 """
-from langchain.chat_models import init_chat_model
-import os
-from dotenv import load_dotenv
+import sys
+from pathlib import Path
 
-load_dotenv()
+from langchain_core.globals import set_llm_cache
 
-# 初始化模型
-model = init_chat_model(
-    model="qwen-plus",
-    model_provider="openai",
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    api_key=os.getenv("DASHSCOPE_API_KEY"),
-)
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.model_factory import get_chat_model
+from common.response_cache import DEFAULT_CACHE_PATH, ResponseCache
+
+# 获取共享的模型实例（复用连接池）
+model = get_chat_model()
+
+# 启用响应缓存：重复运行时相同的提问直接从本地缓存返回，不再重复付费调用
+cache = ResponseCache(ttl=24 * 3600, sqlite_path=DEFAULT_CACHE_PATH)
+set_llm_cache(cache)
 
 # 简单调用
 response = model.invoke("为什么鹦鹉有五颜六色的羽毛？")
@@ -29,4 +31,5 @@ conversation = [
 
 response = model.invoke(conversation)
 print(response.content)
+print(f"\n缓存统计: 命中 {cache.stats.hits} 次，未命中 {cache.stats.misses} 次")
 
@@ -1,19 +1,17 @@
 """
 演示 model.stream() 流式传输的用法
 """
-from langchain.chat_models import init_chat_model
-import os
-from dotenv import load_dotenv
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-load_dotenv()
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.model_factory import get_chat_model
+from common.singleflight import CoalescingChatModel
+from common.stream_accumulator import StreamAccumulator
 
-# 初始化模型
-model = init_chat_model(
-    model="qwen-plus",
-    model_provider="openai",
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    api_key=os.getenv("DASHSCOPE_API_KEY"),
-)
+# 获取共享的模型实例（复用连接池）
+model = get_chat_model()
 
 # 基本流式传输
 for chunk in model.stream("为什么鹦鹉有五颜六色的羽毛？"):
@@ -21,9 +19,26 @@ for chunk in model.stream("为什么鹦鹉有五颜六色的羽毛？"):
 print("\n")
 
 # 累积流式内容
-full = None  # None | AIMessageChunk
+# 注意：full = chunk if full is None else full + chunk 每次相加都会复制已累积的全部内容，
+# 长回复的开销是 O(n²)。StreamAccumulator 只追加增量，最后一次性构造 AIMessage
+acc = StreamAccumulator()
 for chunk in model.stream("天空是什么颜色？"):
-    full = chunk if full is None else full + chunk
+    acc.add(chunk)
+full = acc.message()
 
 #print(f"完整内容: {full.content}")
 
+
+# 合并相同的并发请求
+# 很多用户同时问同一个问题时，CoalescingChatModel 只发出一次上游请求，
+# 所有订阅者得到相同的块，晚加入的订阅者先补发已经收到的块，再跟随实时的流
+coalescing = CoalescingChatModel(model=model)
+
+
+def ask(question: str) -> str:
+    return "".join(chunk.text for chunk in coalescing.stream(question))
+
+
+with ThreadPoolExecutor(max_workers=8) as pool:
+    answers = list(pool.map(ask, ["天空是什么颜色？"] * 8))
+print(f"8 个相同的流式请求，上游请求 {coalescing.stats.upstream_calls} 次，省下 {coalescing.stats.saved} 次")
@@ -1,20 +1,19 @@
 """
 演示结构化输出的用法
 """
-from langchain.chat_models import init_chat_model
+import sys
+from pathlib import Path
+
 from pydantic import BaseModel, Field
-import os
-from dotenv import load_dotenv
 
-load_dotenv()
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.model_factory import get_chat_model
+from common.request_packing import PackedExtractor
+from common.structured_repair import RepairingStructuredOutput
+from common.structured_stream import stream_structured
 
-# 初始化模型
-model = init_chat_model(
-    model="qwen-plus",
-    model_provider="openai",
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    api_key=os.getenv("DASHSCOPE_API_KEY"),
-)
+# 获取共享的模型实例（复用连接池）
+model = get_chat_model()
 
 # 定义数据结构
 class Movie(BaseModel):
@@ -53,3 +52,33 @@ print()
 if response_with_raw['raw'].usage_metadata:
     print(f"Token 使用信息: {response_with_raw['raw'].usage_metadata}")
 
+# 流式结构化输出：字段一完整就可以显示，不必等整个 JSON 返回
+print()
+print("=== 流式结构化输出 ===")
+for update in stream_structured(
+    model, Movie, "请以 JSON 格式提供电影《泰坦尼克号》的详细信息，包括标题、年份、导演和评分"
+):
+    for path, value in update.fields:
+        if len(path) == 1:
+            print(f"  收到字段 {path[0]}: {value}")
+movie = update.final  # 最后一次更新是完整校验后的 Movie
+print(f"完整结果: {movie}")
+
+# 批量抽取：多部电影打包进一次请求，按编号拆回，无效的条目单独重试
+print()
+print("=== 打包批量抽取 ===")
+extractor = PackedExtractor(
+    model, Movie, instructions="根据电影名称，以 JSON 格式提供电影的详细信息，包括标题、年份、导演和评分。"
+)
+titles = ["盗梦空间", "星际穿越", "泰坦尼克号", "肖申克的救赎"]
+for title, movie in zip(titles, extractor.extract(titles)):
+    print(f"  {title}: {movie}")
+print(f"请求数: {extractor.stats.requests}，平均每部电影 {extractor.stats.tokens_per_record:.0f} tokens")
+
+# 本地修复：代码块、前后文字、单引号、"2010年" 这类格式问题在本地修好，修不了时只发送输出和校验错误
+print()
+print("=== 带本地修复的结构化输出 ===")
+repairing = RepairingStructuredOutput(model, Movie)
+result = repairing.invoke("请以 JSON 格式提供电影《肖申克的救赎》的详细信息")
+print(f"解析结果: {result['parsed']}（修复方式: {result['repair']}）")
+print(f"统计: {repairing.stats}")
@@ -1,20 +1,18 @@
 """
 演示 Token 使用量跟踪
 """
-from langchain.chat_models import init_chat_model
+import sys
+from pathlib import Path
+
 from langchain_core.callbacks import UsageMetadataCallbackHandler, get_usage_metadata_callback
-import os
-from dotenv import load_dotenv
 
-load_dotenv()
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 项目根目录，用于导入 common
+from common.model_factory import get_chat_model
+from common.token_estimator import UsageRecorder
+from common.usage_metrics import UsageMetrics
 
-# 初始化模型
-model = init_chat_model(
-    model="qwen-plus",
-    model_provider="openai",
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    api_key=os.getenv("DASHSCOPE_API_KEY"),
-)
+# 获取共享的模型实例（复用连接池）
+model = get_chat_model()
 
 # 方法1: 使用回调处理器
 callback = UsageMetadataCallbackHandler()
@@ -28,4 +26,23 @@ with get_usage_metadata_callback() as cb:
     model.invoke("你好")
     model.invoke("再见")
     print(f"总计 Token 使用情况: {cb.usage_metadata}")
+print()
+
+# 方法3: 记录每次调用的输入和真实 token 数，用于校准离线估算器
+# 积累一定数量后运行: python common/token_estimator.py calibrate .cache/usage.jsonl --output .cache/token_weights.json
+recorder = UsageRecorder()
+model.invoke("用一句话介绍 LangChain。", config={"callbacks": [recorder]})
+print(f"调用记录已追加到 {recorder.path}")
+print()
+
+# 方法4: 按模型和路由聚合 token、延迟、TTFT 等指标，可导出为 Prometheus 文本格式或 JSON
+metrics = UsageMetrics()
+callback = metrics.callback(route="demo")
+model.invoke("你好", config={"callbacks": [callback]})
+for chunk in model.stream("介绍一下你自己", config={"callbacks": [callback], "metadata": {"route": "stream"}}):
+    pass
+for series in metrics.snapshot():
+    print(f"{series['model']} / {series['route']}: {series['requests']} 次调用, "
+          f"输入 {series['input_tokens']} tokens, 输出 {series['output_tokens']} tokens, "
+          f"延迟 p50 {series['latency']['p50']:.2f}s")
 